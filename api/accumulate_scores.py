@@ -0,0 +1,67 @@
+"""Add newly scored documents to the accumulators of the topic frequency and sentiment served by the api.
+
+The inputs are the parts written by ``bulk_score.py``. Parts already accumulated are skipped, so the same folder
+can be passed again after scoring more filings. The first run initializes the accumulators from the current
+``topics_overtime`` and ``topics_and_docs_sentiment`` assets. Parts those assets were built from, when they were
+published by ``bulk_score.py``, are counted as accumulated and skipped.
+
+A running api reloads the new accumulators without a restart. Run from the api folder:
+
+    python accumulate_scores.py bulk_scoring/parts/*.parquet
+"""
+import argparse
+import os
+from typing import List, Tuple
+
+import pyarrow.parquet as pq
+
+from accumulators import accumulate, empty_state, load_states, merge, save_states, states_from_assets
+from aggregates import load_section_frames
+from bulk_score import published_parts
+
+
+def accumulate_parts(parts: List[str], assets_path: str) -> Tuple[str, int]:
+    """Add the parts not accumulated yet to the accumulators of ``assets_path``.
+
+    Returns
+    -------
+    tuple of (str, int)
+        Current version of the accumulators and number of parts added.
+
+    """
+    folder = os.path.join(assets_path, 'accumulators')
+    version, states, applied = load_states(folder)
+    if version is None:
+        print('Initializing the accumulators from the assets')
+        states = states_from_assets(load_section_frames(assets_path, 'topics_overtime'),
+                                    load_section_frames(assets_path, 'topics_and_docs_sentiment'))
+        # The documents of these parts are already counted in the assets
+        applied = published_parts(assets_path)
+    n_parts = 0
+    for path in parts:
+        part_id = os.path.basename(path)
+        if part_id in applied:
+            continue
+        table = pq.read_table(path)
+        columns = [c for c in ['Section', 'Topic', 'Timestamp', 'sentiment_sigma_fsa'] if c in table.column_names]
+        docs = table.select(columns).to_pandas()
+        for s, section_docs in docs.groupby('Section'):
+            states[s] = merge(states.get(s, empty_state()), accumulate(section_docs))
+        applied.add(part_id)
+        n_parts += 1
+    if n_parts or version is None:
+        version = save_states(folder, states, applied)
+    return version, n_parts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('parts', nargs='+', help='Parquet parts written by bulk_score.py')
+    parser.add_argument('--assets-path', default='assets')
+    args = parser.parse_args()
+    version, n_parts = accumulate_parts(args.parts, args.assets_path)
+    print(f'{n_parts} new parts accumulated, current version {version}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Mergeable per (topic, period) accumulators of the topic frequency and sentiment, updated as documents are scored.
+
+Every section is a frame indexed by (Topic, Timestamp), the timestamp being the start of a ``BASE_FREQ`` period,
+holding the number of chunks, the number and sum of their sentiments and a fixed histogram of the sentiments. All
+the columns add up, so new documents are accumulated by summing their rows into the state, and any coarser
+frequency is aggregated by summing the rows of its periods. Medians are interpolated in the merged histograms.
+
+States are saved as numbered versions in a folder, with a ``CURRENT`` file naming the last complete one, so a
+running api reloads the new state at once and never reads a partially written one.
+"""
+import json
+import os
+import shutil
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from aggregates import SentimentStore
+from columnar import SectionFrames, prepare_frame
+
+# Finest period of the accumulators, every frequency the api aggregates over is a multiple of it
+BASE_FREQ = 'D'
+# Sentiments are in [-1, 1], 128 bins bound the error of the interpolated median to the bin width of 1/64
+SENTIMENT_EDGES = np.linspace(-1.0, 1.0, 129)
+HISTOGRAM_COLUMNS = [f'h{i:03d}' for i in range(len(SENTIMENT_EDGES) - 1)]
+SUM_COLUMNS = ['Frequency', 'n_sentiment', 'sentiment_sum'] + HISTOGRAM_COLUMNS
+
+
+def empty_state() -> pd.DataFrame:
+    index = pd.MultiIndex.from_arrays([pd.Series([], dtype=np.int64), pd.Series([], dtype='datetime64[ns]')],
+                                      names=['Topic', 'Timestamp'])
+    return pd.DataFrame({c: pd.Series([], dtype=np.float64 if c == 'sentiment_sum' else np.int64)
+                         for c in SUM_COLUMNS}, index=index)
+
+
+def accumulate(docs: pd.DataFrame, frequency: Optional[pd.Series] = None) -> pd.DataFrame:
+    """Accumulate scored documents per (Topic, period).
+
+    Parameters
+    ----------
+    docs : pd.DataFrame
+        A row per document or chunk with its ``Topic``, ``Timestamp`` and optionally its ``sentiment_sigma_fsa``.
+    frequency : pd.Series, optional
+        Number of documents of every row, 1 by default.
+
+    Returns
+    -------
+    pd.DataFrame
+        Accumulators indexed by (Topic, Timestamp).
+
+    """
+    keys = pd.DataFrame({'Topic': docs['Topic'].astype(np.int64).to_numpy(),
+                         'Timestamp': pd.to_datetime(docs['Timestamp']).dt.floor(BASE_FREQ).to_numpy()})
+    state = keys.assign(Frequency=1 if frequency is None else frequency.to_numpy()).groupby(
+        ['Topic', 'Timestamp']).sum()
+    if 'sentiment_sigma_fsa' in docs.columns:
+        sentiment = docs['sentiment_sigma_fsa'].to_numpy(dtype=np.float64)
+        has_sentiment = ~np.isnan(sentiment)
+        scored = keys.loc[has_sentiment].assign(sentiment_sum=sentiment[has_sentiment], n_sentiment=1)
+        bins = np.clip(np.searchsorted(SENTIMENT_EDGES, sentiment[has_sentiment], side='right') - 1,
+                       0, len(HISTOGRAM_COLUMNS) - 1)
+        histogram = scored.assign(bin=bins).groupby(['Topic', 'Timestamp', 'bin']).size().unstack(fill_value=0)
+        histogram = histogram.reindex(columns=range(len(HISTOGRAM_COLUMNS)), fill_value=0)
+        histogram.columns = HISTOGRAM_COLUMNS
+        state = state.join(scored.groupby(['Topic', 'Timestamp'])[['n_sentiment', 'sentiment_sum']].sum(),
+                           how='outer').join(histogram, how='outer')
+    return merge(state)
+
+
+def merge(*states: pd.DataFrame) -> pd.DataFrame:
+    """Sum accumulator states, row by row of the same (Topic, Timestamp)."""
+    state = pd.concat([empty_state(), *states]).fillna(0)
+    state = state.groupby(level=['Topic', 'Timestamp']).sum()
+    return state.astype({c: np.float64 if c == 'sentiment_sum' else np.int64 for c in SUM_COLUMNS})
+
+
+def states_from_assets(topics_time: SectionFrames, sentiment: SectionFrames) -> Dict[str, pd.DataFrame]:
+    """Initial accumulators of the topics_overtime and topics_and_docs_sentiment assets.
+
+    The frequencies come from the topics over time, the sentiment from the documents.
+    """
+    states = {}
+    for s in dict.fromkeys(list(topics_time) + list(sentiment)):
+        parts = []
+        if s in topics_time:
+            df = topics_time.load(s, ['Topic', 'Timestamp', 'Frequency'])
+            parts.append(accumulate(df[['Topic', 'Timestamp']], frequency=df['Frequency']))
+        if s in sentiment:
+            parts.append(accumulate(sentiment.load(s, ['Topic', 'Timestamp', 'sentiment_sigma_fsa'])).assign(
+                Frequency=0))
+        states[s] = merge(*parts)
+    return states
+
+
+def histogram_quantile(histogram: np.ndarray, q: float) -> np.ndarray:
+    """Quantile ``q`` of every row of a sentiment histogram, interpolated linearly within its bin. NaN if empty."""
+    cumulative = np.cumsum(histogram, axis=1)
+    total = cumulative[:, -1]
+    target = q * total
+    bins = np.minimum((cumulative < target[:, None]).sum(axis=1), histogram.shape[1] - 1)
+    rows = np.arange(histogram.shape[0])
+    below = np.where(bins > 0, cumulative[rows, np.maximum(bins - 1, 0)], 0)
+    in_bin = histogram[rows, bins]
+    fraction = np.divide(target - below, in_bin, out=np.full(len(rows), 0.5), where=in_bin > 0)
+    width = np.diff(SENTIMENT_EDGES)
+    quantile = SENTIMENT_EDGES[bins] + fraction * width[bins]
+    return np.where(total > 0, quantile, np.nan)
+
+
+def topics_time_frames(states: Dict[str, pd.DataFrame], topic_words: Dict[str, Dict[int, str]],
+                       topic_names: Dict[str, Dict[int, str]], assets: Optional[SectionFrames] = None) -> SectionFrames:
+    """Topic frequency of every period with documents, in the layout of the topics_overtime asset.
+
+    The rows of the ``assets`` are kept, with the words and timestamps of their periods, and the frequency
+    accumulated since is added to the first row of its topic and day. The accumulated frequency of the other days is
+    appended as a row per topic and day, with the words of the whole topic.
+    """
+    frames = {}
+    for s, state in states.items():
+        frequency = state['Frequency']
+        parts = []
+        if assets is not None and s in assets:
+            asset = assets.load(s).copy()
+            keys = pd.MultiIndex.from_arrays([asset['Topic'].astype(np.int64).to_numpy(),
+                                              asset['Timestamp'].dt.floor(BASE_FREQ).to_numpy()],
+                                             names=['Topic', 'Timestamp'])
+            # The asset frequency per (Topic, day), as counted by states_from_assets
+            asset_frequency = pd.Series(asset['Frequency'].to_numpy(), index=keys).groupby(level=keys.names).sum()
+            added = frequency.sub(asset_frequency, fill_value=0)
+            added = added.loc[added > 0].astype(np.int64)
+            first = ~keys.duplicated()
+            asset.loc[first, 'Frequency'] += added.reindex(keys[first], fill_value=0).to_numpy()
+            parts.append(asset)
+            frequency = added.loc[~added.index.isin(keys)]
+        df = frequency.loc[frequency > 0].rename('Frequency').reset_index()
+        df['Words'] = df['Topic'].map(topic_words[s])
+        df['Name'] = df['Topic'].map(topic_names[s])
+        parts.append(df[['Topic', 'Words', 'Frequency', 'Timestamp', 'Name']])
+        frames[s] = prepare_frame(pd.concat(parts, ignore_index=True)[parts[0].columns])
+    return SectionFrames(frames)
+
+
+class AccumulatedSentimentStore(SentimentStore):
+    """Sentiment aggregated from the accumulators rather than from every document.
+
+    The documents are still served from ``frames``. Means are exact, medians are interpolated in the histograms.
+
+    Parameters
+    ----------
+    states : dict of {str : pd.DataFrame}
+        Accumulators of every section.
+    topic_names : dict of {str : dict of {int : str}}
+        Topic names of every section.
+    frames : SectionFrames
+        Documents of every section.
+    maxsize : int, optional
+        Maximum number of aggregated frequencies kept in the cache.
+
+    """
+
+    def __init__(self, states: Dict[str, pd.DataFrame], topic_names: Dict[str, Dict[int, str]],
+                 frames: SectionFrames, maxsize: int = 32):
+        super().__init__(frames, maxsize)
+        self.states = states
+        self.topic_names = topic_names
+
+    def _aggregate(self, freq: str) -> Dict[str, pd.DataFrame]:
+        agg_sentiment = {}
+        for s, state in self.states.items():
+            state = state.loc[state['n_sentiment'] > 0].reset_index()
+            agg = state.groupby(['Topic', pd.Grouper(key='Timestamp', freq=freq)], sort=True)[
+                ['n_sentiment', 'sentiment_sum'] + HISTOGRAM_COLUMNS].sum().reset_index()
+            agg = agg.loc[agg['n_sentiment'] > 0].copy()
+            agg['mean'] = agg['sentiment_sum'] / agg['n_sentiment']
+            agg['median'] = histogram_quantile(agg[HISTOGRAM_COLUMNS].to_numpy(), 0.5)
+            agg['Name'] = agg['Topic'].map(self.topic_names[s])
+            agg_sentiment[s] = agg[['Timestamp', 'Topic', 'Name', 'mean', 'median']].reset_index(drop=True)
+        return agg_sentiment
+
+
+def current_version(folder: str) -> Optional[str]:
+    """Name of the last complete version of the accumulators saved in ``folder``, None if there is none."""
+    try:
+        with open(os.path.join(folder, 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_states(folder: str) -> Tuple[Optional[str], Dict[str, pd.DataFrame], Set[str]]:
+    """Load the current accumulators of every section and the ids of the batches already accumulated."""
+    version = current_version(folder)
+    if version is None:
+        return None, {}, set()
+    path = os.path.join(folder, version)
+    states = {os.path.splitext(f)[0]: pq.read_table(os.path.join(path, f)).to_pandas().set_index(['Topic', 'Timestamp'])
+              for f in sorted(os.listdir(path)) if f.endswith('.parquet')}
+    with open(os.path.join(path, 'applied.json')) as f:
+        applied = set(json.load(f))
+    return version, states, applied
+
+
+def save_states(folder: str, states: Dict[str, pd.DataFrame], applied: Iterable[str], keep: int = 2) -> str:
+    """Save the accumulators as a new version and make it the current one.
+
+    The ``keep`` most recent versions are kept, so an api still reading the previous one is not disturbed.
+    """
+    os.makedirs(folder, exist_ok=True)
+    versions = sorted(v for v in os.listdir(folder) if v.startswith('v') and v[1:].isdigit())
+    version = f'v{int(versions[-1][1:]) + 1 if versions else 1:06d}'
+    path = os.path.join(folder, version)
+    os.makedirs(path)
+    for s, state in states.items():
+        pq.write_table(pa.Table.from_pandas(state.reset_index(), preserve_index=False),
+                       os.path.join(path, f'{s}.parquet'), compression='zstd')
+    with open(os.path.join(path, 'applied.json'), 'w') as f:
+        json.dump(sorted(applied), f)
+    tmp_path = os.path.join(folder, '.CURRENT.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(folder, 'CURRENT'))
+    for old in versions[:max(0, len(versions) + 1 - keep)]:
+        shutil.rmtree(os.path.join(folder, old), ignore_errors=True)
+    return version
@@ -0,0 +1,335 @@
+"""In-memory stores of the precomputed assets served by the API, with cached aggregations."""
+import base64
+import binascii
+import json
+import os
+from functools import lru_cache
+from io import StringIO
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from columnar import ParquetFrames, SectionFrames, prepare_frame
+
+# Frequencies requested by the dashboard, aggregated when the API starts
+COMMON_FREQUENCIES = ('1M', '3M', '1Y')
+# Number of rows serialized at a time when streaming a frame
+STREAM_CHUNK_SIZE = 5000
+
+
+def select_records(df: pd.DataFrame, topic: Optional[int] = None, start: Optional[str] = None,
+                   end: Optional[str] = None) -> pd.DataFrame:
+    """Return the rows of a frame sorted by (Topic, Timestamp) for a topic and a time range.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Frame with a ``Topic`` and a datetime ``Timestamp`` column, sorted by both.
+    topic : int, optional
+        Only keep this topic.
+    start, end : str, optional
+        Only keep timestamps in [start, end].
+
+    Returns
+    -------
+    pd.DataFrame
+        A view of the selected rows.
+
+    """
+    if topic is not None:
+        # The frame is sorted by topic, so the rows of a topic are a contiguous slice
+        df = df.iloc[df['Topic'].searchsorted(topic, side='left'):df['Topic'].searchsorted(topic, side='right')]
+    if start is not None or end is not None:
+        timestamps = df['Timestamp']
+        mask = np.ones(len(df), dtype=bool)
+        if start is not None:
+            mask &= (timestamps >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (timestamps <= pd.Timestamp(end)).to_numpy()
+        df = df.loc[mask]
+    return df
+
+
+def encode_cursor(df: pd.DataFrame, row: int) -> str:
+    """Opaque cursor of the rows after ``row`` of a frame sorted by (Topic, Timestamp).
+
+    The cursor holds the key of the row and the number of rows with that key up to it, rather than its index, so it
+    still points after the same row when the frame is replaced by one with rows added before it.
+    """
+    topic, timestamp = int(df['Topic'].iat[row]), df['Timestamp'].iat[row]
+    first = _key_bounds(df, topic, timestamp)[0]
+    key = [topic, int(timestamp.value), int(row - first + 1)]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[int, pd.Timestamp, int]:
+    """Return the topic, timestamp and number of rows seen with them of a cursor, or raise ValueError."""
+    try:
+        topic, timestamp, seen = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(topic), pd.Timestamp(int(timestamp)), int(seen)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f'Invalid cursor {cursor}')
+
+
+def _key_bounds(df: pd.DataFrame, topic: int, timestamp: pd.Timestamp) -> Tuple[int, int]:
+    """Rows of a frame sorted by (Topic, Timestamp) with this topic and timestamp, as a [first, last) range."""
+    lo, hi = df['Topic'].searchsorted(topic, side='left'), df['Topic'].searchsorted(topic, side='right')
+    timestamps = df['Timestamp'].iloc[lo:hi]
+    return lo + timestamps.searchsorted(timestamp, side='left'), lo + timestamps.searchsorted(timestamp, side='right')
+
+
+def page_records(df: pd.DataFrame, topic: Optional[int] = None, start: Optional[str] = None,
+                 end: Optional[str] = None, cursor: Optional[str] = None,
+                 limit: int = 1000) -> Tuple[pd.DataFrame, Optional[str]]:
+    """Return a page of the rows selected as ``select_records`` and the cursor of the next page.
+
+    The page starts after the row of the cursor, found by binary search, and only the rows up to the end of the page
+    are filtered by time, so the cost of a page does not grow with the number of pages before it.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Frame with a ``Topic`` and a datetime ``Timestamp`` column, sorted by both.
+    topic : int, optional
+        Only keep this topic.
+    start, end : str, optional
+        Only keep timestamps in [start, end].
+    cursor : str, optional
+        Cursor returned with the previous page. The first page is returned by default.
+    limit : int, optional
+        Maximum number of rows of the page.
+
+    Returns
+    -------
+    tuple of (pd.DataFrame, str or None)
+        Rows of the page and cursor of the next page, None for the last page.
+
+    Raises
+    ------
+    ValueError
+        If the cursor is invalid.
+
+    """
+    df = select_records(df, topic)
+    position = 0
+    if cursor is not None:
+        cursor_topic, cursor_timestamp, seen = decode_cursor(cursor)
+        first, last = _key_bounds(df, cursor_topic, cursor_timestamp)
+        position = min(first + seen, last)
+    timestamps = df['Timestamp']
+    rows, found = [], 0
+    # One more row than the page is looked for, to know whether there is a next page
+    while position < len(df) and found <= limit:
+        stop = min(position + max(limit + 1, STREAM_CHUNK_SIZE), len(df))
+        block_timestamps = timestamps.iloc[position:stop]
+        mask = np.ones(stop - position, dtype=bool)
+        if start is not None:
+            mask &= (block_timestamps >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (block_timestamps <= pd.Timestamp(end)).to_numpy()
+        block = np.arange(position, stop)[mask]
+        rows.append(block)
+        found += len(block)
+        position = stop
+    rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    next_cursor = encode_cursor(df, rows[limit - 1]) if len(rows) > limit else None
+    return df.iloc[rows[:limit]], next_cursor
+
+
+def iter_json_lines(frames: Dict[str, pd.DataFrame], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """Yield the rows of every frame as newline delimited JSON, tagged with their section.
+
+    Rows are serialized ``chunk_size`` at a time, so the whole payload is never held in memory.
+    """
+    for s, df in frames.items():
+        for i in range(0, len(df), chunk_size):
+            lines = df.iloc[i:i + chunk_size].assign(Section=s).to_json(orient='records', lines=True)
+            yield lines.rstrip('\n') + '\n'
+
+
+def select_topics(df: pd.DataFrame, top_n: Optional[int] = None, outliers: bool = True) -> pd.DataFrame:
+    """Keep the topics below ``top_n``, all of them by default, and the outliers of topic -1 if ``outliers``."""
+    if top_n:
+        df = df.loc[df['Topic'] < top_n]
+    if not outliers:
+        df = df.loc[df['Topic'] != -1]
+    return df
+
+
+def plot_series(df: pd.DataFrame, columns: List[str], categorical: Iterable[str] = (),
+                precision: Optional[int] = None) -> str:
+    """Serialize a section frame in a compact form, ready to plot.
+
+    Every column is a list, timestamps are dates, the name of every topic is sent once, and the values of the
+    ``categorical`` columns are codes into a list of their distinct values.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Frame with ``Topic``, ``Name`` and ``Timestamp`` columns.
+    columns : list of str
+        Value columns sent along the timestamps and topics.
+    categorical : iterable of str, optional
+        Columns among ``columns`` sent as codes.
+    precision : int, optional
+        Number of decimals the float columns are rounded to.
+
+    Returns
+    -------
+    str
+        JSON object with the ``names`` of the topics, the ``categories`` of the categorical columns and the
+        ``data`` lists.
+
+    """
+    names = df.drop_duplicates('Topic').set_index('Topic')['Name']
+    data = {'Timestamp': df['Timestamp'].dt.strftime('%Y-%m-%d').tolist(), 'Topic': df['Topic'].astype(int).tolist()}
+    categories = {}
+    for c in columns:
+        values = df[c]
+        if c in categorical:
+            codes, uniques = pd.factorize(values)
+            categories[c], data[c] = uniques.astype(str).tolist(), codes.tolist()
+            continue
+        if precision is not None and pd.api.types.is_float_dtype(values):
+            values = values.round(precision)
+        # Periods without documents have no median, sent as null rather than the NaN json does not allow
+        data[c] = values.astype(object).where(values.notna(), None).tolist()
+    return json.dumps({'names': {str(t): str(n) for t, n in names.items()}, 'categories': categories, 'data': data},
+                      separators=(',', ':'))
+
+
+def parse_json_frames(raw: Dict[str, str]) -> SectionFrames:
+    """Parse an asset stored as a JSON records string per section into section frames."""
+    return SectionFrames({s: prepare_frame(pd.read_json(StringIO(v), orient='records')) for s, v in raw.items()})
+
+
+def load_section_frames(assets_path: str, name: str) -> SectionFrames:
+    """Load an asset lazily from ``<assets_path>/columnar/<name>`` if it was built, or parse its JSON file otherwise."""
+    columnar_folder = os.path.join(assets_path, 'columnar', name)
+    if os.path.isdir(columnar_folder):
+        return ParquetFrames(columnar_folder)
+    with open(os.path.join(assets_path, f'{name}.json')) as f:
+        return parse_json_frames(json.load(f))
+
+
+class TopicsTimeStore:
+    """Topic frequency over time of every section, parsed once, with an LRU cache of the aggregated responses.
+
+    Parameters
+    ----------
+    frames : SectionFrames
+        Frame of every section, sorted by (Topic, Timestamp).
+    maxsize : int, optional
+        Maximum number of ``(freq, top_n)`` responses kept in the cache.
+
+    """
+
+    def __init__(self, frames: SectionFrames, maxsize: int = 64):
+        self.frames = frames
+        self.aggregate = lru_cache(maxsize=maxsize)(self._aggregate)
+        self.response = lru_cache(maxsize=maxsize)(self._build_response)
+        self.section_series = lru_cache(maxsize=maxsize)(self._section_series)
+
+    def _aggregate(self, freq: Optional[str] = None, top_n: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+        """Aggregate the frequencies of every section over ``freq`` periods and keep the ``top_n`` topics."""
+        frames = dict(self.frames)
+        if freq:
+            frames = {s: v.set_index('Timestamp').groupby(['Topic', 'Words', 'Name'], observed=True)[
+                'Frequency'].resample(rule=freq).sum().reset_index(level=(0, 1, 2)) for s, v in frames.items()}
+        if top_n:
+            frames = {s: v.loc[v['Topic'].isin(list(range(-1, top_n)))] for s, v in frames.items()}
+        return frames
+
+    def _build_response(self, freq: Optional[str] = None, top_n: Optional[int] = None) -> bytes:
+        """Encode the aggregation of ``(freq, top_n)`` as the get_topics_time JSON response.
+
+        The bytes are cached rather than the dictionary, so that cache hits are not validated and encoded again.
+        """
+        response_json = self.meta(freq, top_n)
+        for s, v in self.aggregate(freq, top_n).items():
+            response_json[s] = v.to_json(orient='records')
+        return json.dumps(response_json).encode()
+
+    def _section_series(self, section: str, freq: Optional[str] = None, top_n: Optional[int] = None,
+                        outliers: bool = True) -> str:
+        """Compact topic frequency of a section, as ``plot_series``, with the words of the topics as codes."""
+        df = select_topics(self.aggregate(freq, top_n)[section], outliers=outliers)
+        if 'Timestamp' not in df.columns:
+            # Resampled frames are indexed by period
+            df = df.reset_index()
+        return plot_series(df, ['Frequency', 'Words'], categorical=['Words'])
+
+    def topic_trend(self, section: str, topic: int, freq: Optional[str] = None) -> Dict[str, list]:
+        """Frequency over ``freq`` periods of a topic of a section, as ``Timestamp`` dates and ``Frequency`` lists."""
+        # Aggregated frames stay sorted by topic
+        df = select_records(self.aggregate(freq)[section], topic)
+        if 'Timestamp' not in df.columns:
+            df = df.reset_index()
+        return {'Timestamp': df['Timestamp'].dt.strftime('%Y-%m-%d').tolist(),
+                'Frequency': df['Frequency'].astype(int).tolist()}
+
+    @staticmethod
+    def meta(freq: Optional[str] = None, top_n: Optional[int] = None) -> Dict[str, str]:
+        """Parameters echoed back in the get_topics_time response."""
+        meta = {}
+        if freq:
+            meta['frequency'] = freq
+        if top_n:
+            meta['top_n'] = str(top_n)
+        return meta
+
+    def warm(self, freqs: Iterable[str] = COMMON_FREQUENCIES, top_ns: Iterable[Optional[int]] = (None,)):
+        """Fill the cache with the responses of the given frequencies and top_n values."""
+        for freq in freqs:
+            for top_n in top_ns:
+                self.response(freq, top_n)
+
+
+class SentimentStore:
+    """Document sentiment of every section with memoized aggregations.
+
+    The frames are never modified after loading, so the store can be shared by concurrent requests.
+
+    Parameters
+    ----------
+    frames : SectionFrames
+        Frame of every section with parsed timestamps, sorted by (Topic, Timestamp).
+    maxsize : int, optional
+        Maximum number of aggregated frequencies kept in the cache.
+
+    """
+
+    def __init__(self, frames: SectionFrames, maxsize: int = 32):
+        self.frames = frames
+        self.aggregate = lru_cache(maxsize=maxsize)(self._aggregate)
+        self.response = lru_cache(maxsize=maxsize)(self._build_response)
+        self.section_series = lru_cache(maxsize=maxsize)(self._section_series)
+
+    def _aggregate(self, freq: str) -> Dict[str, pd.DataFrame]:
+        """Mean and median sentiment per topic and period of every section.
+
+        All the documents of a section are bucketed into the same ``freq`` periods in a single groupby, rather
+        than resampling every topic separately, so periods are aligned across topics and periods without
+        documents are not returned.
+        """
+        agg_sentiment = {}
+        for s in self.frames:
+            df = self.frames.load(s, ['Topic', 'Name', 'Timestamp', 'sentiment_sigma_fsa'])
+            topic_names = df.drop_duplicates('Topic').set_index('Topic')['Name']
+            agg = df.groupby(['Topic', pd.Grouper(key='Timestamp', freq=freq)], sort=True)[
+                'sentiment_sigma_fsa'].agg(['mean', 'median']).reset_index()
+            agg.insert(2, 'Name', agg['Topic'].map(topic_names))
+            agg_sentiment[s] = agg[['Timestamp', 'Topic', 'Name', 'mean', 'median']]
+        return agg_sentiment
+
+    def _build_response(self, freq: str) -> bytes:
+        """Encode the aggregation of ``freq`` as the get_topics_sentiment JSON response."""
+        response_json = {s: v.to_json(orient='records', date_format='iso') for s, v in self.aggregate(freq).items()}
+        response_json['frequency'] = freq
+        return json.dumps(response_json).encode()
+
+    def _section_series(self, section: str, freq: str, top_n: Optional[int] = None, outliers: bool = True) -> str:
+        """Compact mean and median sentiment of a section, as ``plot_series``, rounded to 4 decimals."""
+        df = select_topics(self.aggregate(freq)[section], top_n, outliers)
+        return plot_series(df, ['mean', 'median'], precision=4)
@@ -1,20 +1,41 @@
 # api.py
+import asyncio
 import logging
-from typing import Dict
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import numpy as np
 import uvicorn
 import pandas as pd
 import json
-import sqlite3
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
 from starlette.middleware.base import BaseHTTPMiddleware
-from langchain.document_loaders import WebBaseLoader
-from langchain.text_splitter import SentenceTransformersTokenTextSplitter
-from bertopic import BERTopic
 import os
+import sys
 from decouple import config
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from inference import StackedTopicScorer
+from topic_index import TopicIndex
+from topic_search import HnswTopicSearch
+from aggregates import (COMMON_FREQUENCIES, SentimentStore, TopicsTimeStore, iter_json_lines, load_section_frames,
+                        page_records, select_records)
+from accumulators import AccumulatedSentimentStore, current_version, load_states, topics_time_frames
+from columnar import ARROW_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, SectionFrames, encode_frames
+from database import CachedUrl, UrlTopicsCache, make_engine, process_lock
+from embedding_cache import ChunkEmbeddingCache
+from ingestion import (InFlightRequests, PageFetchError, conditional_headers, content_hash, fetch_page,
+                       make_http_client)
+from metrics import (MODEL_LOAD_SECONDS, URL_CHUNKS, CacheEventsExporter, MetricsMiddleware, TimedScorer,
+                     metrics_registry, observe_stage)
+from model_registry import ModelRegistry
+from profiling import ProfilingMiddleware
+
 # Define the app object to
 app = FastAPI(debug=True)
 
@@ -29,11 +50,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Requests sent with an X-Profile: 1 header are profiled, their collapsed stacks are written to PROFILES_PATH
+if config('PROFILING_ENABLED', default=False, cast=bool):
+    app.add_middleware(ProfilingMiddleware, folder=config('PROFILES_PATH', default='profiles'),
+                       interval=config('PROFILING_INTERVAL', default=0.005, cast=float))
+
+
+# Paths served without an API key, such as the metrics scraped by Prometheus
+PUBLIC_PATHS = ('/metrics',)
+
 
 # Add Api Key
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        if request.headers.get('API-Key') == 'your-api-key':
+        if request.url.path in PUBLIC_PATHS or request.headers.get('API-Key') == 'your-api-key':
             response = await call_next(request)
         else:
             raise HTTPException(status_code=400, detail='Invalid API key')
@@ -41,17 +71,9 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
 
 app.add_middleware(AuthMiddleware)
+# The counters of the caches, created below, are exported after every request
+app.add_middleware(MetricsMiddleware, sync=lambda: cache_events.sync())
 
-sections = [f'Section{s}' for s in ['1', '1A', '7']]
-if os.environ.get('TOPIC_MODELS_PATH') is not None:
-    model_path = '/app/topic_models'
-else:
-    model_path = '../topic_models'
-
-topic_models = {s: BERTopic.load(os.path.join(model_path, f'topic_models_{s}'),
-                                 embedding_model='all-MiniLM-L6-v2') for s in sections}
-topics_names_dict = {s: dict(zip(tm.get_topic_info()['Topic'], tm.get_topic_info()['Name'])) for s, tm in
-                     topic_models.items()}
 # Create a global logger
 logger = logging.getLogger('topics-api')
 logger.setLevel(logging.INFO)
@@ -60,39 +82,222 @@ stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
+sections = [f'Section{s}' for s in ['1', '1A', '7']]
 if os.environ.get('TOPIC_MODELS_PATH') is not None:
-    assets_path = '/app/api/assets'
+    model_path = '/app/topic_models'
 else:
-    assets_path = 'assets'
+    model_path = '../topic_models'
+
+# Only the topic embeddings and labels of the saved models are needed to assign topics, so we avoid BERTopic.load.
+# TOPIC_EMBEDDINGS_DTYPE=float16 or int8 loads the embeddings written by quantize_topics.py instead of the float32 ones
+TOPIC_EMBEDDINGS_DTYPE = config('TOPIC_EMBEDDINGS_DTYPE', default='float32')
+topic_models = {s: TopicIndex(os.path.join(model_path, f'topic_models_{s}'), TOPIC_EMBEDDINGS_DTYPE) for s in sections}
+topics_names_dict = {s: tm.topic_names for s, tm in topic_models.items()}
+# All the models share the same embedding model, so chunks are embedded once and scored against every section.
+# The registry loads it once for the process, and texts are split with its tokenizer
+model_registry = ModelRegistry().load()
+for name, seconds in model_registry.load_times.items():
+    MODEL_LOAD_SECONDS.labels(name).set(seconds)
+embedding_model = model_registry.embedding_model
+topic_scorer = StackedTopicScorer.from_indexes(topic_models)
+
+# Free text queries are searched exactly against the stacked topic embeddings or, with SEARCH_INDEX=hnsw, in HNSW
+# graphs of the topics of every section, for models too large for the exact search
+SEARCH_INDEX = config('SEARCH_INDEX', default='exact')
+if SEARCH_INDEX == 'exact':
+    topic_search = topic_scorer
+elif SEARCH_INDEX == 'hnsw':
+    topic_search = HnswTopicSearch(topic_scorer)
+else:
+    raise ValueError(f'Unknown SEARCH_INDEX {SEARCH_INDEX}. Use exact or hnsw')
+
+
+@lru_cache(maxsize=config('QUERY_CACHE_SIZE', default=4096, cast=int))
+def embed_query(query: str) -> np.ndarray:
+    """Embed a search query, repeated queries are embedded once."""
+    return embedding_model.encode([query])[0]
+
+
+# ASSETS_PATH points the api to other assets, such as the synthetic ones of the benchmarks
+if os.environ.get('TOPIC_MODELS_PATH') is not None:
+    assets_path = config('ASSETS_PATH', default='/app/api/assets')
+else:
+    assets_path = config('ASSETS_PATH', default='assets')
+
+
+def load_asset_frames(name: str) -> SectionFrames:
+    """Load an asset lazily from its columnar build if there is one, or parse its JSON file otherwise."""
+    if os.path.isdir(os.path.join(assets_path, 'columnar', name)):
+        logger.info(f'Loading {name} from its columnar build')
+    else:
+        logger.info(f'No columnar build of {name}, parsing {name}.json. Run build_assets.py for a faster startup')
+    return load_section_frames(assets_path, name)
+
+
+class AssetStores(NamedTuple):
+    """Stores of the topics over time and sentiment, replaced as a whole when the accumulators are updated."""
+    version: Optional[str]
+    topics_time: TopicsTimeStore
+    sentiment: SentimentStore
+
+    def preload(self):
+        """Load every column of the assets and aggregate the common frequencies now rather than on first use."""
+        for frames in (self.topics_time.frames, self.sentiment.frames):
+            for s in frames:
+                frames.load(s)
+        self.topics_time.warm()
+
+
+# Documents scored after the assets were built are added to these accumulators by accumulate_scores.py
+accumulators_path = os.path.join(assets_path, 'accumulators')
+ASSETS_RELOAD_INTERVAL = config('ASSETS_RELOAD_INTERVAL', default=30.0, cast=float)
+
+
+def load_asset_stores(sentiment_frames: Optional[SectionFrames] = None) -> AssetStores:
+    """Load the stores from the current accumulators if there are any, or from the assets otherwise.
+
+    The documents of the sentiment asset are served as they are in both cases, ``sentiment_frames`` avoids loading
+    them again on reloads.
+    """
+    if sentiment_frames is None:
+        # Load the topics_and_docs_sentiment json at the start of the application from the GCP bucket
+        #text = requests.get(url=TOPICS_AND_DOCS_SENTIMENT_URL).json()
+        sentiment_frames = load_asset_frames('topics_and_docs_sentiment')
+    version, states, _ = load_states(accumulators_path)
+    if version is None:
+        # Parse the topics over time once, aggregated responses are cached by (freq, top_n)
+        return AssetStores(None, TopicsTimeStore(load_asset_frames('topics_overtime')),
+                           SentimentStore(sentiment_frames))
+    logger.info(f'Loading the accumulators {version}')
+    topic_words = {s: tm.topic_words for s, tm in topic_models.items()}
+    # The rows of the asset are served as they are, with the documents accumulated since added
+    topics_time = topics_time_frames(states, topic_words, topics_names_dict, load_asset_frames('topics_overtime'))
+    return AssetStores(version, TopicsTimeStore(topics_time),
+                       AccumulatedSentimentStore(states, topics_names_dict, sentiment_frames))
+
+
+asset_stores = load_asset_stores()
+# Workers forked from a process that preloaded the assets share their pages, rather than each loading a copy. See
+# gunicorn.conf.py
+if config('PRELOAD_ASSETS', default=False, cast=bool):
+    asset_stores.preload()
+assets_reload_lock = asyncio.Lock()
+
+
+async def reload_asset_stores() -> bool:
+    """Swap in the stores of new accumulators, if they changed. Requests in flight finish on the previous stores."""
+    global asset_stores
+    async with assets_reload_lock:
+        if current_version(accumulators_path) == asset_stores.version:
+            return False
+
+        def load():
+            stores = load_asset_stores(asset_stores.sentiment.frames)
+            stores.topics_time.warm()
+            return stores
+        asset_stores = await asyncio.get_running_loop().run_in_executor(None, load)
+        logger.info(f'Reloaded the topics over time and sentiment from the accumulators {asset_stores.version}')
+        return True
+
+
+async def reload_asset_stores_periodically():
+    while True:
+        await asyncio.sleep(ASSETS_RELOAD_INTERVAL)
+        try:
+            await reload_asset_stores()
+        except Exception:
+            logger.exception('Could not reload the accumulators')
 
 
 @app.on_event("startup")
-async def load_jsons():
-    global sections_topics_time
-    sections_topics_time = json.load(open(os.path.join(assets_path, "topics_overtime.json")))
-    return sections_topics_time
+async def warm_topics_time():
+    logger.info(f'Pre-computing topics over time for frequencies {", ".join(COMMON_FREQUENCIES)}')
+    asset_stores.topics_time.warm()
+    app.state.assets_reload = asyncio.create_task(reload_asset_stores_periodically())
 
-# Load the topics_and_docs_sentiment json at the start of the application from the GCP bucket
-#text = requests.get(url=TOPICS_AND_DOCS_SENTIMENT_URL).json()
-text = json.load(open(os.path.join(assets_path, "topics_and_docs_sentiment.json")))
-topics_and_docs_sentiment = {k: pd.read_json(v, orient='records') for k, v in text.items()}
 
 if os.environ.get('TOPIC_MODELS_PATH') is None:
     logger.info('We are in local')
-    db_path = 'db/topics-url-db.db'
+    db_path = config('DB_PATH', default='db/topics-url-db.db')
 else:
     logger.info('We are in docker')
-    db_path = '/app/api/db/topics_db.db'
+    db_path = config('DB_PATH', default='/app/api/db/topics_db.db')
+
+# Pooled WAL-mode engine on the normalized tables of the URL topics. Legacy tables are migrated on creation
+engine = make_engine(db_path)
+# Topics older than the TTL are revalidated against the page, the least recently used URLs beyond the maximum
+# are evicted every compaction interval, and the most recently used ones are kept in memory
+URL_CACHE_TTL = config('URL_CACHE_TTL', default=7 * 24 * 3600, cast=float)
+URL_CACHE_MAX_URLS = config('URL_CACHE_MAX_URLS', default=100_000, cast=int)
+URL_CACHE_HOT_SIZE = config('URL_CACHE_HOT_SIZE', default=1024, cast=int)
+URL_CACHE_COMPACTION_INTERVAL = config('URL_CACHE_COMPACTION_INTERVAL', default=600, cast=float)
+url_topics_cache = UrlTopicsCache(engine, topics_names_dict, hot_size=URL_CACHE_HOT_SIZE)
+url_topics_cache.create()
+
+# Chunks shared by several pages, such as boilerplate and repeated filing sections, are embedded and scored once.
+# A CHUNK_CACHE_SIZE of 0 disables the cache
+CHUNK_CACHE_SIZE = config('CHUNK_CACHE_SIZE', default=200_000, cast=int)
+if CHUNK_CACHE_SIZE > 0:
+    chunk_cache = ChunkEmbeddingCache(os.path.join(os.path.dirname(db_path), 'chunk_cache'),
+                                      dim=topic_scorer.matrix.shape[0], capacity=CHUNK_CACHE_SIZE,
+                                      model_name=model_registry.model_name, topics_version=topic_scorer.fingerprint)
+else:
+    chunk_cache = None
+cache_events = CacheEventsExporter({'url_topics': lambda: url_topics_cache.stats,
+                                    **({'chunk_embeddings': lambda: chunk_cache.stats} if chunk_cache else {})})
+
+# Pages are fetched asynchronously, splitting and inference run in a bounded pool off the event loop
+FETCH_TIMEOUT = config('FETCH_TIMEOUT', default=20.0, cast=float)
+MAX_PAGE_BYTES = config('MAX_PAGE_BYTES', default=5_000_000, cast=int)
+BATCH_FETCH_CONCURRENCY = config('BATCH_FETCH_CONCURRENCY', default=16, cast=int)
+# Larger batches are rejected, so that a single request cannot hold the inference pool or the memory for long
+BATCH_MAX_URLS = config('BATCH_MAX_URLS', default=256, cast=int)
+EMBED_BATCH_SIZE = config('EMBED_BATCH_SIZE', default=128, cast=int)
+http_client = make_http_client(timeout=FETCH_TIMEOUT)
+inference_executor = ThreadPoolExecutor(max_workers=config('INFERENCE_WORKERS', default=2, cast=int),
+                                        thread_name_prefix='inference')
+urls_in_flight = InFlightRequests()
+
+
+def reset_after_fork():
+    """Drop the database connections inherited by a forked worker, every process needs its own."""
+    engine.dispose(close=False)
+    if chunk_cache is not None:
+        chunk_cache.engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def compact_url_cache() -> int:
+    # Every worker writes its own recorded accesses, one worker at a time
+    with process_lock(f'{db_path}.compact.lock'):
+        return url_topics_cache.compact(URL_CACHE_MAX_URLS)
+
+
+async def compact_url_cache_periodically():
+    while True:
+        await asyncio.sleep(URL_CACHE_COMPACTION_INTERVAL)
+        try:
+            evicted = await asyncio.get_running_loop().run_in_executor(None, compact_url_cache)
+        except Exception:
+            logger.exception('Could not compact the URL topics cache')
+            continue
+        if evicted:
+            logger.info(f'Evicted {evicted} least recently used URLs from the database')
+
+
+@app.on_event("startup")
+async def start_url_cache_compaction():
+    app.state.url_cache_compaction = asyncio.create_task(compact_url_cache_periodically())
 
-# Establish the connection and create the SQLite table if not existing
-connection = sqlite3.connect(db_path)
 
-cursor = connection.cursor()
-cursor.execute("""
-          CREATE TABLE IF NOT EXISTS data_topics
-          (url text, topics_section1 text, topics_section2 text, topics_section3 text)
-          """)
-mapping_db = {'Section1': 'topics_section1', 'Section1A': 'topics_section2', 'Section7': 'topics_section3'}
+@app.on_event("shutdown")
+async def close_ingestion():
+    app.state.url_cache_compaction.cancel()
+    app.state.assets_reload.cancel()
+    await http_client.aclose()
+    inference_executor.shutdown(wait=False)
 
 
 @app.get("/")
@@ -100,8 +305,17 @@ async def root():
     return {"message": "Please use the /docs endpoint to view the API documentation"}
 
 
+def _binary_media_type(request: Request) -> Optional[str]:
+    """Return the binary encoding accepted by the client, if it asked for one."""
+    accept = request.headers.get('accept', '')
+    for media_type in (ARROW_MEDIA_TYPE, MSGPACK_MEDIA_TYPE):
+        if media_type in accept:
+            return media_type
+    return None
+
+
 @app.get("/get_topics_time")
-async def get_topics_time(freq: str = None, top_n: int = None) -> Dict[str, str]:
+async def get_topics_time(request: Request, freq: str = None, top_n: int = None) -> Dict[str, str]:
     """Return dictionary of jsonnified dataframes with evolution of the topic frequency over time.
 
     Parameters
@@ -115,41 +329,27 @@ async def get_topics_time(freq: str = None, top_n: int = None) -> Dict[str, str]
     Returns
     -------
     dict of {str : str}
-        Dictionary of topic dataframes in json format
+        Dictionary of topic dataframes in json format. Clients sending an Accept header of
+        application/vnd.apache.arrow.stream or application/x-msgpack get the dataframes in that encoding instead.
 
     """
     logger.info('Returning a dictionary of dataframes. Each dataframe is a section')
-    response = await load_jsons()
     if not freq and not top_n:
         logger.info('No frequency or top_n specified, all topics will be returned.')
-        return response
-    else:
-        response_json = {}
-        sections_topics_time_dfs = {k: pd.read_json(v) for k, v in response.items()}
     if freq:
-        logger.info(f'Using {freq} to aggregate across time. This may take some time.')
-        response_json['frequency'] = freq
-        for s, v in sections_topics_time_dfs.items():
-            response[s] = v.set_index('Timestamp').groupby(['Topic', 'Words', 'Name'])['Frequency'].resample(
-                rule=freq).sum().reset_index(level=(0, 1, 2))
+        logger.info(f'Using {freq} to aggregate across time.')
     if top_n:
         logger.info(f'Top {top_n} topics will be returned. Topic -1 contains the outliers.')
-        response_json['top_n'] = str(top_n)
-        # If there is no frequency parameter, we simply filter for the top topics
-        if not freq:
-            for s, v in sections_topics_time_dfs.items():
-                response[s] = v.loc[v['Topic'].isin(list(range(-1, top_n)))]
-        # We can reuse response from above
-        else:
-            for s, v in response.items():
-                response[s] = response[s].loc[response[s]['Topic'].isin(list(range(-1, top_n)))]
-    for s in sections:
-        response_json[s] = response[s].to_json(orient='records')
-    return response_json
+    topics_time_store = asset_stores.topics_time
+    media_type = _binary_media_type(request)
+    if media_type:
+        return Response(encode_frames(topics_time_store.aggregate(freq, top_n), media_type,
+                                      topics_time_store.meta(freq, top_n)), media_type=media_type)
+    return Response(content=topics_time_store.response(freq, top_n), media_type='application/json')
 
 
 @app.get("/get_topics_sentiment")
-async def get_topics_sentiment(freq: str = None) -> Dict[str, str]:
+async def get_topics_sentiment(request: Request, freq: str = None) -> Dict[str, str]:
     """Return dictionary of topic sentiment dataframes.
 
     Parameters
@@ -160,28 +360,238 @@ async def get_topics_sentiment(freq: str = None) -> Dict[str, str]:
     Returns
     -------
     dict of {str : str}
-        Dictionary of JSON topic sentiment data
+        Dictionary of JSON topic sentiment data. Clients sending an Accept header of
+        application/vnd.apache.arrow.stream or application/x-msgpack get the dataframes in that encoding instead.
 
     """
     logger.info('Returning a dictionary of dataframes. Each dataframe corresponds to the sentiment found for a '
                 'respective section')
+    sentiment_store = asset_stores.sentiment
+    topics_and_docs_sentiment = sentiment_store.frames
+    media_type = _binary_media_type(request)
+    if media_type:
+        frames = sentiment_store.aggregate(freq) if freq else dict(topics_and_docs_sentiment)
+        return Response(encode_frames(frames, media_type, {'frequency': freq or 'No frequency specified'}),
+                        media_type=media_type)
     if freq is None:
         logger.info(
             'No frequency specified, all documents will be returned for post-processing. This may block or interrupt '
-            'your browser')
+            'your browser. Use /get_topics_sentiment/stream or /get_topics_sentiment/page instead.')
         response_json = {s: v.to_json(orient='records') for s, v in topics_and_docs_sentiment.items()}
         response_json['frequency'] = 'No frequency specified'
-    else:
-        logger.info(f'Using {freq} to aggregate sentiment across time.')
-        agg_sentiment = {}
-        for s in topics_and_docs_sentiment:
-            topics_and_docs_sentiment[s]['Timestamp'] = pd.to_datetime(topics_and_docs_sentiment[s]['Timestamp'],
-                                                                       infer_datetime_format=True)
-            agg_sentiment[s] = topics_and_docs_sentiment[s].set_index('Timestamp').groupby(['Topic', 'Name'])[
-                'sentiment_sigma_fsa'].resample(rule=freq).agg([np.mean, np.median]).reset_index(level=(0, 1,))
-        response_json = {s: v.reset_index().to_json(orient='records', date_format='iso') for s, v in agg_sentiment.items()}
-        response_json['frequency'] = freq
-    return response_json
+        return response_json
+    logger.info(f'Using {freq} to aggregate sentiment across time.')
+    return Response(content=sentiment_store.response(freq), media_type='application/json')
+
+
+def _check_section(frames: Dict[str, pd.DataFrame], section: str):
+    if section not in frames:
+        raise HTTPException(status_code=404, detail=f'Unknown section {section}. Use one of {", ".join(frames)}')
+
+
+def _section_frames(frames: Dict[str, pd.DataFrame], section: Optional[str]) -> Dict[str, pd.DataFrame]:
+    """Return the frames of all the sections, or only the requested one."""
+    if section is None:
+        return frames
+    _check_section(frames, section)
+    return {section: frames[section]}
+
+
+def _parse_time_range(start: Optional[str], end: Optional[str]) -> Tuple[Optional[pd.Timestamp], ...]:
+    """Parse the bounds of a time range as naive UTC timestamps, like those of the assets, or answer 422."""
+    bounds = []
+    for name, value in (('start', start), ('end', end)):
+        if value is None:
+            bounds.append(None)
+            continue
+        try:
+            timestamp = pd.Timestamp(value)
+        except ValueError:
+            timestamp = pd.NaT
+        if pd.isna(timestamp):
+            raise HTTPException(status_code=422, detail=f'Invalid {name} {value!r}. Use an ISO 8601 date or time')
+        bounds.append(timestamp.tz_convert(None) if timestamp.tzinfo is not None else timestamp)
+    return tuple(bounds)
+
+
+def _stream_records(frames: Dict[str, pd.DataFrame], section: Optional[str], topic: Optional[int],
+                    start: Optional[str], end: Optional[str]) -> StreamingResponse:
+    """Stream the selected rows of the frames as newline delimited JSON."""
+    start, end = _parse_time_range(start, end)
+    selected = {s: select_records(df, topic, start, end) for s, df in _section_frames(frames, section).items()}
+    return StreamingResponse(iter_json_lines(selected), media_type='application/x-ndjson')
+
+
+def _page_records(frames: Dict[str, pd.DataFrame], section: str, topic: Optional[int], start: Optional[str],
+                  end: Optional[str], cursor: Optional[str], limit: int) -> Response:
+    """Return a page of the selected rows of a section, with the cursor of the next page if there is one."""
+    start, end = _parse_time_range(start, end)
+    try:
+        df, next_cursor = page_records(_section_frames(frames, section)[section], topic, start, end, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    meta = json.dumps({'section': section, 'limit': limit, 'next_cursor': next_cursor})
+    # The records are serialized by pandas and spliced in, rather than being parsed back into Python objects
+    body = meta[:-1] + ', "records": ' + df.to_json(orient='records') + '}'
+    return Response(content=body, media_type='application/json')
+
+
+@app.get("/get_topics_sentiment/stream")
+async def stream_topics_sentiment(section: str = None, topic: int = None, start: str = None,
+                                  end: str = None) -> StreamingResponse:
+    """Stream the sentiment of every document as newline delimited JSON, one record per line.
+
+    Parameters
+    ----------
+    section : str, optional
+        Only stream this section. All the sections are streamed by default, each record has a Section field.
+    topic : int, optional
+        Only stream the documents of this topic.
+    start, end : str, optional
+        Only stream the documents with a timestamp within [start, end].
+
+    Returns
+    -------
+    StreamingResponse
+        application/x-ndjson stream of document sentiment records
+
+    """
+    logger.info('Streaming the sentiment of the documents')
+    return _stream_records(asset_stores.sentiment.frames, section, topic, start, end)
+
+
+@app.get("/get_topics_sentiment/page")
+async def page_topics_sentiment(section: str, topic: int = None, start: str = None, end: str = None,
+                                cursor: str = None, limit: int = Query(1000, ge=1, le=10000)) -> Response:
+    """Return a page of the sentiment of the documents of a section.
+
+    Parameters
+    ----------
+    section : str
+        Section of the documents.
+    topic : int, optional
+        Only return the documents of this topic.
+    start, end : str, optional
+        Only return the documents with a timestamp within [start, end].
+    cursor : str, optional
+        Opaque cursor of the next page, returned with the previous page. The first page is returned by default.
+    limit : int, optional
+        Maximum number of records of the page.
+
+    Returns
+    -------
+    Response
+        JSON with the records of the page and the cursor of the next page, null for the last one
+
+    """
+    return _page_records(asset_stores.sentiment.frames, section, topic, start, end, cursor, limit)
+
+
+@app.get("/get_topics_time/stream")
+async def stream_topics_time(section: str = None, topic: int = None, start: str = None,
+                             end: str = None) -> StreamingResponse:
+    """Stream the topic frequency over time as newline delimited JSON, one record per line.
+
+    Parameters
+    ----------
+    section : str, optional
+        Only stream this section. All the sections are streamed by default, each record has a Section field.
+    topic : int, optional
+        Only stream this topic.
+    start, end : str, optional
+        Only stream the frequencies with a timestamp within [start, end].
+
+    Returns
+    -------
+    StreamingResponse
+        application/x-ndjson stream of topic frequency records
+
+    """
+    logger.info('Streaming the topics over time')
+    return _stream_records(asset_stores.topics_time.frames, section, topic, start, end)
+
+
+@app.get("/get_topics_time/page")
+async def page_topics_time(section: str, topic: int = None, start: str = None, end: str = None,
+                           cursor: str = None, limit: int = Query(1000, ge=1, le=10000)) -> Response:
+    """Return a page of the topic frequency over time of a section.
+
+    Parameters
+    ----------
+    section : str
+        Section of the topics.
+    topic : int, optional
+        Only return this topic.
+    start, end : str, optional
+        Only return the frequencies with a timestamp within [start, end].
+    cursor : str, optional
+        Opaque cursor of the next page, returned with the previous page. The first page is returned by default.
+    limit : int, optional
+        Maximum number of records of the page.
+
+    Returns
+    -------
+    Response
+        JSON with the records of the page and the cursor of the next page, null for the last one
+
+    """
+    return _page_records(asset_stores.topics_time.frames, section, topic, start, end, cursor, limit)
+
+
+@app.get("/sections/{section}/topics_time")
+async def section_topics_time(section: str, freq: str = None, top_n: int = Query(None, ge=1),
+                              outliers: bool = True) -> Response:
+    """Return the topic frequency over time of a section, aggregated and in a compact form ready to plot.
+
+    Parameters
+    ----------
+    section : str
+        Section of the topics.
+    freq : str, optional
+        Resample frequency for aggregation. Needs to be compatible with Pandas resample.
+    top_n : int, optional
+        Only return the topics with an id below top_n.
+    outliers : bool, optional
+        Whether to return topic -1, holding the outliers.
+
+    Returns
+    -------
+    Response
+        JSON with the ``names`` of the topics, the distinct ``Words`` under ``categories`` and, under ``data``, the
+        ``Timestamp``, ``Topic``, ``Frequency`` and ``Words`` code lists.
+
+    """
+    topics_time_store = asset_stores.topics_time
+    _check_section(topics_time_store.frames, section)
+    return Response(topics_time_store.section_series(section, freq, top_n, outliers), media_type='application/json')
+
+
+@app.get("/sections/{section}/topics_sentiment")
+async def section_topics_sentiment(section: str, freq: str = '1Y', top_n: int = Query(None, ge=1),
+                                   outliers: bool = True) -> Response:
+    """Return the mean and median sentiment of the topics of a section over time, in a compact form ready to plot.
+
+    Parameters
+    ----------
+    section : str
+        Section of the topics.
+    freq : str, optional
+        Resample frequency. Needs to be compatible with Pandas resample.
+    top_n : int, optional
+        Only return the topics with an id below top_n.
+    outliers : bool, optional
+        Whether to return topic -1, holding the outliers.
+
+    Returns
+    -------
+    Response
+        JSON with the ``names`` of the topics and, under ``data``, the ``Timestamp``, ``Topic``, ``mean`` and
+        ``median`` lists.
+
+    """
+    sentiment_store = asset_stores.sentiment
+    _check_section(sentiment_store.frames, section)
+    return Response(sentiment_store.section_series(section, freq, top_n, outliers), media_type='application/json')
 
 
 @app.get("/get_topics_url")
@@ -194,7 +604,8 @@ async def get_topics_url(url: str = 'https://www.federalreserve.gov/newsevents/p
     url : str
         The URL of the webpage to scrape and extract topics from. Default is 'https://www.federalreserve.gov/newsevents/pressreleases/bcreg20230829b.htm'.
     keep_all : bool
-        Determines whether to keep all topics or only unique topics. Use True if you are interested in density analysis.
+        Determines whether to keep all topics, one per chunk in the order of the chunks, or only unique topics, in the
+        order they first appear. Use True if you are interested in density analysis.
 
     Returns
     -------
@@ -207,40 +618,328 @@ async def get_topics_url(url: str = 'https://www.federalreserve.gov/newsevents/p
 
     """
     # Check if the url is present in the database
-    cursor = connection.cursor()
-    cursor.execute('SELECT * FROM data_topics WHERE url=?', [url])
-    if cursor.fetchone() is None:
-        keep_all = True # We save all the topics independent from the repetitions
+    with observe_stage('db_lookup'):
+        entry = url_topics_cache.lookup(url)
+    if entry is not None and entry.is_fresh(URL_CACHE_TTL):
+        logger.info('URL exists in the database. Returning the topics')
+        return topic_names(entry.topics, keep_all)
+    if entry is None:
         logger.info('URL not present in the database. Scraping, extracting topics, and inserting into the database')
     else:
-        logger.info('URL exists in the database. Returning the topics')
-        cursor.execute('SELECT topics_section1, topics_section2, topics_section3 FROM data_topics WHERE url=?', [url])
-        topics = cursor.fetchone()
-        topics_doc = {s: topics[i].split(',') for i, s in enumerate(sections)}
-        return topics_doc
-    loader = WebBaseLoader(url)
-    splitter = SentenceTransformersTokenTextSplitter(chunk_overlap=0,
-                                                     model_name='sentence-transformers/all-MiniLM-L6-v2')
-    page = loader.load()
-    docs = splitter.split_documents(page)
-    docs_str = [doc.page_content for doc in docs]
-    topics_doc = {}
-    for s, tm in topic_models.items():
-        topics, _ = tm.transform(docs_str)
-        # Use this the user can keep uniques or get all the topics for density analysis.
-        if keep_all:
-            topics_doc[s] = list(np.vectorize(topics_names_dict[s].get)(topics))
+        logger.info('URL topics expired. Checking whether the page changed')
+    # Concurrent requests for the same URL share a single scrape and inference
+    _, topics = await urls_in_flight.run(url, lambda: ingest_url(url, entry))
+    # Requests for the same URL share all the topics, repetitions are only dropped from this response
+    return topics if keep_all else {s: list(dict.fromkeys(names)) for s, names in topics.items()}
+
+
+def split_text(text: str) -> List[str]:
+    """Split a text into chunks of the size of the embedding model input."""
+    with observe_stage('split'):
+        return model_registry.chunker.split_text(text)
+
+
+def embed(chunks: List[str]) -> np.ndarray:
+    """Embed chunks with the embedding model."""
+    with observe_stage('embed'):
+        return embedding_model.encode(chunks, batch_size=EMBED_BATCH_SIZE)
+
+
+def assign_topics(docs_chunks: List[List[str]]) -> List[Dict[str, tuple]]:
+    """Return the topic id and score of every chunk for each section, for several documents at once. CPU bound.
+
+    The chunks of all the documents are embedded in a single batch and scored together. Chunks found in the chunk
+    cache are not embedded again.
+    """
+    all_chunks = [chunk for chunks in docs_chunks for chunk in chunks]
+    if not all_chunks:
+        return [{s: ([], []) for s in sections} for _ in docs_chunks]
+    # The topic assignment of every section is timed separately
+    scorer = TimedScorer(topic_scorer)
+    if chunk_cache is not None:
+        topics_sections, scores_sections = chunk_cache.assign(all_chunks, embed, scorer)
+    else:
+        topics_sections, scores_sections = scorer.assign(embed(all_chunks))
+    for chunks in docs_chunks:
+        URL_CHUNKS.observe(len(chunks))
+    bounds = np.cumsum([0] + [len(chunks) for chunks in docs_chunks])
+    return [{s: (topics_sections[s][start:end], scores_sections[s][start:end]) for s in sections}
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def topic_names(topics_doc: Dict[str, list], keep_all: bool = True) -> Dict[str, list]:
+    """Map the topic ids of every section to their names, once per chunk or, unless ``keep_all``, once per topic."""
+    # We keep all the topics independent from the repetitions, which allows density analysis.
+    names = {s: [topics_names_dict[s][int(t)] for t in topics] for s, topics in topics_doc.items()}
+    return names if keep_all else {s: list(dict.fromkeys(topics)) for s, topics in names.items()}
+
+
+def extract_topics(text: str) -> Dict[str, tuple]:
+    """Split a text into chunks and return the topic id and score of every chunk for each section. CPU bound."""
+    return assign_topics([split_text(text)])[0]
+
+
+async def fetch_text(url: str, entry: Optional[CachedUrl] = None) -> Tuple[Optional[str], Dict[str, str]]:
+    """Fetch a page and extract its text, off the event loop.
+
+    If the URL is cached, the request is conditional on the stored validators. The text is None when the server
+    answers 304 Not Modified or when the text hashes to the stored content hash, in which case the stored topics
+    are still valid. The validators of the page are returned with the text.
+    """
+    headers = conditional_headers(entry.etag, entry.last_modified) if entry is not None else None
+    with observe_stage('fetch'):
+        page = await fetch_page(http_client, url, max_bytes=MAX_PAGE_BYTES, headers=headers)
+    validators = page.validators
+    if entry is not None and page.not_modified:
+        return None, validators
+
+    def extract_text():
+        with observe_stage('extract_text'):
+            return page.text
+    text = await asyncio.get_running_loop().run_in_executor(inference_executor, extract_text)
+    validators['content_hash'] = content_hash(text)
+    if entry is not None and entry.content_hash == validators['content_hash']:
+        return None, validators
+    return text, validators
+
+
+async def ingest_url(url: str, entry: Optional[CachedUrl] = None) -> Tuple[str, Dict[str, list]]:
+    """Fetch a page, extract its topics in the inference pool and insert them into the database.
+
+    If the page did not change since ``entry`` was stored, the stored topics are revalidated instead. The topics are
+    returned with their status, ``cached`` or ``inserted``.
+    """
+    try:
+        text, validators = await fetch_text(url, entry)
+    except PageFetchError as e:
+        logger.info(str(e))
+        raise HTTPException(status_code=502, detail=str(e))
+    if text is None:
+        logger.info('Page not modified. Keeping the stored topics')
+        url_topics_cache.revalidate(url, validators)
+        return 'cached', topic_names(entry.topics)
+    topics_doc = await asyncio.get_running_loop().run_in_executor(inference_executor, lambda: extract_topics(text))
+    with observe_stage('insert'):
+        url_topics_cache.upsert_many({url: topics_doc}, {url: validators})
+    return 'inserted', topic_names({s: topics for s, (topics, _) in topics_doc.items()})
+
+
+class UrlsRequest(BaseModel):
+    urls: List[str] = Field(max_length=BATCH_MAX_URLS)
+
+
+@app.post("/get_topics_urls")
+async def get_topics_urls(request: UrlsRequest) -> Dict[str, Dict[str, dict]]:
+    """Extract the topics of a list of URLs in one batch.
+
+    URLs already in the database are returned from it, after checking that their page did not change if their
+    topics expired. The others are fetched concurrently, their chunks are embedded and scored together in large
+    batches, and their topics are inserted in a single transaction. URLs being ingested by another request are
+    waited for rather than ingested again, and requests for the URLs of the batch wait for it.
+
+    Parameters
+    ----------
+    request : UrlsRequest
+        JSON body with the list of urls, at most ``BATCH_MAX_URLS`` of them.
+
+    Returns
+    -------
+    dict of {str : dict of {str : dict}}
+        For each URL, under ``results``, its ``status`` (``cached``, ``inserted`` or ``error``) and either its
+        ``topics`` per section or the error ``detail``.
+
+    """
+    urls = list(dict.fromkeys(request.urls))
+    logger.info(f'Extracting the topics of {len(urls)} URLs')
+    with observe_stage('db_lookup'):
+        entries = url_topics_cache.lookup_many(urls)
+    results = {url: {'status': 'cached', 'topics': topic_names(entry.topics)} for url, entry in entries.items()
+               if entry.is_fresh(URL_CACHE_TTL)}
+    missing = [url for url in urls if url not in results]
+    # Every missing URL is registered as in flight with a future set by this batch, unless another request is
+    # already ingesting it
+    loop = asyncio.get_running_loop()
+    shared, batch = {}, {}
+    for url in missing:
+        future = loop.create_future()
+        shared[url], started = urls_in_flight.start(url, lambda: future)
+        if started:
+            batch[url] = future
+    try:
+        await ingest_batch(batch, entries)
+    finally:
+        for future in batch.values():
+            if not future.done():
+                future.set_exception(RuntimeError('The ingestion of the batch failed'))
+    outcomes = await asyncio.gather(*[asyncio.shield(task) for task in shared.values()], return_exceptions=True)
+    for url, outcome in zip(shared, outcomes):
+        if isinstance(outcome, HTTPException):
+            results[url] = {'status': 'error', 'detail': outcome.detail}
+        elif isinstance(outcome, Exception):
+            logger.error(f'Could not extract the topics of {url}', exc_info=outcome)
+            results[url] = {'status': 'error', 'detail': 'Internal error while extracting the topics'}
         else:
-            topics_doc[s] = list(set(np.vectorize(topics_names_dict[s].get)(topics)))
-    # Make strings of the lists
-    data_to_insert = {}
-    for s, k in mapping_db.items():
-        data_to_insert[k] = ','.join(topics_doc[s])
-    data_to_insert['url'] = url
-    cursor.execute('INSERT INTO data_topics VALUES (:url, :topics_section1, :topics_section2, :topics_section3)',
-                   data_to_insert)
-    connection.commit()
-    return topics_doc
+            status, topics = outcome
+            results[url] = {'status': status, 'topics': topics}
+    return {'results': {url: results[url] for url in urls}}
+
+
+async def ingest_batch(futures: Dict[str, asyncio.Future], entries: Dict[str, CachedUrl]):
+    """Ingest several URLs as ``ingest_url``, setting the future of every URL to its outcome.
+
+    The pages are fetched concurrently, their chunks are embedded and scored together and their topics are inserted
+    in a single transaction.
+    """
+    semaphore = asyncio.Semaphore(BATCH_FETCH_CONCURRENCY)
+
+    async def bounded_fetch(url):
+        async with semaphore:
+            return await fetch_text(url, entries.get(url))
+
+    texts = await asyncio.gather(*[bounded_fetch(url) for url in futures], return_exceptions=True)
+    fetched, validators = {}, {}
+    for url, fetch_result in zip(futures, texts):
+        if isinstance(fetch_result, (PageFetchError, httpx.HTTPError)):
+            futures[url].set_exception(HTTPException(status_code=502, detail=str(fetch_result)))
+            continue
+        if isinstance(fetch_result, Exception):
+            futures[url].set_exception(fetch_result)
+            continue
+        text, validators[url] = fetch_result
+        if text is None:
+            url_topics_cache.revalidate(url, validators[url])
+            futures[url].set_result(('cached', topic_names(entries[url].topics)))
+        else:
+            fetched[url] = text
+    if not fetched:
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        docs_chunks = await loop.run_in_executor(inference_executor, lambda: [split_text(t) for t in fetched.values()])
+        docs_topics = await loop.run_in_executor(inference_executor, lambda: assign_topics(docs_chunks))
+        urls_topics = dict(zip(fetched, docs_topics))
+        with observe_stage('insert'):
+            url_topics_cache.upsert_many(urls_topics, validators)
+    except Exception as e:
+        # The error is reported for every URL of the stage, the outcomes of the others are kept
+        for url in fetched:
+            futures[url].set_exception(e)
+        return
+    for url, topics_doc in urls_topics.items():
+        futures[url].set_result(('inserted', topic_names({s: topics for s, (topics, _) in topics_doc.items()})))
+
+
+@app.post("/reload_assets")
+async def reload_assets() -> Dict[str, object]:
+    """Reload the topics over time and sentiment if the accumulators were updated, without waiting for the next check.
+
+    Returns
+    -------
+    dict
+        Whether the stores were reloaded and the version of the accumulators they are built from, None if they are
+        built from the assets.
+
+    """
+    reloaded = await reload_asset_stores()
+    return {'reloaded': reloaded, 'version': asset_stores.version}
+
+
+@app.get("/get_cache_stats")
+async def get_cache_stats() -> Dict[str, dict]:
+    """Return the hit counts and sizes of the URL topics cache and of the chunk embedding cache.
+
+    Returns
+    -------
+    dict of {str : dict}
+        Counters of the URL topics cache and, if it is enabled, of the chunk embedding cache with its hit rate.
+
+    """
+    stats = {'url_topics': dict(url_topics_cache.stats)}
+    if chunk_cache is not None:
+        stats['chunk_embeddings'] = chunk_cache.summary()
+    return stats
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Return the metrics of the api in the Prometheus text format.
+
+    Requests per route and their latency, time spent in every stage of URL ingestion and in the topic assignment
+    of every section, number of chunks per URL, cache hits and misses and model load times.
+    """
+    cache_events.sync()
+    return Response(generate_latest(metrics_registry()), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+@app.get("/search_topics")
+async def search_topics(q: str = Query(..., min_length=1), k: int = Query(10, ge=1, le=100),
+                        sections: List[str] = Query(None), outliers: bool = False, trend: bool = False,
+                        freq: str = '1Y') -> Dict[str, object]:
+    """Return the topics of all the sections closest in meaning to a free text query.
+
+    Parameters
+    ----------
+    q : str
+        Query, such as "LIBOR transition risk".
+    k : int, optional
+        Number of topics returned.
+    sections : list of str, optional
+        Sections searched, all of them by default. Repeat the parameter for several sections.
+    outliers : bool, optional
+        Whether topic -1, holding the outliers of every section, can be returned.
+    trend : bool, optional
+        Whether to return the frequency over time of every topic.
+    freq : str, optional
+        Resample frequency of the trends. Needs to be compatible with Pandas resample.
+
+    Returns
+    -------
+    dict
+        The query and its ``topics``, most similar first, with their section, id, name, cosine similarity ``score``
+        and, if ``trend``, their ``Timestamp`` and ``Frequency`` lists.
+
+    """
+    for section in sections or []:
+        _check_section(topics_names_dict, section)
+    topics_time_store = asset_stores.topics_time
+
+    def search():
+        found = topic_search.top_k(embed_query(q), k, sections, outliers)
+        topics = [{'section': s, 'topic_id': t, 'name': topics_names_dict[s][t], 'score': round(score, 4)}
+                  for s, t, score in found]
+        if trend:
+            for topic in topics:
+                topic['trend'] = topics_time_store.topic_trend(topic['section'], topic['topic_id'], freq)
+        return topics
+    # The query is embedded off the event loop, but not behind the URL ingestion of the inference pool
+    return {'query': q, 'topics': await asyncio.get_running_loop().run_in_executor(None, search)}
+
+
+@app.get("/get_urls_by_topic")
+async def get_urls_by_topic(section: str, topic_id: int, limit: int = Query(100, ge=1, le=10000)) -> Dict[str, object]:
+    """Return the URLs in the database with chunks assigned to a topic.
+
+    Parameters
+    ----------
+    section : str
+        Section of the topic model.
+    topic_id : int
+        Id of the topic in the section model.
+    limit : int, optional
+        Maximum number of URLs returned.
+
+    Returns
+    -------
+    dict
+        The topic name and the list of URLs with their number of chunks on the topic, most frequent first.
+
+    """
+    if section not in topics_names_dict:
+        raise HTTPException(status_code=404, detail=f'Unknown section {section}. Use one of {", ".join(sections)}')
+    if topic_id not in topics_names_dict[section]:
+        raise HTTPException(status_code=404, detail=f'Unknown topic {topic_id} in {section}')
+    return {'section': section, 'topic_id': topic_id, 'name': topics_names_dict[section][topic_id],
+            'urls': url_topics_cache.urls_by_topic(section, topic_id, limit)}
 
 
 if __name__ == '__main__':
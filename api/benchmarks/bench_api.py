@@ -0,0 +1,251 @@
+"""Benchmark the latency and throughput of the api hot paths, offline.
+
+The api is called in process through ``TestClient``, on synthetic assets sized like production written to a
+temporary folder, with a temporary URL database. Pages are served by a local HTTP server, every page its own text
+so that a cache miss embeds all its chunks. The cases are:
+
+    * ``topics_time``: ``/get_topics_time`` for every combination of ``--freqs`` and ``--top-ns``.
+    * ``sentiment``: ``/get_topics_sentiment`` with all the documents, and aggregated for every frequency.
+    * ``search``: ``/search_topics`` on a repeated query, with and without the trends of the topics, and on new
+      queries that are embedded first.
+    * ``url``: ``/get_topics_url`` on a URL in the database, and on new small and large pages.
+
+Each case is called ``--repeat`` times in a row for the latency percentiles, after a first call reported on its
+own since it fills the caches, then ``--repeat`` times from ``--concurrency`` threads for the throughput. The
+results are written as JSON, by default to ``benchmarks/results/<commit>.json``, and two runs are compared with
+``--compare``. Run from the api folder:
+
+    python benchmarks/bench_api.py
+    python benchmarks/bench_api.py --compare benchmarks/results/1a2b3c4.json benchmarks/results/5d6e7f8.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+API_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_PATH)
+from columnar import prepare_frame, write_parquet_frames
+from topic_index import TopicIndex
+
+SECTIONS = [f'Section{s}' for s in ['1', '1A', '7']]
+HEADERS = {'API-Key': 'your-api-key'}
+
+
+def make_assets(assets_path: str, model_path: str, docs_per_section: int, years: int, seed: int = 0):
+    """Write synthetic topics_overtime and topics_and_docs_sentiment assets in the columnar format.
+
+    Documents are spread over the topics of the saved models with a Zipf law, as topic sizes are, and over the
+    business days of ``years`` years. The topics over time count the documents of every (topic, day), as
+    ``bulk_score.py`` does.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(end='2023-12-29', periods=years * 261)
+    topics_time, sentiment = {}, {}
+    for s in SECTIONS:
+        index = TopicIndex(os.path.join(model_path, f'topic_models_{s}'))
+        topic_ids = np.array(sorted(index.topic_names))
+        weights = 1 / np.arange(1, len(topic_ids) + 1)
+        docs = pd.DataFrame({'Topic': rng.choice(topic_ids, size=docs_per_section, p=weights / weights.sum()),
+                             'Timestamp': rng.choice(days, size=docs_per_section)})
+        docs['Name'] = docs['Topic'].map(index.topic_names)
+        labels = rng.choice(['NEGATIVE', 'NEUTRAL', 'POSITIVE'], size=docs_per_section, p=[0.3, 0.5, 0.2])
+        docs['ticker'] = rng.choice([f'T{i:04d}' for i in range(3000)], size=docs_per_section)
+        docs['label_sigma_fsa'] = labels
+        docs['score_sigma_fsa'] = rng.uniform(0.5, 1.0, size=docs_per_section)
+        docs['sentiment_sigma_fsa'] = np.select([labels == 'NEGATIVE', labels == 'NEUTRAL'],
+                                                [-docs['score_sigma_fsa'], 0.0], docs['score_sigma_fsa'])
+        sentiment[s] = prepare_frame(docs)
+        frequency = docs.groupby(['Topic', 'Timestamp']).size().rename('Frequency').reset_index()
+        frequency['Words'] = frequency['Topic'].map(index.topic_words)
+        frequency['Name'] = frequency['Topic'].map(index.topic_names)
+        topics_time[s] = prepare_frame(frequency[['Topic', 'Words', 'Frequency', 'Timestamp', 'Name']])
+    write_parquet_frames(topics_time, os.path.join(assets_path, 'columnar', 'topics_overtime'))
+    write_parquet_frames(sentiment, os.path.join(assets_path, 'columnar', 'topics_and_docs_sentiment'))
+    return {'topics_overtime_rows': sum(len(df) for df in topics_time.values()),
+            'sentiment_rows': sum(len(df) for df in sentiment.values())}
+
+
+def load_words() -> List[str]:
+    """Words of the 10-K sections of data_sample.csv, to build pages that read like filings."""
+    sample = pd.read_csv(os.path.join(API_PATH, '..', 'data_sample.csv'), usecols=SECTIONS, nrows=20)
+    return ' '.join(sample.fillna('').to_numpy().ravel()).split()
+
+
+def start_page_server(words: List[str]) -> ThreadingHTTPServer:
+    """Serve ``/<seed>/<n_words>`` as a page of ``n_words`` words, starting at a position drawn from the seed."""
+
+    class PageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            seed, n_words = (int(p) for p in self.path.strip('/').split('/')[:2])
+            start = np.random.default_rng(seed).integers(len(words))
+            text = ' '.join(words[(start + i) % len(words)] for i in range(n_words))
+            body = f'<html><body><p>{seed}</p><p>{text}</p></body></html>'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {'n': len(latencies), 'mean': float(np.mean(latencies)), 'p50': float(p50), 'p90': float(p90),
+            'p99': float(p99), 'max': float(np.max(latencies))}
+
+
+def measure(call: Callable[[], object], repeat: int, concurrency: int) -> Dict[str, object]:
+    """Time a first call, ``repeat`` calls in a row and ``repeat`` calls from ``concurrency`` threads."""
+
+    def timed():
+        start = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f'{response.request.url} returned {response.status_code}: {response.text[:200]}')
+        return elapsed
+
+    first = timed()
+    latencies = [timed() for _ in range(repeat)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda _: timed(), range(repeat)))
+    return {'first_seconds': first, 'latency': summarize(latencies),
+            'throughput_rps': repeat / (time.perf_counter() - start), 'concurrency': concurrency}
+
+
+def run(args) -> Dict[str, object]:
+    work_dir = tempfile.mkdtemp(prefix='bench-api-')
+    assets_path = os.path.join(work_dir, 'assets')
+    print(f'Writing the synthetic assets to {assets_path}')
+    fixtures = make_assets(assets_path, args.model_path, args.docs_per_section, args.years)
+    os.environ['ASSETS_PATH'] = assets_path
+    os.environ['DB_PATH'] = os.path.join(work_dir, 'db', 'topics-url-db.db')
+    os.makedirs(os.path.dirname(os.environ['DB_PATH']))
+    server = start_page_server(load_words())
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    from fastapi.testclient import TestClient
+    import app as api
+
+    seeds = itertools.count(1)
+    results = {}
+    with TestClient(api.app, headers=HEADERS) as client:
+        for freq, top_n in itertools.product([''] + args.freqs, args.top_ns):
+            params = {k: v for k, v in {'freq': freq, 'top_n': top_n}.items() if v not in ('', 0)}
+            name = f'topics_time freq={freq or "none"} top_n={top_n or "all"}'
+            results[name] = measure(lambda: client.get('/get_topics_time', params=params), args.repeat,
+                                    args.concurrency)
+            print(name, results[name]['latency']['p50'])
+        for freq in [''] + args.freqs:
+            params = {'freq': freq} if freq else {}
+            name = f'sentiment freq={freq or "raw"}'
+            # Every document is serialized when there is no frequency, a few calls are enough
+            repeat = args.repeat if freq else max(1, args.repeat // 10)
+            results[name] = measure(lambda: client.get('/get_topics_sentiment', params=params), repeat,
+                                    args.concurrency)
+            print(name, results[name]['latency']['p50'])
+        # Repeated queries reuse their embedding, new ones are embedded first
+        search_cases = {'search': lambda: {'q': 'LIBOR transition risk'},
+                        'search trend': lambda: {'q': 'LIBOR transition risk', 'trend': True},
+                        'search new query': lambda: {'q': f'LIBOR transition risk {next(seeds)}'}}
+        for name, make_params in search_cases.items():
+            results[name] = measure(lambda: client.get('/search_topics', params=make_params()), args.repeat,
+                                    args.concurrency)
+            print(name, results[name]['latency']['p50'])
+        cached_url = f'{base_url}/0/{args.small_page_words}'
+        client.get('/get_topics_url', params={'url': cached_url})
+        url_cases = {'url hit': lambda: cached_url,
+                     'url miss small': lambda: f'{base_url}/{next(seeds)}/{args.small_page_words}',
+                     'url miss large': lambda: f'{base_url}/{next(seeds)}/{args.large_page_words}'}
+        for name, make_url in url_cases.items():
+            repeat = args.repeat if name == 'url hit' else args.url_repeat
+            results[name] = measure(lambda: client.get('/get_topics_url', params={'url': make_url()}), repeat,
+                                    args.concurrency)
+            print(name, results[name]['latency']['p50'])
+    server.shutdown()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {'fixtures': {'docs_per_section': args.docs_per_section, 'years': args.years,
+                         'small_page_words': args.small_page_words, 'large_page_words': args.large_page_words,
+                         **fixtures},
+            'results': results}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=API_PATH, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(base_path: str, new_path: str, threshold: float):
+    """Print the change of the p50, p90 and throughput of every case, flagging the ones worse than ``threshold``."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f'{base_path} ({base["commit"]}) -> {new_path} ({new["commit"]})')
+    print(f'{"case":<40} {"p50":>9} {"p90":>9} {"rps":>9}')
+    for name, result in new['results'].items():
+        if name not in base['results']:
+            continue
+        before = base['results'][name]
+        changes = [result['latency'][p] / before['latency'][p] - 1 for p in ('p50', 'p90')]
+        changes.append(before['throughput_rps'] / result['throughput_rps'] - 1)
+        flag = '  REGRESSION' if max(changes) > threshold else ''
+        print(f'{name:<40} ' + ' '.join(f'{c:>+9.1%}' for c in changes) + flag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='JSON file of the results, benchmarks/results/<commit>.json by default')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='Compare two result files and exit')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    parser.add_argument('--docs-per-section', type=int, default=200_000)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--freqs', nargs='+', default=['M', 'Q', 'Y'])
+    parser.add_argument('--top-ns', type=int, nargs='+', default=[0, 10, 50], help='0 returns all the topics')
+    parser.add_argument('--small-page-words', type=int, default=1_000)
+    parser.add_argument('--large-page-words', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--url-repeat', type=int, default=5, help='Calls of the cache miss cases')
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare, args.threshold)
+        return
+    commit = git_commit()
+    report = {'commit': commit, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'machine': platform.machine(), 'cpus': os.cpu_count(), **run(args)}
+    output = args.output or os.path.join(API_PATH, 'benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Measure the accuracy, speed and memory of the quantized topic embeddings against ``BERTopic.transform``.
+
+The sections of the filings of data_sample.csv are split into chunks as the api splits pages, and every chunk is
+embedded once. The topics of the chunks are assigned by ``tm.transform`` of every section model, the reference,
+and by the stacked scorer with the topic embeddings in float32, float16 and int8. For every dtype the fraction of
+chunks whose topic differs from the reference is reported per section, with the largest error on the similarity of
+the assigned topic, the time to assign the topics of all the chunks and the memory of the topic embeddings.
+
+The quantized embeddings are written by ``quantize_topics.py`` if they are missing. Without BERTopic installed,
+``--reference float32`` compares with the float32 scorer instead, whose topics are those of ``tm.transform`` for
+models saved with safetensors. Run from the api folder:
+
+    python benchmarks/bench_quantization.py
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from bench_api import API_PATH, SECTIONS, git_commit
+from inference import QUANTIZED_DTYPES, StackedTopicScorer
+from model_registry import ModelRegistry
+from quantize_topics import quantize_model
+from topic_index import TopicIndex, embeddings_file
+
+
+def make_chunks(registry: ModelRegistry, max_filings: int) -> list:
+    """Chunks of every section of the filings of data_sample.csv."""
+    sample = pd.read_csv(os.path.join(API_PATH, '..', 'data_sample.csv'), usecols=SECTIONS, nrows=max_filings)
+    texts = [text for text in sample.fillna('').to_numpy().ravel() if text]
+    return [chunk for text in texts for chunk in registry.chunker.split_text(text)]
+
+
+def bertopic_topics(model_path: str, chunks: list, embeddings: np.ndarray) -> dict:
+    """Topics and similarities of the chunks assigned by ``tm.transform`` of every section model."""
+    from bertopic import BERTopic
+
+    reference = {}
+    for s in SECTIONS:
+        tm = BERTopic.load(os.path.join(model_path, f'topic_models_{s}'), embedding_model='all-MiniLM-L6-v2')
+        topics, probabilities = tm.transform(chunks, embeddings)
+        reference[s] = (np.asarray(topics), np.asarray(probabilities))
+    return reference
+
+
+def timeit(func, repeat: int) -> float:
+    """Return the best wall time in seconds of ``repeat`` calls to ``func``."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    parser.add_argument('--reference', choices=['bertopic', 'float32'], default='bertopic')
+    parser.add_argument('--max-filings', type=int, default=None, help='Number of filings of data_sample.csv used')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON file of the results, benchmarks/results/quantization-<commit>.json '
+                                         'by default')
+    args = parser.parse_args()
+
+    registry = ModelRegistry().load()
+    chunks = make_chunks(registry, args.max_filings)
+    embeddings = np.asarray(registry.embedding_model.encode(chunks), dtype=np.float32)
+    print(f'{len(chunks)} chunks of data_sample.csv')
+
+    paths = {s: os.path.join(args.model_path, f'topic_models_{s}') for s in SECTIONS}
+    scorers = {}
+    for dtype in ('float32',) + QUANTIZED_DTYPES:
+        for path in paths.values():
+            if not os.path.exists(os.path.join(path, embeddings_file(dtype))):
+                quantize_model(path, dtype)
+        scorers[dtype] = StackedTopicScorer.from_indexes({s: TopicIndex(p, dtype) for s, p in paths.items()})
+    if args.reference == 'bertopic':
+        reference = bertopic_topics(args.model_path, chunks, embeddings)
+    else:
+        topics, scores = scorers['float32'].assign(embeddings)
+        reference = {s: (topics[s], scores[s]) for s in SECTIONS}
+
+    runs = []
+    print(f'{"dtype":>8} {"MB":>6} {"file MB":>8} {"assign (s)":>11} {"speedup":>8} {"changed":>8} '
+          f'{"max score error":>16}')
+    for dtype, scorer in scorers.items():
+        topics, scores = scorer.assign(embeddings)
+        changed = {s: float(np.mean(topics[s] != reference[s][0])) for s in SECTIONS}
+        score_error = max(float(np.abs(scores[s] - reference[s][1]).max()) for s in SECTIONS)
+        seconds = timeit(lambda: scorer.assign(embeddings), args.repeat)
+        file_mb = sum(os.path.getsize(os.path.join(p, embeddings_file(dtype))) for p in paths.values()) / 2 ** 20
+        memory_mb = (scorer.matrix.nbytes + (0 if scorer.scales is None else scorer.scales.nbytes)) / 2 ** 20
+        runs.append({'dtype': dtype, 'memory_mb': memory_mb, 'file_mb': file_mb, 'assign_seconds': seconds,
+                     'changed': changed, 'changed_mean': float(np.mean(list(changed.values()))),
+                     'max_score_error': score_error})
+        print(f'{dtype:>8} {memory_mb:>6.1f} {file_mb:>8.1f} {seconds:>11.4f} '
+              f'{runs[0]["assign_seconds"] / seconds:>7.2f}x {runs[-1]["changed_mean"]:>8.2%} {score_error:>16.5f}')
+
+    commit = git_commit()
+    report = {'commit': commit, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'reference': args.reference,
+              'chunks': len(chunks), 'repeat': args.repeat, 'runs': runs}
+    output = args.output or os.path.join(API_PATH, 'benchmarks', 'results', f'quantization-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
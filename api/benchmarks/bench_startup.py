@@ -0,0 +1,67 @@
+"""Benchmark the cold start time and peak memory of loading the three section models.
+
+Each load path runs in a fresh interpreter, so the import cost of its dependencies is part of the
+measurement, as it is for a new uvicorn worker.
+
+    * ``bertopic``: ``BERTopic.load`` of every section, as the API did before.
+    * ``topic_index``: ``TopicIndex`` of every section, memory-mapping the safetensors embeddings.
+
+Run from the api folder:
+
+    python benchmarks/bench_startup.py --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+LOADERS = {
+    'bertopic': """
+from bertopic import BERTopic
+models = {s: BERTopic.load(os.path.join(model_path, f'topic_models_{s}'), embedding_model='all-MiniLM-L6-v2')
+          for s in sections}
+""",
+    'topic_index': """
+from sentence_transformers import SentenceTransformer
+from topic_index import TopicIndex
+models = {s: TopicIndex(os.path.join(model_path, f'topic_models_{s}')) for s in sections}
+embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+""",
+}
+
+TEMPLATE = """
+import json, os, resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {api_path!r})
+model_path = {model_path!r}
+sections = ['Section1', 'Section1A', 'Section7']
+{loader}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def run(loader: str, model_path: str) -> dict:
+    """Run a load path in a new interpreter and return its timing and peak resident memory."""
+    api_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = TEMPLATE.format(api_path=api_path, model_path=model_path, loader=LOADERS[loader])
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model-path', default=os.path.abspath(os.path.join('..', 'topic_models')))
+    args = parser.parse_args()
+
+    print(f'{"loader":>12} {"seconds":>10} {"max RSS (MB)":>14}')
+    for loader in LOADERS:
+        results = [run(loader, args.model_path) for _ in range(args.repeat)]
+        best = min(results, key=lambda r: r['seconds'])
+        print(f'{loader:>12} {best["seconds"]:>10.2f} {best["max_rss_mb"]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark the topic assignment stage of get_topics_url.
+
+Compares the previous path, one ``BERTopic.transform`` per section (each re-encoding the chunks), with the
+shared stage that embeds the chunks once and scores them against all the sections in one matrix product.
+
+Run from the api folder:
+
+    python benchmarks/bench_url_inference.py --sizes 10 100 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from bertopic import BERTopic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inference import StackedTopicScorer
+from topic_index import TopicIndex
+
+SECTIONS = [f'Section{s}' for s in ['1', '1A', '7']]
+
+
+def make_chunks(n_chunks: int, words_per_chunk: int = 180) -> list:
+    """Build ``n_chunks`` chunks of 10-K text out of data_sample.csv, cycling over the text if needed."""
+    sample = pd.read_csv(os.path.join('..', 'data_sample.csv'))
+    words = ' '.join(sample[SECTIONS].iloc[0].astype(str)).split()
+    return [' '.join(words[(i * words_per_chunk) % len(words):][:words_per_chunk]) for i in range(n_chunks)]
+
+
+def timeit(func, repeat: int) -> float:
+    """Return the best wall time in seconds of ``repeat`` calls to ``func``."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    args = parser.parse_args()
+
+    topic_models = {s: BERTopic.load(os.path.join(args.model_path, f'topic_models_{s}'),
+                                     embedding_model='all-MiniLM-L6-v2') for s in SECTIONS}
+    embedding_model = topic_models[SECTIONS[0]].embedding_model
+    # The scorer loads the models as the api does
+    scorer = StackedTopicScorer.from_indexes({s: TopicIndex(os.path.join(args.model_path, f'topic_models_{s}'))
+                                              for s in SECTIONS})
+
+    def before(docs):
+        return {s: tm.transform(docs)[0] for s, tm in topic_models.items()}
+
+    def after(docs):
+        return scorer.assign(embedding_model.embed(docs))[0]
+
+    print(f'{"chunks":>8} {"before (s)":>12} {"after (s)":>12} {"speedup":>8} {"same topics":>12}')
+    for n in args.sizes:
+        docs = make_chunks(n)
+        expected, got = before(docs), after(docs)
+        same = all(np.array_equal(np.asarray(expected[s]), got[s]) for s in SECTIONS)
+        t_before = timeit(lambda: before(docs), args.repeat)
+        t_after = timeit(lambda: after(docs), args.repeat)
+        print(f'{n:>8} {t_before:>12.3f} {t_after:>12.3f} {t_before / t_after:>7.1f}x {str(same):>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Benchmark how the throughput of the api scales with its number of worker processes.
+
+For every ``--workers`` count the api is started with ``gunicorn.conf.py``, on the synthetic assets of
+``bench_api.py`` and a fresh URL database, and loaded by ``--concurrency`` client threads for ``--duration`` seconds
+with each workload:
+
+    * ``aggregates``: ``/get_topics_time`` and ``/sections/{section}/topics_sentiment`` over the common frequencies,
+      served from the cached aggregations.
+    * ``url_miss``: ``/get_topics_url`` on new pages, which embeds every chunk and is bound by the CPU.
+
+The throughput and latency percentiles of every run are reported with the proportional set size of all the
+processes of the api, which counts the pages shared by the workers once. Run from the api folder:
+
+    python benchmarks/bench_workers.py --workers 1 2 4
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import httpx
+
+from bench_api import API_PATH, HEADERS, SECTIONS, git_commit, load_words, make_assets, start_page_server, summarize
+
+FREQS = ['1M', '3M', '1Y']
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int) -> List[int]:
+    """Pids of the child processes of ``pid``."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name, in parentheses, can hold spaces
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(entry))
+    return pids
+
+
+def pss_mb(pids: List[int]) -> float:
+    """Proportional set size of the processes in MB, pages shared by n of them counting 1/n for each."""
+    total = 0
+    for pid in pids:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            total += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+    return total / 1024
+
+
+def start_api(workers: int, port: int, env: Dict[str, str], timeout: float, log_path: str) -> subprocess.Popen:
+    """Start the api with ``workers`` processes, logging to ``log_path``, and wait until all of them answer."""
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                   cwd=API_PATH, env={**env, 'WEB_CONCURRENCY': str(workers),
+                                                      'BIND': f'127.0.0.1:{port}'},
+                                   stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The api exited with code {process.returncode}, see {log_path}')
+        if len(children(process.pid)) == workers:
+            try:
+                if httpx.get(f'http://127.0.0.1:{port}/', headers=HEADERS).status_code == 200:
+                    return process
+            except httpx.TransportError:
+                pass
+        time.sleep(0.5)
+    process.kill()
+    raise TimeoutError(f'The api did not start {workers} workers in {timeout}s, see {log_path}')
+
+
+def load(request: Callable[[httpx.Client], httpx.Response], base_url: str, concurrency: int,
+         duration: float) -> Dict[str, object]:
+    """Send requests from ``concurrency`` threads for ``duration`` seconds and return the throughput and latency."""
+    deadline = time.perf_counter() + duration
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client_loop():
+        with httpx.Client(base_url=base_url, headers=HEADERS, timeout=300) as client:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    ok = request(client).status_code == 200
+                except httpx.TransportError:
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    (latencies if ok else errors).append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(lambda _: client_loop(), range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {'requests': len(latencies), 'errors': len(errors), 'throughput_rps': len(latencies) / elapsed,
+            'latency': summarize(latencies) if latencies else None}
+
+
+def workloads(pages_url: str, page_words: int) -> Dict[str, Callable[[httpx.Client], httpx.Response]]:
+    aggregates = itertools.cycle(
+        [('/get_topics_time', {'freq': f}) for f in FREQS]
+        + [(f'/sections/{s}/topics_sentiment', {'freq': f, 'top_n': 15}) for s in SECTIONS for f in FREQS])
+    seeds = itertools.count(1)
+
+    def get_aggregate(client):
+        path, params = next(aggregates)
+        return client.get(path, params=params)
+
+    return {'aggregates': get_aggregate,
+            'url_miss': lambda client: client.get('/get_topics_url',
+                                                  params={'url': f'{pages_url}/{next(seeds)}/{page_words}'})}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of client threads')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of every workload')
+    parser.add_argument('--workloads', nargs='+', default=['aggregates', 'url_miss'])
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    parser.add_argument('--docs-per-section', type=int, default=200_000)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--page-words', type=int, default=2_000)
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--output', help='JSON file of the results, benchmarks/results/workers-<commit>.json by default')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-workers-')
+    assets_path = os.path.join(work_dir, 'assets')
+    print(f'Writing the synthetic assets to {assets_path}')
+    fixtures = make_assets(assets_path, args.model_path, args.docs_per_section, args.years)
+    server = start_page_server(load_words())
+    pages_url = f'http://127.0.0.1:{server.server_port}'
+    runs = []
+    print(f'{"workers":>8} {"workload":>12} {"rps":>9} {"p50 (s)":>9} {"p99 (s)":>9} {"PSS (MB)":>10}')
+    for n_workers in args.workers:
+        run_dir = os.path.join(work_dir, f'run-{n_workers}')
+        os.makedirs(os.path.join(run_dir, 'db'))
+        env = {**os.environ, 'ASSETS_PATH': assets_path, 'DB_PATH': os.path.join(run_dir, 'db', 'topics.db'),
+               'PROMETHEUS_MULTIPROC_DIR': os.path.join(run_dir, 'metrics')}
+        port = free_port()
+        process = start_api(n_workers, port, env, args.startup_timeout, os.path.join(run_dir, 'api.log'))
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            for name, request in workloads(pages_url, args.page_words).items():
+                if name not in args.workloads:
+                    continue
+                # Every worker aggregates its stores and runs the model once before being measured
+                load(request, base_url, args.concurrency, min(5.0, args.duration))
+                result = load(request, base_url, args.concurrency, args.duration)
+                result.update(workers=n_workers, workload=name,
+                              pss_mb=pss_mb([process.pid] + children(process.pid)))
+                runs.append(result)
+                latency = result['latency'] or {'p50': float('nan'), 'p99': float('nan')}
+                print(f'{n_workers:>8} {name:>12} {result["throughput_rps"]:>9.1f} {latency["p50"]:>9.3f} '
+                      f'{latency["p99"]:>9.3f} {result["pss_mb"]:>10.0f}')
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+    server.shutdown()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {'commit': commit, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'cpus': os.cpu_count(),
+              'concurrency': args.concurrency, 'duration': args.duration,
+              'fixtures': {'docs_per_section': args.docs_per_section, 'years': args.years,
+                           'page_words': args.page_words, **fixtures},
+              'runs': runs}
+    output = args.output or os.path.join(API_PATH, 'benchmarks', 'results', f'workers-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Convert the JSON assets of the API to the columnar format it loads lazily.
+
+``topics_overtime.json`` and ``topics_and_docs_sentiment.json`` hold a JSON records string per section. Each section
+is written to ``<assets>/columnar/<asset>/<section>.parquet`` with parsed timestamps, rows sorted by
+(Topic, Timestamp) and the topic names stored as dictionaries.
+
+Run from the api folder:
+
+    python build_assets.py --assets-path assets
+"""
+import argparse
+import json
+import os
+import time
+
+from aggregates import parse_json_frames
+from columnar import write_parquet_frames
+
+ASSETS = ('topics_overtime', 'topics_and_docs_sentiment')
+
+
+def build_asset(assets_path: str, name: str):
+    """Convert ``<assets_path>/<name>.json`` to ``<assets_path>/columnar/<name>``."""
+    start = time.perf_counter()
+    with open(os.path.join(assets_path, f'{name}.json')) as f:
+        frames = parse_json_frames(json.load(f))
+    write_parquet_frames(dict(frames), os.path.join(assets_path, 'columnar', name))
+    print(f'{name}: {sum(len(df) for df in frames.values())} rows in {time.perf_counter() - start:.1f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--assets-path', default='assets')
+    parser.add_argument('--assets', nargs='+', default=ASSETS, choices=ASSETS)
+    args = parser.parse_args()
+    for name in args.assets:
+        build_asset(args.assets_path, name)
+
+
+if __name__ == '__main__':
+    main()
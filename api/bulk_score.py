@@ -0,0 +1,246 @@
+"""Score a corpus of filings with the saved topic models and write the assets served by the api.
+
+The input is a CSV or Parquet file in the schema of ``data_sample.csv``: one filing per row with its ``ticker``,
+``companyName``, ``filedAt`` and the text of its ``Section1``, ``Section1A`` and ``Section7``. Filings are read
+``--batch-size`` rows at a time. Every section is split into chunks with the tokenizer of the embedding model, the
+chunks are embedded, and their sentiment classified, on a pool of worker processes, and their topics are assigned
+with the saved ``topic_models``.
+
+The scored chunks of every batch are written to ``<work-dir>/parts``, and batches with a part are skipped, so an
+interrupted run resumes where it stopped and a run on the filings of a new year only scores those. The
+``topics_overtime`` and ``topics_and_docs_sentiment`` assets of all the parts are then built from their narrow
+columns, never the texts, in the columnar format the api loads.
+
+The assets are built in ``<work-dir>/assets``, and the assets served by the api are left as they are. To add the
+new parts to the served assets, accumulate them with ``accumulate_scores.py``. With ``--publish`` the assets are
+built in ``--assets-path`` instead, replacing the served ones, which only suits parts covering every filing, such
+as the first scoring of the whole corpus. Run from the api folder:
+
+    python bulk_score.py filings_2023.csv --workers 4
+    python bulk_score.py filings_*.csv --workers 4 --publish
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from columnar import prepare_frame, read_parquet_metadata, write_parquet_frames
+from model_registry import EMBEDDING_MODEL_NAME, ModelRegistry
+from topic_index import TopicIndex
+
+SECTIONS = [f'Section{s}' for s in ['1', '1A', '7']]
+META_COLUMNS = ['ticker', 'companyName', 'filedAt']
+SENTIMENT_MODEL = 'Sigma/financial-sentiment-analysis'
+SENTIMENT_LABELS = {'LABEL_0': 'NEGATIVE', 'LABEL_1': 'NEUTRAL', 'LABEL_2': 'POSITIVE'}
+# Schema metadata of the assets listing the parts they were built from
+PARTS_METADATA_KEY = 'bulk_score_parts'
+
+# Models of a worker process, loaded once by init_worker
+_registry: Optional[ModelRegistry] = None
+_classifier = None
+
+
+def iter_filings(path: str, batch_size: int) -> Iterator[pd.DataFrame]:
+    """Read the metadata and section columns of a CSV or Parquet file of filings, ``batch_size`` rows at a time."""
+    columns = META_COLUMNS + SECTIONS
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_size)
+
+
+def source_id(path: str, batch_size: int) -> str:
+    """Identify the batches of an input file, so its parts are found again when the run is resumed."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.blake2b(f'{stem}:{os.path.getsize(path)}:{batch_size}'.encode(), digest_size=6).hexdigest()
+    return f'{stem}-{digest}'
+
+
+def init_worker(model_name: str, sentiment_model: Optional[str], threads: int):
+    """Load the models of a worker process once."""
+    global _registry, _classifier
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _registry = ModelRegistry(model_name).load()
+    if sentiment_model:
+        from transformers import pipeline
+        _classifier = pipeline(task='sentiment-analysis', model=sentiment_model)
+
+
+def score_texts(texts: List[Optional[str]], batch_size: int = 128) -> Tuple[List[int], np.ndarray, Optional[list]]:
+    """Split texts into chunks, embed them and classify their sentiment, in a worker process.
+
+    Returns
+    -------
+    tuple of (list of int, np.ndarray, list of dict or None)
+        Number of chunks of every text, embeddings of all the chunks and their sentiment label and score.
+
+    """
+    docs_chunks = [_registry.chunker.split_text(t) if isinstance(t, str) else [] for t in texts]
+    chunks = [chunk for doc_chunks in docs_chunks for chunk in doc_chunks]
+    model = _registry.embedding_model
+    if chunks:
+        embeddings = np.asarray(model.encode(chunks, batch_size=batch_size), dtype=np.float32)
+    else:
+        embeddings = np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    sentiment = None
+    if _classifier is not None:
+        sentiment = _classifier(chunks, batch_size=batch_size, truncation=True) if chunks else []
+    return [len(c) for c in docs_chunks], embeddings, sentiment
+
+
+def score_batch(filings: pd.DataFrame, executor: Executor, topic_indexes: Dict[str, TopicIndex],
+                tasks_per_section: int = 1, batch_size: int = 128) -> pd.DataFrame:
+    """Return the topic, and sentiment if classified, of every chunk of every section of a batch of filings.
+
+    Each section is scored in ``tasks_per_section`` tasks submitted to ``executor`` so that every worker is busy.
+    """
+    timestamps = pd.to_datetime(filings['filedAt'], utc=True).dt.tz_localize(None).to_numpy()
+    tickers, names = filings['ticker'].to_numpy(), filings['companyName'].to_numpy()
+    step = max(1, -(-len(filings) // tasks_per_section))
+    tasks = [(s, start, executor.submit(score_texts, filings[s].iloc[start:start + step].tolist(), batch_size))
+             for s in SECTIONS for start in range(0, len(filings), step)]
+    frames = []
+    for s, start, future in tasks:
+        n_chunks, embeddings, sentiment = future.result()
+        rows = np.repeat(np.arange(start, start + len(n_chunks)), n_chunks)
+        topics, scores = topic_indexes[s].transform(embeddings) if len(rows) else ([], [])
+        df = pd.DataFrame({'Section': s, 'Topic': np.asarray(topics, dtype=np.int64), 'Timestamp': timestamps[rows],
+                           'ticker': tickers[rows], 'companyName': names[rows],
+                           'Probability': np.asarray(scores, dtype=np.float32)})
+        if sentiment is not None:
+            labels = pd.Series([r['label'] for r in sentiment], dtype=object).map(SENTIMENT_LABELS)
+            df['label_sigma_fsa'] = labels.to_numpy()
+            df['score_sigma_fsa'] = np.asarray([r['score'] for r in sentiment], dtype=np.float64)
+            # Negative documents count as minus their score and neutral ones as 0, as in the sentiment notebook
+            df['sentiment_sigma_fsa'] = np.select([labels == 'NEGATIVE', labels == 'NEUTRAL'],
+                                                  [-df['score_sigma_fsa'], 0.0], df['score_sigma_fsa'])
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_part(df: pd.DataFrame, path: str):
+    """Write the scored chunks of a batch, through a temporary file so that only complete parts are resumed."""
+    tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.tmp')
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def section_frequency(paths: List[str]) -> Dict[str, pd.Series]:
+    """Number of chunks of every (Topic, Timestamp) of each section, counted part by part."""
+    frequency = {}
+    for path in paths:
+        part = pq.read_table(path, columns=['Section', 'Topic', 'Timestamp']).to_pandas()
+        for s, df in part.groupby('Section', observed=True):
+            counts = df.groupby(['Topic', 'Timestamp']).size()
+            # The running counts are bounded by the size of the asset, whatever the number of parts
+            frequency[s] = counts if s not in frequency else frequency[s].add(counts, fill_value=0).astype(np.int64)
+    return frequency
+
+
+def published_parts(assets_path: str) -> Set[str]:
+    """Ids of the parts the columnar assets in ``assets_path`` were built from, empty if not by ``build_assets``."""
+    parts = set()
+    for name in ('topics_overtime', 'topics_and_docs_sentiment'):
+        for metadata in read_parquet_metadata(os.path.join(assets_path, 'columnar', name)).values():
+            parts.update(json.loads(metadata.get(PARTS_METADATA_KEY, '[]')))
+    return parts
+
+
+def build_assets(parts_dir: str, assets_path: str, topic_indexes: Dict[str, TopicIndex]):
+    """Build the columnar topics_overtime and topics_and_docs_sentiment assets of all the parts in ``assets_path``.
+
+    The topic frequency over time is the number of chunks of every topic per filing timestamp, counted one part at
+    a time. The sentiment asset holds every chunk with a classified sentiment, read one section at a time. The ids
+    of the parts are recorded in the metadata of the assets, so that ``accumulate_scores.py`` does not count them
+    again.
+    """
+    paths = sorted(os.path.join(parts_dir, f) for f in os.listdir(parts_dir) if f.endswith('.parquet'))
+    if not paths:
+        print(f'No scored batches in {parts_dir}')
+        return
+    metadata = {PARTS_METADATA_KEY: json.dumps([os.path.basename(p) for p in paths])}
+    topics_time = {}
+    for s, counts in section_frequency(paths).items():
+        frequency = counts.rename('Frequency').reset_index()
+        frequency['Words'] = frequency['Topic'].map(topic_indexes[s].topic_words)
+        frequency['Name'] = frequency['Topic'].map(topic_indexes[s].topic_names)
+        topics_time[s] = prepare_frame(frequency[['Topic', 'Words', 'Frequency', 'Timestamp', 'Name']])
+    write_parquet_frames(topics_time, os.path.join(assets_path, 'columnar', 'topics_overtime'), metadata)
+    # Parts scored without sentiment have no sentiment columns, they are read as nulls
+    schema = pa.unify_schemas([pq.read_schema(p) for p in paths])
+    sentiment = {}
+    if 'sentiment_sigma_fsa' in schema.names:
+        dataset = ds.dataset(paths, schema=schema, format='parquet')
+        columns = [c for c in schema.names if c != 'Section']
+        for s in SECTIONS:
+            scored = (ds.field('Section') == s) & ds.field('sentiment_sigma_fsa').is_valid()
+            df = dataset.to_table(columns=columns, filter=scored).to_pandas()
+            if len(df):
+                df['Name'] = df['Topic'].map(topic_indexes[s].topic_names)
+                sentiment[s] = prepare_frame(df[['Topic', 'Name'] + [c for c in columns if c != 'Topic']])
+        write_parquet_frames(sentiment, os.path.join(assets_path, 'columnar', 'topics_and_docs_sentiment'), metadata)
+    for name, frames in [('topics_overtime', topics_time), ('topics_and_docs_sentiment', sentiment)]:
+        print(f'{name}: {sum(len(df) for df in frames.values())} rows written to {assets_path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='CSV or Parquet files of filings')
+    parser.add_argument('--work-dir', default='bulk_scoring', help='Folder of the checkpointed parts')
+    parser.add_argument('--output', help='Folder the assets are built in, <work-dir>/assets by default')
+    parser.add_argument('--publish', action='store_true',
+                        help='Build the assets in --assets-path instead, replacing the assets served by the api')
+    parser.add_argument('--assets-path', default='assets')
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    parser.add_argument('--batch-size', type=int, default=100, help='Number of filings read at a time')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--embed-batch-size', type=int, default=128)
+    parser.add_argument('--sentiment-model', default=SENTIMENT_MODEL)
+    parser.add_argument('--no-sentiment', action='store_true', help='Only write the topics_overtime asset')
+    parser.add_argument('--build-every', type=int, default=0,
+                        help='Also rebuild the assets every this many scored batches')
+    args = parser.parse_args()
+    output = args.assets_path if args.publish else args.output or os.path.join(args.work_dir, 'assets')
+
+    topic_indexes = {s: TopicIndex(os.path.join(args.model_path, f'topic_models_{s}')) for s in SECTIONS}
+    parts_dir = os.path.join(args.work_dir, 'parts')
+    os.makedirs(parts_dir, exist_ok=True)
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    sentiment_model = None if args.no_sentiment else args.sentiment_model
+    scored = 0
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(EMBEDDING_MODEL_NAME, sentiment_model, threads)) as executor:
+        for path in args.inputs:
+            prefix = source_id(path, args.batch_size)
+            for i, filings in enumerate(iter_filings(path, args.batch_size)):
+                part_path = os.path.join(parts_dir, f'{prefix}-{i:06d}.parquet')
+                if os.path.exists(part_path):
+                    continue
+                start = time.perf_counter()
+                df = score_batch(filings, executor, topic_indexes, tasks_per_section=args.workers,
+                                 batch_size=args.embed_batch_size)
+                write_part(df, part_path)
+                scored += 1
+                print(f'{path} batch {i}: {len(filings)} filings, {len(df)} chunks in '
+                      f'{time.perf_counter() - start:.1f}s')
+                if args.build_every and scored % args.build_every == 0:
+                    build_assets(parts_dir, output, topic_indexes)
+    build_assets(parts_dir, output, topic_indexes)
+
+
+if __name__ == '__main__':
+    main()
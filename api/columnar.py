@@ -0,0 +1,181 @@
+"""Columnar storage of the API assets and binary encodings of the responses."""
+import os
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, Optional
+
+import msgpack
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+# Text columns with few distinct values, stored as dictionaries
+CATEGORICAL_COLUMNS = ('Name', 'Words', 'ticker', 'companyName')
+
+
+class SectionFrames(Mapping):
+    """Read-only mapping of section to dataframe.
+
+    ``load`` returns a frame holding at least the requested columns, so that stores which only aggregate a few
+    columns do not need every column to be in memory.
+
+    Parameters
+    ----------
+    frames : dict of {str : pd.DataFrame}
+        Frame of every section.
+
+    """
+
+    def __init__(self, frames: Dict[str, pd.DataFrame]):
+        self._frames = frames
+
+    def load(self, section: str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        return self._frames[section]
+
+    def __getitem__(self, section: str) -> pd.DataFrame:
+        return self.load(section)
+
+    def __contains__(self, section) -> bool:
+        return section in self._frames
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._frames)
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+class ParquetFrames(SectionFrames):
+    """Section frames read lazily, column by column, from a folder holding a ``<section>.parquet`` per section.
+
+    Parameters
+    ----------
+    folder : str
+        Folder written by ``write_parquet_frames``.
+
+    """
+
+    def __init__(self, folder: str):
+        paths = {os.path.splitext(f)[0]: os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                 if f.endswith('.parquet')}
+        super().__init__({})
+        self.paths = paths
+        self._schema_columns = {}
+        self._lock = threading.Lock()
+
+    def load(self, section: str, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        path = self.paths[section]
+        with self._lock:
+            schema_columns = self._schema_columns.get(section)
+            if schema_columns is None:
+                schema_columns = self._schema_columns[section] = pq.read_schema(path).names
+            loaded = self._frames.get(section)
+            wanted = schema_columns if columns is None else list(columns)
+            missing = [c for c in wanted if loaded is None or c not in loaded.columns]
+            if missing:
+                new = pq.read_table(path, columns=missing).to_pandas()
+                loaded = new if loaded is None else pd.concat([loaded, new], axis=1)
+                # Keep the column order of the file whatever the order the columns were loaded in
+                self._frames[section] = loaded = loaded[[c for c in schema_columns if c in loaded.columns]]
+        return loaded
+
+    def __contains__(self, section) -> bool:
+        # Without it, Mapping would load every column of the section to check it
+        return section in self.paths
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse the timestamps, sort by (Topic, Timestamp) and store the repeated text columns as categoricals."""
+    df = df.copy()
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    for c in CATEGORICAL_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
+    return df.sort_values(['Topic', 'Timestamp'], kind='stable', ignore_index=True)
+
+
+def write_parquet_frames(frames: Dict[str, pd.DataFrame], folder: str, metadata: Optional[Dict[str, str]] = None):
+    """Write the frame of every section to ``<folder>/<section>.parquet``, with ``metadata`` in every schema."""
+    os.makedirs(folder, exist_ok=True)
+    for s, df in frames.items():
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if metadata:
+            table = table.replace_schema_metadata({**table.schema.metadata, **metadata})
+        # Write to a temporary file first, so a running API never reads a partially written file
+        tmp_path = os.path.join(folder, f'.{s}.parquet.tmp')
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, os.path.join(folder, f'{s}.parquet'))
+
+
+def read_parquet_metadata(folder: str) -> Dict[str, Dict[str, str]]:
+    """Schema metadata written by ``write_parquet_frames`` of every section of a folder, empty if there is none."""
+    if not os.path.isdir(folder):
+        return {}
+    metadata = {}
+    for f in sorted(os.listdir(folder)):
+        if f.endswith('.parquet'):
+            raw = pq.read_schema(os.path.join(folder, f)).metadata or {}
+            metadata[os.path.splitext(f)[0]] = {k.decode(): v.decode() for k, v in raw.items() if k != b'pandas'}
+    return metadata
+
+
+def _arrow_table(df: pd.DataFrame, section: str) -> pa.Table:
+    """Convert a section frame to Arrow, with dictionary columns of a common type across sections."""
+    table = pa.Table.from_pandas(df.assign(Section=section), preserve_index=False)
+    dictionary_type = pa.dictionary(pa.int32(), pa.string())
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type) or pa.types.is_string(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()).dictionary_encode()
+                                     .cast(dictionary_type))
+    return table
+
+
+def encode_frames(frames: Dict[str, pd.DataFrame], media_type: str, meta: Optional[Dict[str, str]] = None) -> bytes:
+    """Encode the frame of every section in a binary format.
+
+    Parameters
+    ----------
+    frames : dict of {str : pd.DataFrame}
+        Frame of every section.
+    media_type : str
+        ``ARROW_MEDIA_TYPE`` for an Arrow IPC stream of a single table with a ``Section`` column, the metadata
+        being stored in the schema metadata. ``MSGPACK_MEDIA_TYPE`` for a MessagePack map of the metadata and of
+        the columns of every section, timestamps being epoch milliseconds as in the JSON responses.
+    meta : dict of {str : str}, optional
+        Response metadata such as the frequency.
+
+    Returns
+    -------
+    bytes
+        Encoded frames.
+
+    """
+    meta = meta or {}
+    if media_type == ARROW_MEDIA_TYPE:
+        table = pa.concat_tables([_arrow_table(df, s) for s, df in frames.items()])
+        table = table.replace_schema_metadata({k: str(v) for k, v in meta.items()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if media_type == MSGPACK_MEDIA_TYPE:
+        sections = {}
+        for s, df in frames.items():
+            columns = {}
+            for c in df.columns:
+                values = df[c]
+                if pd.api.types.is_datetime64_any_dtype(values):
+                    values = values.to_numpy(dtype='datetime64[ms]').astype(np.int64)
+                columns[c] = values.tolist()
+            sections[s] = columns
+        return msgpack.packb({**meta, 'sections': sections})
+    raise ValueError(f'Unsupported media type {media_type}')
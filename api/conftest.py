@@ -0,0 +1,41 @@
+"""Fixtures shared by the test modules.
+
+The tests run against a copy of the URL topics database, so the tracked one and its chunk cache are left unchanged.
+``DB_PATH`` is set when pytest starts, before the test modules import the app.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from bulk_score import SECTIONS
+from test_topic_index import make_model
+from topic_index import TopicIndex
+
+TRACKED_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'topics-url-db.db')
+
+
+def pytest_configure(config):
+    config.db_folder = tempfile.mkdtemp(prefix='api-tests-')
+    db_path = os.path.join(config.db_folder, os.path.basename(TRACKED_DB_PATH))
+    if os.path.exists(TRACKED_DB_PATH):
+        shutil.copyfile(TRACKED_DB_PATH, db_path)
+    # The chunk embedding cache is created next to the database
+    os.environ['DB_PATH'] = db_path
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(config.db_folder, ignore_errors=True)
+
+
+@pytest.fixture
+def topic_indexes(tmp_path):
+    """Topic model of every section with 3 topics and the outlier topic, embedded as one-hot vectors."""
+    indexes = {}
+    for s in SECTIONS:
+        (tmp_path / s).mkdir()
+        make_model(tmp_path / s, np.eye(4, dtype=np.float32))
+        indexes[s] = TopicIndex(str(tmp_path / s))
+    return indexes
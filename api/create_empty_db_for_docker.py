@@ -1,10 +1,10 @@
-import sqlite3
-db_path = 'db/data_docker.db'
-connect = sqlite3.connect(db_path)
-cursor = connect.cursor()
-cursor.execute('''
-          CREATE TABLE IF NOT EXISTS data
-          (url text, topics_section1 text, topics_section2 text, topics_section3 text)
-          ''')
-cursor.execute(''' select * from data''').fetchone()
+import os
+import sys
 
+from database import UrlTopicsCache, make_engine
+from topic_index import TopicIndex
+
+db_path = sys.argv[1] if len(sys.argv) > 1 else 'db/data_docker.db'
+sections = [f'Section{s}' for s in ['1', '1A', '7']]
+topic_names = {s: TopicIndex(os.path.join('..', 'topic_models', f'topic_models_{s}')).topic_names for s in sections}
+UrlTopicsCache(make_engine(db_path), topic_names).create()
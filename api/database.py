@@ -1,21 +1,371 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-SQLITE_DATABASE_URL = "sqlite:///./note.db"
+try:
+    import fcntl
+except ImportError:
+    # Windows, where the api runs as a single process
+    fcntl = None
 
-engine = create_engine(
-    SQLITE_DATABASE_URL, echo=True, connect_args={"check_same_thread": False}
+from sqlalchemy import (Column, Float, ForeignKey, Index, Integer, MetaData, Table, Text, bindparam, create_engine,
+                        event, func, inspect, select, text)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection, Engine
+
+# Section of every topics column of the legacy tables
+SECTION_COLUMNS = {'Section1': 'topics_section1', 'Section1A': 'topics_section2', 'Section7': 'topics_section3'}
+# Tables of earlier versions, holding the topic names of every section joined in a string, most recent first
+LEGACY_TABLES = ('data_topics', 'data')
+# SQLite limits the number of bound parameters of a statement
+MAX_PARAMETERS = 900
+# Columns of ``urls`` identifying the version of the page the topics were extracted from
+VALIDATORS = ('etag', 'last_modified', 'content_hash')
+
+metadata = MetaData()
+
+urls = Table(
+    'urls', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('url', Text, nullable=False),
+    Column('n_chunks', Integer),
+    Column('fetched_at', Float),
+    # Validators of the fetched page, used to revalidate expired entries without running the inference again
+    Column('etag', Text),
+    Column('last_modified', Text),
+    Column('content_hash', Text),
+    Column('last_accessed', Float),
+    Index('ux_urls_url', 'url', unique=True),
+    Index('ix_urls_last_accessed', 'last_accessed'),
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
+url_topics = Table(
+    'url_topics', metadata,
+    Column('url_id', Integer, ForeignKey('urls.id', ondelete='CASCADE'), primary_key=True),
+    Column('section', Text, primary_key=True),
+    Column('chunk_index', Integer, primary_key=True),
+    Column('topic_id', Integer, nullable=False),
+    Column('score', Float),
+    Index('ix_url_topics_section_topic', 'section', 'topic_id', 'url_id'),
+)
+
+
+def make_engine(db_path: str, pool_size: int = 5) -> Engine:
+    """Create a pooled engine on an SQLite file in WAL mode.
+
+    WAL lets readers run concurrently with a writer, and ``busy_timeout`` makes writers from other connections or
+    processes wait for the lock instead of failing.
+    """
+    engine = create_engine(f'sqlite:///{db_path}', pool_size=pool_size, pool_pre_ping=True,
+                           connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+    return engine
+
+
+@contextmanager
+def process_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on ``path`` across the processes of the api, waiting for it if another one holds it.
+
+    Serializes maintenance run by every worker, such as the compaction of the URL topics cache.
+    """
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def parse_legacy_topics(joined: str, names_pattern: re.Pattern) -> List[int]:
+    """Return the ids of the topic names of a legacy string, in order.
+
+    Names were joined with commas, or with nothing in the oldest tables, and can themselves contain commas, so
+    the string is matched against the known names rather than split.
+    """
+    return [int(m.group(0).split('_', 1)[0]) for m in names_pattern.finditer(joined or '')]
+
+
+@dataclass
+class CachedUrl:
+    """Topics of a stored URL with the validators of the page they were extracted from."""
+    topics: Dict[str, List[int]]
+    fetched_at: Optional[float] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+
+    def is_fresh(self, ttl: float, now: Optional[float] = None) -> bool:
+        """Whether the topics were extracted less than ``ttl`` seconds ago. A ``ttl`` of 0 or less never expires.
+
+        URLs migrated from the legacy tables have no fetch time and are always revalidated.
+        """
+        if ttl <= 0:
+            return True
+        return self.fetched_at is not None and (now or time.time()) - self.fetched_at < ttl
+
+
+class UrlTopicsCache:
+    """Topics of the URLs already scraped.
+
+    Every URL is a row of ``urls``, and the topic id and similarity score of each of its chunks for every section
+    is a row of ``url_topics``, indexed by (section, topic_id) for reverse lookups.
+
+    The most recently requested URLs are also kept in memory, in front of SQLite. Accesses are recorded in memory
+    and written when the cache is compacted, which evicts the least recently used URLs beyond a maximum number.
+    Several processes can share the database. Each one keeps its own URLs in memory, so topics stored again by a
+    process are seen by the others once their in-memory entry is evicted or expires.
+
+    Parameters
+    ----------
+    engine : Engine
+        Engine created with ``make_engine``.
+    topic_names : dict of {str : dict of {int : str}}
+        Topic names of every section, used to migrate the legacy tables.
+    hot_size : int, optional
+        Maximum number of URLs kept in memory.
+
+    """
+
+    def __init__(self, engine: Engine, topic_names: Dict[str, Dict[int, str]], hot_size: int = 1024):
+        self.engine = engine
+        self.topic_names = topic_names
+        self.hot_size = hot_size
+        self.stats = Counter()
+        self._hot: 'OrderedDict[str, CachedUrl]' = OrderedDict()
+        self._accessed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def create(self):
+        """Create the tables, and migrate the legacy tables and columns to the current schema."""
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # Let compaction give the pages of evicted URLs back to the file system. Databases created without it
+            # need a VACUUM for the setting to take effect
+            conn.execute(text('PRAGMA auto_vacuum=INCREMENTAL'))
+            if conn.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+                conn.execute(text('VACUUM'))
+        with self.engine.begin() as conn:
+            metadata.create_all(conn)
+            inspector = inspect(conn)
+            existing = inspector.get_table_names()
+            url_columns = {c['name'] for c in inspector.get_columns('urls')}
+            for column in urls.columns:
+                if column.name not in url_columns:
+                    column_type = column.type.compile(conn.dialect)
+                    conn.execute(text(f'ALTER TABLE urls ADD COLUMN {column.name} {column_type}'))
+            for index in urls.indexes:
+                index.create(conn, checkfirst=True)
+            for table in LEGACY_TABLES:
+                if table in existing:
+                    self._migrate_legacy(conn, table)
+
+    def _migrate_legacy(self, conn: Connection, table: str):
+        """Move the rows of a legacy table into the normalized tables and drop it.
+
+        URLs already present in the normalized tables are left untouched. Legacy rows have no scores.
+        """
+        patterns = {s: re.compile('|'.join(re.escape(n) for n in sorted(names.values(), key=len, reverse=True)))
+                    for s, names in self.topic_names.items()}
+        columns = ', '.join(SECTION_COLUMNS.values())
+        urls_topics = {}
+        # Later rows of a URL replace earlier ones, as they would have with an upsert
+        for row in conn.execute(text(f'SELECT url, {columns} FROM {table} ORDER BY rowid')).mappings():
+            urls_topics[row['url']] = {s: (parse_legacy_topics(row[c], patterns[s]), None)
+                                       for s, c in SECTION_COLUMNS.items()}
+        stored = {row[0] for row in conn.execute(select(urls.c.url))}
+        self._upsert(conn, {url: topics for url, topics in urls_topics.items() if url not in stored},
+                     fetched_at=None)
+        conn.execute(text(f'DROP TABLE {table}'))
+
+    def get(self, url: str) -> Optional[Dict[str, List[int]]]:
+        """Return the topic id of every chunk of a URL for each section, or None if it is not stored."""
+        return self.get_many([url]).get(url)
+
+    def get_many(self, urls_list: Iterable[str]) -> Dict[str, Dict[str, List[int]]]:
+        """Return the topic id of every chunk for each section of the stored URLs among ``urls_list``."""
+        return {url: entry.topics for url, entry in self.lookup_many(urls_list).items()}
+
+    def lookup(self, url: str) -> Optional[CachedUrl]:
+        """Return the stored topics and page validators of a URL, or None if it is not stored."""
+        return self.lookup_many([url]).get(url)
+
+    def lookup_many(self, urls_list: Iterable[str]) -> Dict[str, CachedUrl]:
+        """Return the stored topics and page validators of the stored URLs among ``urls_list``.
+
+        URLs are looked up in memory first, and the ones read from SQLite are kept in memory. Every URL found is
+        marked as accessed.
+        """
+        urls_list = list(urls_list)
+        now = time.time()
+        with self._lock:
+            found = {url: self._hot[url] for url in urls_list if url in self._hot}
+            for url in found:
+                self._hot.move_to_end(url)
+        self.stats['hot_hits'] += len(found)
+        missing = [url for url in urls_list if url not in found]
+        with self.engine.connect() as conn:
+            for i in range(0, len(missing), MAX_PARAMETERS):
+                query = (select(urls.c.url, urls.c.fetched_at, urls.c.etag, urls.c.last_modified,
+                                urls.c.content_hash, url_topics.c.section, url_topics.c.topic_id)
+                         .select_from(urls.outerjoin(url_topics, urls.c.id == url_topics.c.url_id))
+                         .where(urls.c.url.in_(missing[i:i + MAX_PARAMETERS]))
+                         .order_by(urls.c.id, url_topics.c.section, url_topics.c.chunk_index))
+                for url, fetched_at, etag, last_modified, content_hash, section, topic_id in conn.execute(query):
+                    entry = found.get(url)
+                    if entry is None:
+                        found[url] = entry = CachedUrl({s: [] for s in SECTION_COLUMNS}, fetched_at, etag,
+                                                       last_modified, content_hash)
+                        self._remember(url, entry)
+                    if section is not None:
+                        entry.topics[section].append(topic_id)
+        n_misses = sum(1 for url in missing if url not in found)
+        self.stats['db_hits'] += len(missing) - n_misses
+        self.stats['misses'] += n_misses
+        with self._lock:
+            self._accessed.update((url, now) for url in found)
+        return found
+
+    def _remember(self, url: str, entry: CachedUrl):
+        """Keep an entry in memory, dropping the least recently used one beyond ``hot_size``."""
+        if self.hot_size <= 0:
+            return
+        with self._lock:
+            self._hot[url] = entry
+            self._hot.move_to_end(url)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+
+    def upsert_many(self, urls_topics: Dict[str, Dict[str, Tuple[Sequence[int], Optional[Sequence[float]]]]],
+                    validators: Optional[Dict[str, Dict[str, Optional[str]]]] = None):
+        """Insert or replace the topics of several URLs in one transaction.
+
+        Parameters
+        ----------
+        urls_topics : dict of {str : dict of {str : tuple}}
+            For every URL and section, the topic ids of the chunks and their similarity scores (or None).
+        validators : dict of {str : dict of {str : str}}, optional
+            For every URL, the ``etag``, ``last_modified`` and ``content_hash`` of the page the topics were
+            extracted from. Missing validators are stored as NULL.
+
+        """
+        fetched_at = time.time()
+        with self.engine.begin() as conn:
+            self._upsert(conn, urls_topics, fetched_at=fetched_at, validators=validators)
+        validators = validators or {}
+        for url, topics_doc in urls_topics.items():
+            self._remember(url, CachedUrl({s: [int(t) for t in ids] for s, (ids, _) in topics_doc.items()},
+                                          fetched_at, **{k: validators.get(url, {}).get(k) for k in VALIDATORS}))
+        with self._lock:
+            self._accessed.update((url, fetched_at) for url in urls_topics)
+
+    def revalidate(self, url: str, validators: Optional[Dict[str, Optional[str]]] = None):
+        """Mark the stored topics of a URL as fresh, after checking that its page did not change.
+
+        Parameters
+        ----------
+        url : str
+            Stored URL.
+        validators : dict of {str : str}, optional
+            New ``etag``, ``last_modified`` or ``content_hash`` of the page. Validators that are missing or None
+            keep their stored value.
+
+        """
+        fetched_at = time.time()
+        values = {k: v for k, v in (validators or {}).items() if k in VALIDATORS and v is not None}
+        with self.engine.begin() as conn:
+            conn.execute(urls.update().where(urls.c.url == url).values(fetched_at=fetched_at, **values))
+        with self._lock:
+            entry = self._hot.get(url)
+            if entry is not None:
+                self._hot[url] = CachedUrl(entry.topics, fetched_at, **{k: values.get(k, getattr(entry, k))
+                                                                        for k in VALIDATORS})
+
+    def compact(self, max_urls: int) -> int:
+        """Write the recorded accesses, evict the least recently used URLs beyond ``max_urls`` and shrink the file.
+
+        URLs never accessed since they were stored are ordered by their fetch time.
+
+        Returns
+        -------
+        int
+            Number of URLs evicted.
 
+        """
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+        rows = [{'u': url, 't': t} for url, t in accessed.items()]
+        with self.engine.begin() as conn:
+            if rows:
+                conn.execute(urls.update().where(urls.c.url == bindparam('u')).values(last_accessed=bindparam('t')),
+                             rows)
+            n_urls = conn.execute(select(func.count()).select_from(urls)).scalar()
+            evicted = []
+            if n_urls > max_urls:
+                last_used = func.coalesce(urls.c.last_accessed, urls.c.fetched_at, 0)
+                evicted = conn.execute(select(urls.c.id, urls.c.url).order_by(last_used, urls.c.id)
+                                       .limit(n_urls - max_urls)).all()
+                ids = [row.id for row in evicted]
+                for i in range(0, len(ids), MAX_PARAMETERS):
+                    # The chunk topics are deleted by the foreign key cascade
+                    conn.execute(urls.delete().where(urls.c.id.in_(ids[i:i + MAX_PARAMETERS])))
+        with self._lock:
+            for row in evicted:
+                self._hot.pop(row.url, None)
+        if evicted:
+            with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                conn.execute(text('PRAGMA incremental_vacuum'))
+                conn.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        self.stats['evictions'] += len(evicted)
+        return len(evicted)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    @staticmethod
+    def _upsert(conn: Connection, urls_topics: Dict, fetched_at: Optional[float],
+                validators: Optional[Dict[str, Dict[str, Optional[str]]]] = None):
+        if not urls_topics:
+            return
+        validators = validators or {}
+        url_rows = [{'url': url, 'n_chunks': max((len(ids) for ids, _ in topics_doc.values()), default=0),
+                     'fetched_at': fetched_at, **{k: validators.get(url, {}).get(k) for k in VALIDATORS}}
+                    for url, topics_doc in urls_topics.items()]
+        statement = insert(urls)
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=['url'], set_={c: statement.excluded[c] for c in ('n_chunks', 'fetched_at') + VALIDATORS}),
+            url_rows)
+        url_ids = {}
+        urls_list = list(urls_topics)
+        for i in range(0, len(urls_list), MAX_PARAMETERS):
+            url_ids.update(conn.execute(select(urls.c.url, urls.c.id).where(
+                urls.c.url.in_(urls_list[i:i + MAX_PARAMETERS]))).all())
+        ids_list = list(url_ids.values())
+        for i in range(0, len(ids_list), MAX_PARAMETERS):
+            conn.execute(url_topics.delete().where(url_topics.c.url_id.in_(ids_list[i:i + MAX_PARAMETERS])))
+        topic_rows = [{'url_id': url_ids[url], 'section': s, 'chunk_index': j, 'topic_id': int(topic_id),
+                       'score': None if scores is None else float(scores[j])}
+                      for url, topics_doc in urls_topics.items() for s, (ids, scores) in topics_doc.items()
+                      for j, topic_id in enumerate(ids)]
+        if topic_rows:
+            conn.execute(url_topics.insert(), topic_rows)
 
+    def urls_by_topic(self, section: str, topic_id: int, limit: int = 100) -> List[Dict]:
+        """Return the URLs with chunks assigned to a topic, with the number of chunks, most frequent first."""
+        count = func.count().label('count')
+        query = (select(urls.c.url, count)
+                 .select_from(url_topics.join(urls, urls.c.id == url_topics.c.url_id))
+                 .where(url_topics.c.section == section, url_topics.c.topic_id == topic_id)
+                 .group_by(url_topics.c.url_id).order_by(count.desc(), urls.c.url).limit(limit))
+        with self.engine.connect() as conn:
+            return [{'url': url, 'count': n} for url, n in conn.execute(query)]
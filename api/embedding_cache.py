@@ -0,0 +1,228 @@
+"""Persistent cache of chunk embeddings and topic assignments, keyed by a hash of the chunk text."""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Column, Float, Index, Integer, MetaData, Table, Text, bindparam, event, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from database import MAX_PARAMETERS, make_engine
+from inference import StackedTopicScorer
+
+metadata = MetaData()
+
+chunks = Table(
+    'chunks', metadata,
+    Column('key', Text, primary_key=True),
+    # Row of the embedding in the vectors file
+    Column('slot', Integer, nullable=False, unique=True),
+    # JSON of the topic id and score of every section, NULL once the topic models change
+    Column('assignment', Text),
+    Column('last_used', Float, nullable=False),
+    Index('ix_chunks_last_used', 'last_used'),
+)
+
+cache_meta = Table(
+    'cache_meta', metadata,
+    Column('name', Text, primary_key=True),
+    Column('value', Text),
+)
+
+
+def chunk_key(chunk: str) -> str:
+    """Hash of a chunk with its whitespace normalized, so the same text laid out differently shares an entry."""
+    return hashlib.blake2b(' '.join(chunk.split()).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ChunkEmbeddingCache:
+    """Embedding and topic assignment of the chunks already scored, shared by every URL.
+
+    Embeddings are stored as float16 in a fixed size memory-mapped file of ``capacity`` rows, and an SQLite index
+    maps the hash of every chunk to its row, its topic assignment and the last time it was used. Once the file is
+    full, the least recently used chunks are evicted and their rows reused.
+
+    The cache is emptied when the embedding model or the layout changes. When only the topic models change, the
+    assignments are dropped and recomputed from the stored embeddings, without embedding the chunks again.
+
+    Parameters
+    ----------
+    folder : str
+        Folder holding ``index.db`` and ``vectors.f16``.
+    dim : int
+        Dimension of the embeddings.
+    capacity : int, optional
+        Maximum number of chunks.
+    model_name : str, optional
+        Name of the embedding model.
+    topics_version : str, optional
+        Fingerprint of the topic models, such as ``StackedTopicScorer.fingerprint``.
+
+    """
+
+    def __init__(self, folder: str, dim: int, capacity: int = 200_000, model_name: str = '',
+                 topics_version: str = ''):
+        os.makedirs(folder, exist_ok=True)
+        self.dim = dim
+        self.capacity = capacity
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self.engine = make_engine(os.path.join(folder, 'index.db'))
+
+        # Take the write lock when a transaction begins rather than on its first write, so that concurrent
+        # processes allocating rows of the vectors file wait for each other instead of failing
+        @event.listens_for(self.engine, 'connect')
+        def disable_driver_transactions(dbapi_connection, _):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(self.engine, 'begin')
+        def begin_immediate(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+        vectors_path = os.path.join(folder, 'vectors.f16')
+        layout = {'model_name': model_name, 'dim': str(dim), 'capacity': str(capacity)}
+        with self.engine.begin() as conn:
+            metadata.create_all(conn)
+            stored = dict(conn.execute(select(cache_meta.c.name, cache_meta.c.value)).all())
+            reset = any(stored.get(k) != v for k, v in layout.items()) or not os.path.exists(vectors_path)
+            if reset:
+                conn.execute(chunks.delete())
+                with open(vectors_path, 'wb') as f:
+                    f.truncate(capacity * dim * np.dtype(np.float16).itemsize)
+            elif stored.get('topics_version') != topics_version:
+                conn.execute(chunks.update().values(assignment=None))
+            statement = insert(cache_meta)
+            conn.execute(statement.on_conflict_do_update(index_elements=['name'],
+                                                         set_={'value': statement.excluded.value}),
+                         [{'name': k, 'value': v} for k, v in {**layout, 'topics_version': topics_version}.items()])
+        self.vectors = np.memmap(vectors_path, dtype=np.float16, mode='r+', shape=(capacity, dim))
+
+    def __len__(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(chunks)).scalar()
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the chunks looked up that were found, since the cache was opened."""
+        looked_up = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / looked_up if looked_up else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        """Counters of the cache, with its hit rate and size."""
+        return {'hits': self.stats['hits'], 'misses': self.stats['misses'], 'hit_rate': self.hit_rate,
+                'rescored': self.stats['rescored'], 'evictions': self.stats['evictions'], 'size': len(self),
+                'capacity': self.capacity}
+
+    def lookup(self, keys: Iterable[str]) -> Dict[str, Tuple[int, Dict[str, Tuple[int, float]]]]:
+        """Return the row and the topic assignment (or None) of the stored keys, marking them as used."""
+        return self._lookup(keys)[0]
+
+    def _lookup(self, keys: Iterable[str]) -> Tuple[Dict[str, Tuple[int, Dict[str, Tuple[int, float]]]],
+                                                    Dict[str, np.ndarray]]:
+        """Return ``lookup`` and a float32 copy of the embeddings of the stored keys without a topic assignment.
+
+        The embeddings are copied while holding the locks ``put`` takes, so that their rows cannot be evicted and
+        reused by another chunk in between.
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock, self.engine.begin() as conn:
+            for i in range(0, len(keys), MAX_PARAMETERS):
+                batch = keys[i:i + MAX_PARAMETERS]
+                for key, slot, assignment in conn.execute(select(chunks.c.key, chunks.c.slot, chunks.c.assignment)
+                                                          .where(chunks.c.key.in_(batch))):
+                    found[key] = (slot, None if assignment is None else json.loads(assignment))
+                conn.execute(chunks.update().where(chunks.c.key.in_(batch)).values(last_used=time.time()))
+            unassigned = [key for key, (_, assignment) in found.items() if assignment is None]
+            vectors = self.vectors[[found[key][0] for key in unassigned]].astype(np.float32)
+        return found, dict(zip(unassigned, vectors))
+
+    def put(self, keys: Sequence[str], embeddings: np.ndarray,
+            assignments: Dict[str, Dict[str, Tuple[int, float]]]):
+        """Store the embeddings and topic assignments of new keys, evicting the least recently used ones if full.
+
+        Keys stored in the meantime by another process are skipped.
+        """
+        keys, embeddings = list(keys)[-self.capacity:], embeddings[-self.capacity:]
+        with self._lock, self.engine.begin() as conn:
+            stored = set()
+            for i in range(0, len(keys), MAX_PARAMETERS):
+                stored.update(conn.execute(select(chunks.c.key).where(
+                    chunks.c.key.in_(keys[i:i + MAX_PARAMETERS]))).scalars())
+            new = [i for i, key in enumerate(keys) if key not in stored]
+            if not new:
+                return
+            next_slot = conn.execute(select(func.coalesce(func.max(chunks.c.slot), -1))).scalar() + 1
+            slots = list(range(next_slot, min(next_slot + len(new), self.capacity)))
+            if len(slots) < len(new):
+                evicted = conn.execute(select(chunks.c.key, chunks.c.slot).order_by(chunks.c.last_used)
+                                       .limit(len(new) - len(slots))).all()
+                evicted_keys = [row.key for row in evicted]
+                for i in range(0, len(evicted_keys), MAX_PARAMETERS):
+                    conn.execute(chunks.delete().where(chunks.c.key.in_(evicted_keys[i:i + MAX_PARAMETERS])))
+                slots += [row.slot for row in evicted]
+                self.stats['evictions'] += len(evicted)
+            self.vectors[slots] = embeddings[new].astype(np.float16)
+            now = time.time()
+            conn.execute(chunks.insert(), [{'key': keys[i], 'slot': slot, 'last_used': now,
+                                            'assignment': json.dumps(assignments[keys[i]])}
+                                           for i, slot in zip(new, slots)])
+
+    def _set_assignments(self, assignments: Dict[str, Dict[str, Tuple[int, float]]]):
+        with self.engine.begin() as conn:
+            conn.execute(chunks.update().where(chunks.c.key == bindparam('k')).values(assignment=bindparam('a')),
+                         [{'k': key, 'a': json.dumps(a)} for key, a in assignments.items()])
+
+    def assign(self, texts: List[str], embed: Callable[[List[str]], np.ndarray],
+               scorer: StackedTopicScorer) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        """Assign a topic of every section to each chunk, embedding only the chunks not in the cache.
+
+        Parameters
+        ----------
+        texts : list of str
+            Chunks to assign.
+        embed : callable
+            Function returning the embeddings (n_chunks, dim) of a list of chunks.
+        scorer : StackedTopicScorer
+            Scorer of the topic models.
+
+        Returns
+        -------
+        tuple of (dict of {str : np.ndarray}, dict of {str : np.ndarray})
+            Topic ids and the cosine similarity of the assigned topic, per section, as ``scorer.assign``.
+
+        """
+        keys = [chunk_key(t) for t in texts]
+        found, unassigned = self._lookup(set(keys))
+        assignments = {key: a for key, (_, a) in found.items() if a is not None}
+        rescore = list(unassigned)
+        if rescore:
+            embeddings = np.stack([unassigned[key] for key in rescore])
+            rescored = self._assignments(rescore, scorer.assign(embeddings))
+            self._set_assignments(rescored)
+            assignments.update(rescored)
+            self.stats['rescored'] += len(rescore)
+        # Chunks repeated within the texts are embedded once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            embeddings = np.asarray(embed(list(missing.values())), dtype=np.float32)
+            new = self._assignments(list(missing), scorer.assign(embeddings))
+            self.put(list(missing), embeddings, new)
+            assignments.update(new)
+        n_misses = sum(1 for key in keys if key in missing)
+        self.stats['hits'] += len(keys) - n_misses
+        self.stats['misses'] += n_misses
+        topics = {s: np.array([assignments[key][s][0] for key in keys], dtype=int) for s in scorer.sections}
+        scores = {s: np.array([assignments[key][s][1] for key in keys], dtype=np.float32) for s in scorer.sections}
+        return topics, scores
+
+    @staticmethod
+    def _assignments(keys: List[str], assigned: Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]) -> \
+            Dict[str, Dict[str, Tuple[int, float]]]:
+        """Convert the output of ``StackedTopicScorer.assign`` to a topic id and score per section of every key."""
+        topics, scores = assigned
+        return {key: {s: (int(topics[s][i]), float(scores[s][i])) for s in topics} for i, key in enumerate(keys)}
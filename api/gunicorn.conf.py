@@ -0,0 +1,48 @@
+"""Gunicorn settings of the api running as several uvicorn worker processes.
+
+The app is imported once, before the workers are forked, so the embedding model, the stacked topic embeddings and
+the preloaded assets are shared by all the workers as copy-on-write pages instead of being loaded by each of them.
+The topic embeddings and the chunk embedding cache are memory-mapped files, shared through the page cache. Every
+worker opens its own database connections after the fork, and the URL topics database is compacted by one worker at
+a time. Run from the repository root, with WEB_CONCURRENCY workers:
+
+    WEB_CONCURRENCY=4 gunicorn -c api/gunicorn.conf.py api.app:app
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+# Module level names are read as settings, and config is one of them
+from decouple import config as env_config
+
+bind = env_config('BIND', default='0.0.0.0:8037')
+workers = env_config('WEB_CONCURRENCY', default=1, cast=int)
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+# Seconds a worker can stay unresponsive before it is restarted
+timeout = env_config('WORKER_TIMEOUT', default=120, cast=int)
+# Seconds idle connections are kept open. The gunicorn default of 2 lets the keep-alive timer of uvicorn close
+# connections whose response is still streamed through the middlewares when a worker is busy
+keepalive = env_config('KEEPALIVE', default=5, cast=int)
+
+os.environ.setdefault('PRELOAD_ASSETS', 'true')
+# Split the cores between the workers rather than every worker running a thread per core
+os.environ.setdefault('OMP_NUM_THREADS', str(max(1, (os.cpu_count() or 1) // workers)))
+# The metrics of every worker are written to this folder and merged when /metrics is scraped. It is emptied first,
+# so counters of a previous run are not merged in
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'topics-api-metrics'))
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    # Move the objects allocated while loading the app out of reach of the garbage collector, whose passes in the
+    # workers would otherwise write to their pages and copy them
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
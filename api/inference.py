@@ -0,0 +1,205 @@
+"""Shared inference stage used to assign the topics of all the section models at once."""
+import hashlib
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of ``matrix`` with every row scaled to unit L2 norm.
+
+    Rows with zero norm are left untouched so that they score 0 against everything.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# Dtypes the unit topic embeddings can be stored in besides float32, int8 with a scale per topic
+QUANTIZED_DTYPES = ('float16', 'int8')
+
+
+def quantize_rows(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Quantize the rows of ``matrix``, scaled to unit norm, to float16 or to int8.
+
+    Int8 rows are stored as ``round(row / scale)`` with ``scale = max(abs(row)) / 127``, so every row uses the whole
+    int8 range.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        Matrix of shape (n_rows, dim).
+    dtype : str
+        ``float16`` or ``int8``.
+
+    Returns
+    -------
+    tuple of (np.ndarray, np.ndarray or None)
+        Quantized rows, and the float32 scale of every row for int8.
+
+    """
+    unit = normalize_rows(matrix)
+    if dtype == 'float16':
+        return unit.astype(np.float16), None
+    if dtype == 'int8':
+        scales = np.abs(unit).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(unit / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f'Unknown quantized dtype {dtype}. Use one of {", ".join(QUANTIZED_DTYPES)}')
+
+
+def dequantize_rows(values: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """Float32 rows of quantized ``values``, multiplied by their ``scales`` if there are."""
+    rows = np.asarray(values, dtype=np.float32)
+    return rows * scales[:, None] if scales is not None else rows
+
+
+class StackedTopicScorer:
+    """Score document embeddings against the topic embeddings of several sections in one matrix product.
+
+    The topic embeddings of every section are normalised and stacked into a single (dim, n_topics_total)
+    matrix, so a batch of documents is scored against all sections with one ``@``. Topic ids are then
+    recovered per section with an argmax over the section's column block, which reproduces the cosine
+    similarity branch of ``BERTopic.transform`` used by models saved with safetensors.
+
+    Parameters
+    ----------
+    topic_embeddings : dict of {str : np.ndarray}
+        Topic embedding matrix (n_topics, dim) of each section.
+    outliers : dict of {str : int}
+        Number of outlier topics (1 if topic -1 is present) of each section, used to map rows to topic ids.
+    scales : dict of {str : np.ndarray}, optional
+        Scale of every topic of each section, for int8 embeddings quantized by ``quantize_rows``.
+
+    Embeddings quantized by ``quantize_rows`` are stacked in their dtype, half or a quarter of the float32 memory,
+    and only converted to float32 for the duration of a product. Their similarities are multiplied by the scales of
+    the topics, if any, after the product.
+
+    """
+
+    def __init__(self, topic_embeddings: Dict[str, np.ndarray], outliers: Dict[str, int],
+                 scales: Optional[Dict[str, np.ndarray]] = None):
+        self.sections = list(topic_embeddings)
+        # Quantized embeddings are already unit rows
+        blocks = [topic_embeddings[s] if np.asarray(topic_embeddings[s]).dtype.name in QUANTIZED_DTYPES
+                  else normalize_rows(topic_embeddings[s]) for s in self.sections]
+        self.offsets = np.cumsum([0] + [b.shape[0] for b in blocks])
+        self.matrix = np.ascontiguousarray(np.vstack(blocks).T)
+        self.scales = np.concatenate([scales[s] for s in self.sections]).astype(np.float32) if scales else None
+        self.outliers = dict(outliers)
+
+    @classmethod
+    def from_indexes(cls, topic_indexes: Dict) -> 'StackedTopicScorer':
+        """Build the scorer from a dictionary of ``TopicIndex`` objects."""
+        scales = {s: idx.scales for s, idx in topic_indexes.items()}
+        return cls({s: idx.embeddings for s, idx in topic_indexes.items()},
+                   {s: idx.outliers for s, idx in topic_indexes.items()},
+                   scales if all(v is not None for v in scales.values()) else None)
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the sections, topic embeddings and outliers, which changes whenever a topic model does."""
+        digest = hashlib.blake2b(digest_size=16)
+        for i, s in enumerate(self.sections):
+            digest.update(f'{s}:{self.outliers[s]}:{self.offsets[i + 1] - self.offsets[i]};'.encode())
+        digest.update(self.matrix.tobytes())
+        if self.scales is not None:
+            digest.update(self.scales.tobytes())
+        return digest.hexdigest()
+
+    def similarity(self, embeddings: np.ndarray) -> np.ndarray:
+        """Cosine similarity (n_docs, n_topics_total) of document embeddings to the topics of every section."""
+        similarity = normalize_rows(embeddings) @ self.matrix
+        if self.scales is not None:
+            similarity *= self.scales
+        return similarity
+
+    def section_embeddings(self, section: str) -> np.ndarray:
+        """Unit topic embeddings (n_topics, dim) of a section, in float32."""
+        i = self.sections.index(section)
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return dequantize_rows(self.matrix[:, start:stop].T, None if self.scales is None else self.scales[start:stop])
+
+    def assign(self, embeddings: np.ndarray, timings: Optional[Dict[str, float]] = None) -> \
+            Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        """Assign a topic of every section to each embedding.
+
+        Parameters
+        ----------
+        embeddings : np.ndarray
+            Document embeddings of shape (n_docs, dim).
+        timings : dict of {str : float}, optional
+            If given, filled with the seconds taken by the similarity product of all the sections, under
+            ``similarity``, and by the assignment of every section, under its name.
+
+        Returns
+        -------
+        tuple of (dict of {str : np.ndarray}, dict of {str : np.ndarray})
+            Topic ids and the cosine similarity of the assigned topic, per section.
+
+        """
+        start = time.perf_counter()
+        similarity = self.similarity(embeddings)
+        if timings is not None:
+            timings['similarity'] = time.perf_counter() - start
+        topics, scores = {}, {}
+        for i, s in enumerate(self.sections):
+            start = time.perf_counter()
+            block = similarity[:, self.offsets[i]:self.offsets[i + 1]]
+            best = block.argmax(axis=1)
+            topics[s] = best - self.outliers[s]
+            scores[s] = block[np.arange(block.shape[0]), best]
+            if timings is not None:
+                timings[s] = time.perf_counter() - start
+        return topics, scores
+
+    def columns(self, sections: Optional[List[str]] = None, outliers: bool = True) -> np.ndarray:
+        """Columns of the stacked matrix holding the topics of ``sections``, all of them by default."""
+        columns = []
+        for i, s in enumerate(self.sections):
+            if sections is None or s in sections:
+                start = self.offsets[i] + (0 if outliers else self.outliers[s])
+                columns.append(np.arange(start, self.offsets[i + 1]))
+        return np.concatenate(columns) if columns else np.empty(0, dtype=np.int64)
+
+    def topic_of_columns(self, columns: np.ndarray) -> List[Tuple[str, int]]:
+        """Section and topic id of every column of the stacked matrix."""
+        blocks = np.searchsorted(self.offsets, columns, side='right') - 1
+        return [(self.sections[b], int(c - self.offsets[b] - self.outliers[self.sections[b]]))
+                for b, c in zip(blocks, columns)]
+
+    def top_k(self, embedding: np.ndarray, k: int, sections: Optional[List[str]] = None,
+              outliers: bool = False) -> List[Tuple[str, int, float]]:
+        """Find the ``k`` topics most similar to an embedding, across the given sections.
+
+        The embedding is scored against every topic with one product, and the ``k`` best columns of the selected
+        sections are found with ``argpartition`` before only those are sorted.
+
+        Parameters
+        ----------
+        embedding : np.ndarray
+            Embedding of shape (dim,) of a query.
+        k : int
+            Number of topics returned.
+        sections : list of str, optional
+            Sections searched, all of them by default.
+        outliers : bool, optional
+            Whether the outlier topic -1 of every section can be returned.
+
+        Returns
+        -------
+        list of (str, int, float)
+            Section, topic id and cosine similarity of the topics, most similar first.
+
+        """
+        columns = self.columns(sections, outliers)
+        similarity = self.similarity(np.reshape(embedding, (1, -1)))[0, columns]
+        k = min(k, len(columns))
+        if k == 0:
+            return []
+        best = np.argpartition(-similarity, k - 1)[:k]
+        best = best[np.argsort(-similarity[best], kind='stable')]
+        return [(s, t, float(score))
+                for (s, t), score in zip(self.topic_of_columns(columns[best]), similarity[best])]
@@ -0,0 +1,146 @@
+"""Non-blocking fetching of web pages and deduplication of concurrent work on the same URL."""
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import httpx
+from bs4 import BeautifulSoup
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+}
+
+
+class PageFetchError(Exception):
+    """Raised when a page cannot be fetched, is too large or does not answer in time."""
+
+
+@dataclass
+class FetchedPage:
+    url: str
+    html: str
+    headers: httpx.Headers
+    status_code: int = 200
+
+    @property
+    def text(self) -> str:
+        return html_to_text(self.html)
+
+    @property
+    def not_modified(self) -> bool:
+        """Whether the server answered a conditional request with 304 Not Modified, the body being empty."""
+        return self.status_code == 304
+
+    @property
+    def validators(self) -> Dict[str, Optional[str]]:
+        """The ETag and Last-Modified response headers, None when the server did not send them."""
+        return {'etag': self.headers.get('etag'), 'last_modified': self.headers.get('last-modified')}
+
+
+def html_to_text(html: str) -> str:
+    """Extract the text of an HTML page the same way langchain's WebBaseLoader does."""
+    return BeautifulSoup(html, 'html.parser').get_text()
+
+
+def content_hash(text: str) -> str:
+    """Hash of the text of a page, to tell whether it changed when the server sends no validators."""
+    return hashlib.sha256(text.encode('utf-8', errors='replace')).hexdigest()
+
+
+def conditional_headers(etag: Optional[str] = None, last_modified: Optional[str] = None) -> Dict[str, str]:
+    """Request headers asking the server to answer 304 Not Modified if the page still has these validators."""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def make_http_client(timeout: float = 20.0, max_connections: int = 50) -> httpx.AsyncClient:
+    """Create the HTTP client shared by all the page fetches."""
+    return httpx.AsyncClient(headers=DEFAULT_HEADERS, timeout=httpx.Timeout(timeout), follow_redirects=True,
+                             limits=httpx.Limits(max_connections=max_connections))
+
+
+def _content_length(headers: httpx.Headers) -> int:
+    """Announced length of a response body, 0 if unknown or malformed, the body being bounded while read anyway."""
+    try:
+        return int(headers.get('content-length') or 0)
+    except ValueError:
+        return 0
+
+
+async def fetch_page(client: httpx.AsyncClient, url: str, max_bytes: int = 5_000_000,
+                     headers: Dict[str, str] = None) -> FetchedPage:
+    """Download a page without blocking the event loop.
+
+    Parameters
+    ----------
+    client : httpx.AsyncClient
+        Client holding the connection pool and the timeouts.
+    url : str
+        URL of the page.
+    max_bytes : int, optional
+        The download is aborted once the body is larger than this.
+    headers : dict of {str : str}, optional
+        Extra request headers, such as the ``conditional_headers`` of a cached version of the page.
+
+    Returns
+    -------
+    FetchedPage
+        The decoded page, the response headers and the status code, which is 304 with an empty page if the
+        request was conditional and the page did not change.
+
+    Raises
+    ------
+    PageFetchError
+        If the request fails, times out, returns an error status or the body exceeds ``max_bytes``.
+
+    """
+    try:
+        async with client.stream('GET', url, headers=headers) as response:
+            if response.status_code >= 400:
+                raise PageFetchError(f'{url} returned status {response.status_code}')
+            if _content_length(response.headers) > max_bytes:
+                raise PageFetchError(f'{url} is larger than {max_bytes} bytes')
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > max_bytes:
+                    raise PageFetchError(f'{url} is larger than {max_bytes} bytes')
+            encoding = response.encoding or 'utf-8'
+            return FetchedPage(url=str(response.url), html=body.decode(encoding, errors='replace'),
+                               headers=response.headers, status_code=response.status_code)
+    except httpx.HTTPError as e:
+        raise PageFetchError(f'Could not fetch {url}: {e!r}') from e
+
+
+class InFlightRequests:
+    """Share the result of a coroutine between concurrent callers using the same key.
+
+    The first caller for a key starts the work, callers arriving while it runs await the same task. The task is
+    shielded, so a caller that disconnects does not cancel the work of the others.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def start(self, key: Hashable, factory: Callable[[], Awaitable]) -> Tuple[asyncio.Future, bool]:
+        """Return the task of a key, started with ``factory`` if none is running, and whether it was started."""
+        task = self._tasks.get(key)
+        if task is not None:
+            return task, False
+        task = asyncio.ensure_future(factory())
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return task, True
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        task, _ = self.start(key, factory)
+        return await asyncio.shield(task)
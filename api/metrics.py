@@ -0,0 +1,126 @@
+"""Prometheus metrics of the api: requests per route, time spent in every stage of URL ingestion and cache counters.
+
+When the api runs as several worker processes, ``PROMETHEUS_MULTIPROC_DIR`` must name an empty folder shared by the
+workers before this module is imported. The metrics of every worker are then written there and merged when scraped.
+"""
+import os
+import threading
+import time
+from collections import Counter as StatsCounter
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client.multiprocess import MultiProcessCollector
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+REQUESTS = Counter('topics_api_requests_total', 'Requests handled, per route and status',
+                   ['method', 'route', 'status'])
+REQUEST_SECONDS = Histogram('topics_api_request_duration_seconds', 'Time to the response of every route',
+                            ['method', 'route'],
+                            buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+# Stages of the ingestion of a URL: db_lookup, fetch, extract_text, split, embed and insert
+STAGE_SECONDS = Histogram('topics_api_stage_duration_seconds', 'Time spent in every stage of URL ingestion',
+                          ['stage'], buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+# Topic assignment of every section, and the similarity product shared by all the sections
+TRANSFORM_SECONDS = Histogram('topics_api_transform_duration_seconds', 'Time spent assigning the topics of a section',
+                              ['section'], buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1))
+URL_CHUNKS = Histogram('topics_api_url_chunks', 'Number of chunks of every ingested URL',
+                       buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000))
+CACHE_EVENTS = Counter('topics_api_cache_events', 'Hits, misses and evictions of the caches', ['cache', 'event'])
+MODEL_LOAD_SECONDS = Gauge('topics_api_model_load_seconds', 'Time taken to load the models', ['model'],
+                           multiprocess_mode='max')
+
+
+def metrics_registry() -> CollectorRegistry:
+    """Registry exported by /metrics, merging the metrics of all the workers if there are several."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    return registry
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Time the block as ``stage`` of URL ingestion."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+class TimedScorer:
+    """Scorer recording the time taken by each section of ``StackedTopicScorer.assign``."""
+
+    def __init__(self, scorer):
+        self.scorer = scorer
+        self.sections = scorer.sections
+
+    def assign(self, embeddings):
+        timings = {}
+        assigned = self.scorer.assign(embeddings, timings=timings)
+        for section, seconds in timings.items():
+            TRANSFORM_SECONDS.labels(section).observe(seconds)
+        return assigned
+
+
+class CacheEventsExporter:
+    """Add the counts of the ``stats`` counters of the caches to ``CACHE_EVENTS``.
+
+    The caches keep counting in their own counters, and every ``sync`` exports what they counted since the last one.
+
+    Parameters
+    ----------
+    caches : dict of {str : callable}
+        Function returning the ``stats`` counter of every cache, by cache name.
+
+    """
+
+    def __init__(self, caches: Dict[str, Callable[[], StatsCounter]]):
+        self.caches = caches
+        self._exported = StatsCounter()
+        self._lock = threading.Lock()
+
+    def sync(self):
+        with self._lock:
+            for cache, stats in self.caches.items():
+                for event, count in list(stats().items()):
+                    new = count - self._exported[cache, event]
+                    if new > 0:
+                        CACHE_EVENTS.labels(cache, event).inc(new)
+                        self._exported[cache, event] = count
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Count the requests and time their response per route template, so that path and query values do not
+    multiply the series.
+
+    Parameters
+    ----------
+    sync : callable, optional
+        Called after every request, to export the counters kept outside of the metrics, such as
+        ``CacheEventsExporter.sync``.
+
+    """
+
+    def __init__(self, app, sync: Optional[Callable[[], None]] = None):
+        super().__init__(app)
+        self.sync = sync
+
+    async def dispatch(self, request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            REQUESTS.labels(request.method, path, str(status)).inc()
+            REQUEST_SECONDS.labels(request.method, path).observe(time.perf_counter() - start)
+            if self.sync is not None:
+                self.sync()
@@ -0,0 +1,41 @@
+"""Migrate URL topic databases from the comma-joined legacy tables to the normalized schema.
+
+The legacy ``data`` and ``data_topics`` tables are moved into ``urls`` and ``url_topics`` and dropped. The api
+does the same when it starts on a legacy database.
+
+Run from the api folder:
+
+    python migrate_db.py db/*.db
+"""
+import argparse
+import os
+import sqlite3
+
+from database import UrlTopicsCache, make_engine
+from topic_index import TopicIndex
+
+SECTIONS = [f'Section{s}' for s in ['1', '1A', '7']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_paths', nargs='+')
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    args = parser.parse_args()
+
+    topic_names = {s: TopicIndex(os.path.join(args.model_path, f'topic_models_{s}')).topic_names for s in SECTIONS}
+    for db_path in args.db_paths:
+        engine = make_engine(db_path)
+        UrlTopicsCache(engine, topic_names).create()
+        engine.dispose()
+        # Reclaim the space of the dropped tables and fold the WAL back into the file
+        conn = sqlite3.connect(db_path)
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA journal_mode=DELETE')
+        n_urls, n_topics = [conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in ['urls', 'url_topics']]
+        conn.close()
+        print(f'{db_path}: {n_urls} urls, {n_topics} chunk topics')
+
+
+if __name__ == '__main__':
+    main()
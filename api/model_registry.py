@@ -0,0 +1,117 @@
+"""Process-wide registry of the tokenizer and embedding model, loaded once and shared by every request."""
+import logging
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger('topics-api')
+
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+# Maximum sequence length of all-MiniLM-L6-v2. Longer inputs are truncated by the model, so chunks are cut at it
+TOKENS_PER_CHUNK = 256
+
+
+class TokenChunker:
+    """Split texts into windows of a fixed number of tokens with a tokenizer alone.
+
+    Reproduces ``SentenceTransformersTokenTextSplitter`` without loading the transformer: the text is tokenized
+    without the special tokens, cut into consecutive windows of ``tokens_per_chunk`` tokens and every window is
+    decoded back to text.
+
+    Parameters
+    ----------
+    tokenizer : transformers.PreTrainedTokenizerBase
+        Tokenizer of the embedding model.
+    tokens_per_chunk : int, optional
+        Number of tokens of every chunk but the last one.
+    chunk_overlap : int, optional
+        Number of tokens shared by consecutive chunks.
+
+    """
+
+    def __init__(self, tokenizer, tokens_per_chunk: int = TOKENS_PER_CHUNK, chunk_overlap: int = 0):
+        if not 0 <= chunk_overlap < tokens_per_chunk:
+            raise ValueError(f'chunk_overlap must be in [0, {tokens_per_chunk}), got {chunk_overlap}')
+        self.tokenizer = tokenizer
+        self.tokens_per_chunk = tokens_per_chunk
+        self.chunk_overlap = chunk_overlap
+
+    def split_text(self, text: str) -> List[str]:
+        ids = self.tokenizer(text, add_special_tokens=False, truncation=False, verbose=False)['input_ids']
+        step = self.tokens_per_chunk - self.chunk_overlap
+        chunks = []
+        for start in range(0, len(ids), step):
+            chunks.append(self.tokenizer.decode(ids[start:start + self.tokens_per_chunk]))
+            if start + self.tokens_per_chunk >= len(ids):
+                break
+        return chunks
+
+
+class ModelRegistry:
+    """Tokenizer and embedding model of the API, each loaded once, on first use or by ``load``.
+
+    The chunker uses the tokenizer of the embedding model when it is loaded, so splitting and embedding share a
+    single instance. Otherwise only the tokenizer is loaded, which is enough to split texts.
+
+    Parameters
+    ----------
+    model_name : str, optional
+        Name of the sentence-transformers embedding model.
+    tokens_per_chunk : int, optional
+        Number of tokens of the chunks, the maximum sequence length of the model.
+
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, tokens_per_chunk: int = TOKENS_PER_CHUNK):
+        self.model_name = model_name
+        self.tokens_per_chunk = tokens_per_chunk
+        # Seconds taken to load every model, by name
+        self.load_times: Dict[str, float] = {}
+        self._models = {}
+        self._chunker = None
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, loader):
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    start = time.perf_counter()
+                    model = loader()
+                    self.load_times[name] = time.perf_counter() - start
+                    logger.info(f'Loaded {name} {self.model_name} in {self.load_times[name]:.2f}s')
+                    self._models[name] = model
+        return model
+
+    @property
+    def embedding_model(self):
+        """The ``SentenceTransformer`` embedding the chunks."""
+        def load():
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(self.model_name)
+        return self._get('embedding_model', load)
+
+    @property
+    def tokenizer(self):
+        """The tokenizer of the embedding model, without loading the model if it is not loaded yet."""
+        if 'embedding_model' in self._models:
+            return self._models['embedding_model'].tokenizer
+
+        def load():
+            from transformers import AutoTokenizer
+            return AutoTokenizer.from_pretrained(self.model_name)
+        return self._get('tokenizer', load)
+
+    @property
+    def chunker(self) -> TokenChunker:
+        """Splitter of texts into chunks of the model input size."""
+        tokenizer = self.tokenizer
+        if self._chunker is None or self._chunker.tokenizer is not tokenizer:
+            self._chunker = TokenChunker(tokenizer, self.tokens_per_chunk)
+        return self._chunker
+
+    def load(self):
+        """Load the embedding model and its tokenizer now rather than on the first request."""
+        self.embedding_model
+        return self
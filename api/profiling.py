@@ -0,0 +1,102 @@
+"""Sampling profiler of single requests, writing collapsed stacks that flamegraph tools render directly.
+
+While a request asking for a profile is handled, a thread samples the stack of every other thread at a fixed
+interval. Each stack is written on one line as its frames from the thread name to the innermost call, separated by
+semicolons, followed by the number of samples, the input format of ``flamegraph.pl`` and speedscope. The inference
+pool and the event loop are both sampled, so requests handled at the same time show up in the profile too.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FILE_HEADER = 'X-Profile-File'
+
+
+class StackSampler:
+    """Count the stacks of all the other threads, sampled every ``interval`` seconds between start and stop."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def start(self) -> 'StackSampler':
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def write(self, path: str):
+        """Write the collapsed stacks, most sampled first."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    """Profile the requests sent with an ``X-Profile: 1`` header, and name the file of their profile in the
+    ``X-Profile-File`` header of the response.
+
+    Streamed responses are only profiled until their first byte.
+
+    Parameters
+    ----------
+    folder : str
+        Folder of the collapsed stacks files.
+    interval : float, optional
+        Seconds between two samples.
+
+    """
+
+    def __init__(self, app, folder: str, interval: float = 0.005):
+        super().__init__(app)
+        self.folder = folder
+        self.interval = interval
+
+    async def dispatch(self, request: Request, call_next):
+        if request.headers.get(PROFILE_HEADER, '').lower() not in ('1', 'true'):
+            return await call_next(request)
+        sampler = StackSampler(self.interval).start()
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.stop()
+        path = self.write(sampler, request.url.path)
+        if path is not None:
+            response.headers[PROFILE_FILE_HEADER] = os.path.basename(path)
+        return response
+
+    def write(self, sampler: StackSampler, route: str) -> Optional[str]:
+        if not sampler.stacks:
+            return None
+        os.makedirs(self.folder, exist_ok=True)
+        name = route.strip('/').replace('/', '_') or 'root'
+        path = os.path.join(self.folder, f'{name}-{time.time_ns()}.collapsed')
+        sampler.write(path)
+        return path
@@ -0,0 +1,43 @@
+"""Write the topic embeddings of the saved topic models quantized to float16 and int8.
+
+The unit topic embeddings of every ``topic_models_<section>`` folder are written next to its
+``topic_embeddings.safetensors`` as ``topic_embeddings.float16.safetensors`` and ``topic_embeddings.int8.safetensors``,
+the latter with the scale of every topic. The api loads them instead of the float32 embeddings with
+``TOPIC_EMBEDDINGS_DTYPE=float16`` or ``int8``. See ``benchmarks/bench_quantization.py`` for their accuracy.
+
+Run from the api folder:
+
+    python quantize_topics.py --model-path ../topic_models
+"""
+import argparse
+import glob
+import os
+
+from safetensors.numpy import save_file
+
+from inference import QUANTIZED_DTYPES, quantize_rows
+from topic_index import embeddings_file, load_safetensors
+
+
+def quantize_model(path: str, dtype: str):
+    """Write the topic embeddings of the model saved in ``path`` quantized to ``dtype``."""
+    values, scales = quantize_rows(load_safetensors(os.path.join(path, embeddings_file()))['topic_embeddings'], dtype)
+    tensors = {'topic_embeddings': values}
+    if scales is not None:
+        tensors['scales'] = scales
+    save_file(tensors, os.path.join(path, embeddings_file(dtype)))
+    print(f'{os.path.basename(path)} {dtype}: {values.shape[0]} topics, {values.nbytes / 2 ** 20:.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    parser.add_argument('--dtypes', nargs='+', default=QUANTIZED_DTYPES, choices=QUANTIZED_DTYPES)
+    args = parser.parse_args()
+    for path in sorted(glob.glob(os.path.join(args.model_path, 'topic_models_*'))):
+        for dtype in args.dtypes:
+            quantize_model(path, dtype)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import bulk_score
+from accumulate_scores import accumulate_parts
+from accumulators import (AccumulatedSentimentStore, accumulate, current_version, histogram_quantile, load_states,
+                          merge, save_states, states_from_assets, topics_time_frames)
+from aggregates import SentimentStore, TopicsTimeStore, parse_json_frames
+from test_aggregates import make_topics_time
+
+
+def make_docs(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'Topic': rng.integers(0, 3, n),
+                         'Timestamp': pd.Timestamp('2021-01-01') + pd.to_timedelta(rng.integers(0, 700, n), 'D'),
+                         'sentiment_sigma_fsa': np.clip(rng.normal(0, 0.4, n), -1, 1)})
+
+
+def test_accumulators_are_mergeable():
+    """Accumulating two batches and merging them equals accumulating all the documents at once."""
+    docs = make_docs()
+    merged = merge(accumulate(docs.iloc[:150]), accumulate(docs.iloc[150:]))
+    pd.testing.assert_frame_equal(merged, accumulate(docs))
+    assert merged['Frequency'].sum() == len(docs)
+    assert merged['n_sentiment'].sum() == len(docs)
+
+
+def test_histogram_quantile():
+    values = np.array([-0.9, -0.2, 0.1, 0.35, 0.8])
+    histogram = accumulate(pd.DataFrame({'Topic': 0, 'Timestamp': pd.Timestamp('2021-01-01'),
+                                         'sentiment_sigma_fsa': values})).filter(like='h').to_numpy()
+    assert abs(histogram_quantile(histogram, 0.5)[0] - 0.1) <= 1 / 64
+    assert np.isnan(histogram_quantile(np.zeros((1, histogram.shape[1])), 0.5)[0])
+
+
+def test_accumulated_sentiment_matches_documents():
+    """Means are exact and medians within a histogram bin of the middle documents of every period."""
+    docs = make_docs().assign(Name=lambda d: d['Topic'].astype(str) + '_x')
+    frames = parse_json_frames({'Section1': docs.to_json(orient='records')})
+    expected = SentimentStore(frames).aggregate('3M')['Section1']
+    store = AccumulatedSentimentStore(states_from_assets(parse_json_frames({}), frames),
+                                      {'Section1': {t: f'{t}_x' for t in range(3)}}, frames)
+    got = store.aggregate('3M')['Section1']
+    pd.testing.assert_frame_equal(got[['Timestamp', 'Topic', 'Name']].astype({'Name': object}),
+                                  expected[['Timestamp', 'Topic', 'Name']].astype({'Name': object}))
+    np.testing.assert_allclose(got['mean'], expected['mean'])
+    # The median of an even number of documents can be anywhere between the two middle ones
+    middle = frames['Section1'].groupby(['Topic', pd.Grouper(key='Timestamp', freq='3M')])['sentiment_sigma_fsa']
+    lower = middle.quantile(0.5, interpolation='lower').to_numpy()
+    higher = middle.quantile(0.5, interpolation='higher').to_numpy()
+    assert ((got['median'] >= lower - 1 / 64) & (got['median'] <= higher + 1 / 64)).all()
+
+
+def test_topics_time_from_accumulators():
+    """Topic frequencies rebuilt from the accumulators aggregate as the asset does."""
+    frames = parse_json_frames(make_topics_time())
+    states = states_from_assets(frames, parse_json_frames({}))
+    words = {s: {t: f'w{t}' for t in range(-1, 2)} for s in frames}
+    names = {s: {t: f'{t}_w{t}' for t in range(-1, 2)} for s in frames}
+    expected = TopicsTimeStore(frames).aggregate('1Y', None)
+    got = TopicsTimeStore(topics_time_frames(states, words, names)).aggregate('1Y', None)
+    for s in frames:
+        pd.testing.assert_frame_equal(got[s].reset_index(drop=True), expected[s].reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False)
+
+
+def test_topics_time_keeps_the_asset_rows_after_accumulating():
+    """The response keeps the rows of the asset, with the documents accumulated since added or appended."""
+    frames = parse_json_frames(make_topics_time())
+    words = {s: {t: f'topic words {t}' for t in range(-1, 2)} for s in frames}
+    names = {s: {t: f'{t}_w{t}' for t in range(-1, 2)} for s in frames}
+    # A document of topic 0 on the last day of the asset, and two in a month after it
+    new = pd.DataFrame({'Topic': [0, 0, 1], 'Timestamp': pd.to_datetime(['2020-12-31', '2021-03-02', '2021-03-05'])})
+    states = {s: merge(state, accumulate(new)) for s, state in states_from_assets(frames, parse_json_frames({})).items()}
+    before = json.loads(json.loads(TopicsTimeStore(frames).response())['Section1'])
+    after = json.loads(json.loads(TopicsTimeStore(topics_time_frames(states, words, names, frames)).response())[
+        'Section1'])
+    assert all(set(r) == set(before[0]) for r in after)
+    last_day = pd.Timestamp('2020-12-31').value // 10 ** 6
+    expected = [dict(r, Frequency=r['Frequency'] + (r['Topic'] == 0 and r['Timestamp'] == last_day)) for r in before]
+    appended = [r for r in after if r not in expected]
+    assert len(after) == len(before) + 2
+    assert all(r in after for r in expected)
+    assert {(r['Topic'], r['Words'], r['Frequency']) for r in appended} == {(0, 'topic words 0', 1),
+                                                                            (1, 'topic words 1', 1)}
+
+
+def test_save_and_load_versions(tmp_path):
+    """Saved states become the current version, and only the last two versions are kept."""
+    folder = str(tmp_path / 'accumulators')
+    assert load_states(folder) == (None, {}, set())
+    states = {'Section1': accumulate(make_docs())}
+    for i in range(3):
+        version = save_states(folder, states, {f'part-{j}' for j in range(i + 1)})
+    assert version == current_version(folder) == 'v000003'
+    assert sorted(p.name for p in (tmp_path / 'accumulators').iterdir() if p.is_dir()) == ['v000002', 'v000003']
+    loaded_version, loaded, applied = load_states(folder)
+    pd.testing.assert_frame_equal(loaded['Section1'], states['Section1'])
+    assert applied == {'part-0', 'part-1', 'part-2'}
+
+
+def test_accumulate_parts_skips_the_parts_of_published_assets(tmp_path, topic_indexes):
+    """Parts the assets were built from by bulk_score are not counted again, new parts are counted once."""
+    parts_dir = tmp_path / 'parts'
+    parts_dir.mkdir()
+    parts = []
+    for i in range(2):
+        docs = make_docs(n=50, seed=i).assign(Section='Section1', ticker='AIZ', companyName='ASSURANT, INC.',
+                                             Probability=1.0, label_sigma_fsa='POSITIVE', score_sigma_fsa=0.5)
+        parts.append(str(parts_dir / f'filings-{i:06d}.parquet'))
+        bulk_score.write_part(docs, parts[-1])
+        if i == 0:
+            # The assets are published with the first part only
+            bulk_score.build_assets(str(parts_dir), str(tmp_path / 'assets'), topic_indexes)
+    version, n_parts = accumulate_parts(parts, str(tmp_path / 'assets'))
+    assert n_parts == 1
+    _, states, applied = load_states(str(tmp_path / 'assets' / 'accumulators'))
+    assert applied == {'filings-000000.parquet', 'filings-000001.parquet'}
+    assert states['Section1']['Frequency'].sum() == states['Section1']['n_sentiment'].sum() == 100
+    assert accumulate_parts(parts, str(tmp_path / 'assets')) == (version, 0)
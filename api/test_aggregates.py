@@ -0,0 +1,102 @@
+import json
+
+import pandas as pd
+
+from aggregates import SentimentStore, TopicsTimeStore, page_records, parse_json_frames, select_records
+
+
+def make_topics_time():
+    """Build a small topics_overtime.json payload with 3 topics over 24 months for two sections."""
+    timestamps = pd.date_range('2019-01-31', periods=24, freq='M')
+    df = pd.DataFrame([{'Topic': t, 'Words': f'w{t}', 'Name': f'{t}_w{t}', 'Frequency': 1, 'Timestamp': ts}
+                       for t in range(-1, 2) for ts in timestamps])
+    return {s: df.to_json(orient='records') for s in ['Section1', 'Section7']}
+
+
+def test_topics_time_store_caches_responses():
+    """The same (freq, top_n) returns the cached response."""
+    store = TopicsTimeStore(parse_json_frames(make_topics_time()))
+    assert set(json.loads(store.response(None, None))) == {'Section1', 'Section7'}
+    cached = store.response('1Y', 1)
+    assert store.response('1Y', 1) is cached
+    assert store.response.cache_info().hits == 1
+    first = json.loads(cached)
+    assert first['frequency'] == '1Y' and first['top_n'] == '1'
+    df = pd.read_json(first['Section1'], orient='records')
+    assert sorted(df['Topic'].unique()) == [-1, 0]
+    assert df['Frequency'].sum() == 2 * 24
+
+
+def test_topics_time_store_does_not_mutate_frames():
+    """Aggregating leaves the parsed frames unchanged."""
+    store = TopicsTimeStore(parse_json_frames(make_topics_time()))
+    before = store.frames['Section1'].copy()
+    store.warm(freqs=['3M'], top_ns=[None, 1])
+    pd.testing.assert_frame_equal(store.frames['Section1'], before)
+
+
+def test_topic_trend_is_the_resampled_frequency_of_a_topic():
+    """The trend of a topic holds its frequency summed over every period."""
+    store = TopicsTimeStore(parse_json_frames(make_topics_time()))
+    trend = store.topic_trend('Section7', 1, '1Y')
+    assert trend == {'Timestamp': ['2019-12-31', '2020-12-31'], 'Frequency': [12, 12]}
+    assert len(store.topic_trend('Section7', 1)['Frequency']) == 24
+
+
+def make_sentiment():
+    """Build a small topics_and_docs_sentiment.json payload of two topics with one document per month."""
+    timestamps = pd.date_range('2019-01-15', periods=24, freq='MS') + pd.Timedelta(days=14)
+    df = pd.DataFrame([{'Topic': t, 'Name': f'{t}_w{t}', 'sentiment_sigma_fsa': float(i % 4), 'Timestamp': str(ts)}
+                       for t in range(2) for i, ts in enumerate(timestamps)])
+    return {'Section1': df.to_json(orient='records')}
+
+
+def test_sentiment_store_matches_resample():
+    """Aggregates match a per-topic resample on the periods that have documents."""
+    store = SentimentStore(parse_json_frames(make_sentiment()))
+    df = store.frames['Section1']
+    expected = df.set_index('Timestamp').groupby(['Topic', 'Name'])['sentiment_sigma_fsa'].resample(
+        rule='1Y').agg(['mean', 'median']).dropna().reset_index()
+    got = store.aggregate('1Y')['Section1']
+    pd.testing.assert_frame_equal(got.reset_index(drop=True), expected[got.columns].reset_index(drop=True))
+    assert store.response('1Y') is store.response('1Y')
+    assert json.loads(store.response('1Y'))['frequency'] == '1Y'
+
+
+def test_section_series_is_compact_and_filtered():
+    """Section series only hold the requested topics, with each topic name and distinct words sent once."""
+    store = TopicsTimeStore(parse_json_frames(make_topics_time()))
+    payload = json.loads(store.section_series('Section7', '1Y', 2, False))
+    assert store.section_series('Section7', '1Y', 2, False) is store.section_series('Section7', '1Y', 2, False)
+    assert payload['names'] == {'0': '0_w0', '1': '1_w1'}
+    data = payload['data']
+    assert set(data['Topic']) == {0, 1}
+    assert data['Timestamp'][0] == '2019-12-31'
+    assert [payload['categories']['Words'][c] for c in data['Words']] == [f'w{t}' for t in data['Topic']]
+    assert sum(data['Frequency']) == 2 * 24
+
+    sentiment = SentimentStore(parse_json_frames(make_sentiment()))
+    payload = json.loads(sentiment.section_series('Section1', '1Y', 1))
+    expected = sentiment.aggregate('1Y')['Section1'].query('Topic < 1')
+    assert payload['data']['mean'] == expected['mean'].round(4).tolist()
+    assert set(payload['data']) == {'Timestamp', 'Topic', 'mean', 'median'}
+
+
+def test_page_records_follow_cursors():
+    """Pages follow each other without gaps or repeats, also after rows are added before the cursor."""
+    df = parse_json_frames(make_sentiment())['Section1']
+    # Every (Topic, Timestamp) key has two rows, which an odd limit splits across pages
+    df = pd.concat([df, df]).sort_values(['Topic', 'Timestamp'], kind='stable', ignore_index=True)
+    start, end = df['Timestamp'].iloc[len(df) // 4], df['Timestamp'].iloc[3 * len(df) // 4]
+    expected = select_records(df, start=start, end=end)
+    pages, cursor = [], None
+    while True:
+        page, cursor = page_records(df, start=start, end=end, cursor=cursor, limit=7)
+        pages.append(page)
+        if cursor is None:
+            break
+        # The served frame is replaced by one with a copy of its first row, which shifts the row indexes
+        df = pd.concat([df.iloc[:1], df], ignore_index=True)
+    assert all(len(page) == 7 for page in pages[:-1])
+    got = pd.concat(pages)
+    pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True))
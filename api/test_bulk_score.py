@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import bulk_score
+from columnar import ParquetFrames
+from model_registry import TokenChunker
+from test_model_registry import WordTokenizer
+
+FILINGS = pd.DataFrame({
+    'Unnamed: 0': [0, 1, 2],
+    'ticker': ['AIZ', 'AAPL', 'AIZ'],
+    'companyName': ['ASSURANT, INC.', 'APPLE INC.', 'ASSURANT, INC.'],
+    'formType': '10-K',
+    'filedAt': ['2022-02-17 16:12:13-05:00', '2022-10-28 18:04:28-04:00', '2023-02-17 16:12:13-05:00'],
+    'Section1': ['t0 t0 t1', 't1', 't2 t2'],
+    'Section1A': ['t1 t1', None, 't0'],
+    'Section7': ['t2', 't2 t2 t2', 't1'],
+})
+
+
+class FakeRegistry:
+    """One chunk per word, embedded as the one-hot vector of the topic it names."""
+
+    def __init__(self):
+        self.chunker = TokenChunker(WordTokenizer(), tokens_per_chunk=1)
+        self.embedding_model = self
+
+    def encode(self, chunks, batch_size):
+        return np.eye(4, dtype=np.float32)[[int(c[1]) + 1 for c in chunks]]
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+
+def test_score_batch_and_build_assets(tmp_path, topic_indexes, monkeypatch):
+    """Batches are scored chunk by chunk, and the assets count the chunks of every topic per filing date."""
+    monkeypatch.setattr(bulk_score, '_registry', FakeRegistry())
+    monkeypatch.setattr(bulk_score, '_classifier', lambda chunks, **kwargs: [
+        {'label': f'LABEL_{int(c[1])}', 'score': 0.5} for c in chunks])
+    path = str(tmp_path / 'filings.csv')
+    FILINGS.to_csv(path, index=False)
+    parts_dir = tmp_path / 'parts'
+    parts_dir.mkdir()
+    batches = list(bulk_score.iter_filings(path, batch_size=2))
+    assert [len(b) for b in batches] == [2, 1]
+    with ThreadPoolExecutor(2) as executor:
+        for i, filings in enumerate(batches):
+            df = bulk_score.score_batch(filings, executor, topic_indexes, tasks_per_section=2)
+            bulk_score.write_part(df, str(parts_dir / f'{bulk_score.source_id(path, 2)}-{i:06d}.parquet'))
+    assert len(os.listdir(parts_dir)) == 2
+    bulk_score.build_assets(str(parts_dir), str(tmp_path / 'assets'), topic_indexes)
+
+    topics_time = ParquetFrames(str(tmp_path / 'assets' / 'columnar' / 'topics_overtime'))
+    df = topics_time['Section1']
+    assert df[['Topic', 'Frequency']].values.tolist() == [[0, 2], [1, 1], [1, 1], [2, 2]]
+    assert df['Timestamp'].iloc[0] == pd.Timestamp('2022-02-17 21:12:13')
+    assert df['Words'].iloc[0] == 'word, other word' and df['Name'].iloc[0] == '0_word'
+    sentiment = ParquetFrames(str(tmp_path / 'assets' / 'columnar' / 'topics_and_docs_sentiment'))['Section1A']
+    assert sentiment['Topic'].tolist() == [0, 1, 1]
+    assert sentiment['ticker'].tolist() == ['AIZ', 'AIZ', 'AIZ']
+    assert sentiment['sentiment_sigma_fsa'].tolist() == [-0.5, 0.0, 0.0]
+    assert bulk_score.published_parts(str(tmp_path / 'assets')) == set(os.listdir(parts_dir))
+
+
+def test_iter_filings_parquet(tmp_path):
+    """Parquet files are read in batches of the metadata and section columns only."""
+    path = str(tmp_path / 'filings.parquet')
+    pq.write_table(pa.Table.from_pandas(FILINGS), path)
+    batches = list(bulk_score.iter_filings(path, batch_size=2))
+    assert [len(b) for b in batches] == [2, 1]
+    assert list(batches[0].columns) == bulk_score.META_COLUMNS + bulk_score.SECTIONS
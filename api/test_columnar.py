@@ -0,0 +1,36 @@
+import msgpack
+import pandas as pd
+import pyarrow as pa
+
+from aggregates import parse_json_frames
+from columnar import ARROW_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, ParquetFrames, encode_frames, write_parquet_frames
+from test_aggregates import make_sentiment
+
+
+def test_parquet_frames_load_columns_lazily(tmp_path):
+    """Only the requested columns are read, and the loaded frame matches the JSON one."""
+    frames = parse_json_frames(make_sentiment())
+    write_parquet_frames(dict(frames), str(tmp_path))
+    lazy = ParquetFrames(str(tmp_path))
+    assert list(lazy) == ['Section1']
+    assert list(lazy.load('Section1', ['Topic', 'Timestamp']).columns) == ['Topic', 'Timestamp']
+    pd.testing.assert_frame_equal(lazy['Section1'], frames['Section1'])
+
+
+def test_parquet_frames_contains_does_not_load(tmp_path):
+    """Checking a section does not read its columns."""
+    write_parquet_frames(dict(parse_json_frames(make_sentiment())), str(tmp_path))
+    lazy = ParquetFrames(str(tmp_path))
+    assert 'Section1' in lazy and 'Section2' not in lazy
+    assert lazy._frames == {}
+
+
+def test_encode_frames():
+    """Arrow and MessagePack encodings hold the rows of every section and the metadata."""
+    frames = dict(parse_json_frames(make_sentiment()))
+    table = pa.ipc.open_stream(encode_frames(frames, ARROW_MEDIA_TYPE, {'frequency': '1Y'})).read_all()
+    assert table.num_rows == len(frames['Section1'])
+    assert table.schema.metadata[b'frequency'] == b'1Y'
+    decoded = msgpack.unpackb(encode_frames(frames, MSGPACK_MEDIA_TYPE, {'frequency': '1Y'}))
+    assert decoded['frequency'] == '1Y'
+    assert decoded['sections']['Section1']['Topic'] == frames['Section1']['Topic'].tolist()
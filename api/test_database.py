@@ -0,0 +1,143 @@
+import multiprocessing
+import sqlite3
+import time
+
+from database import UrlTopicsCache, make_engine, process_lock
+
+TOPIC_NAMES = {'Section1': {-1: '-1_a', 1: '1_b, c', 12: '12_d'}, 'Section1A': {2: '2_e'}, 'Section7': {3: '3_f'}}
+TOPICS = {'Section1': ([1, 1, 12], [0.5, 0.4, 0.3]), 'Section1A': ([2, 2, 2], None), 'Section7': ([3, 3, 3], None)}
+
+
+def make_cache(db_path, **kwargs):
+    cache = UrlTopicsCache(make_engine(str(db_path)), TOPIC_NAMES, **kwargs)
+    cache.create()
+    return cache
+
+
+def test_create_migrates_legacy_tables(tmp_path):
+    """Legacy comma-joined and concatenated names are migrated to topic ids, the newest table winning."""
+    db_path = str(tmp_path / 'topics.db')
+    conn = sqlite3.connect(db_path)
+    for table in ['data', 'data_topics']:
+        conn.execute(f'CREATE TABLE {table} (url text, topics_section1 text, topics_section2 text, '
+                     f'topics_section3 text)')
+    conn.executemany('INSERT INTO data VALUES (?, ?, ?, ?)', [('u', '12_d1_b, c', '2_e', '3_f'),
+                                                              ('old', '-1_a', '2_e', '3_f')])
+    conn.executemany('INSERT INTO data_topics VALUES (?, ?, ?, ?)', [('u', '12_d', '2_e', '3_f'),
+                                                                     ('u', '1_b, c,12_d,1_b, c', '2_e', '3_f')])
+    conn.commit()
+    conn.close()
+    cache = make_cache(db_path)
+    assert cache.get('u') == {'Section1': [1, 12, 1], 'Section1A': [2], 'Section7': [3]}
+    assert cache.get('old') == {'Section1': [-1], 'Section1A': [2], 'Section7': [3]}
+    conn = sqlite3.connect(db_path)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert tables == {'urls', 'url_topics'}
+    plan = conn.execute('EXPLAIN QUERY PLAN SELECT url_id FROM url_topics WHERE section = ? AND topic_id = ?',
+                        ['Section1', 1]).fetchall()
+    assert 'ix_url_topics_section_topic' in plan[0][-1]
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_upsert_lookup_and_reverse_lookup(tmp_path):
+    """Topics are inserted, replaced on conflict, looked up by URL and by topic."""
+    cache = make_cache(tmp_path / 'topics.db')
+    assert cache.get('u1') is None
+    cache.upsert_many({'u1': TOPICS, 'u2': TOPICS})
+    cache.upsert_many({'u1': {**TOPICS, 'Section1': ([12], [0.9])}})
+    assert cache.get('u1')['Section1'] == [12]
+    assert cache.get('u2') == {s: ids for s, (ids, _) in TOPICS.items()}
+    assert cache.get_many(['u1', 'u2', 'u3']).keys() == {'u1', 'u2'}
+    assert cache.urls_by_topic('Section1', 12) == [{'url': 'u1', 'count': 1}, {'url': 'u2', 'count': 1}]
+    assert cache.urls_by_topic('Section1', 1) == [{'url': 'u2', 'count': 2}]
+
+
+def test_create_adds_missing_columns(tmp_path):
+    """A urls table created by an earlier version gets the validator columns and keeps its rows."""
+    db_path = str(tmp_path / 'topics.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT NOT NULL, n_chunks INTEGER, fetched_at FLOAT)')
+    conn.execute("INSERT INTO urls VALUES (1, 'u', 0, NULL)")
+    conn.commit()
+    conn.close()
+    cache = make_cache(db_path)
+    entry = cache.lookup('u')
+    assert entry.etag is None and not entry.is_fresh(ttl=60)
+    cache.upsert_many({'u': TOPICS}, {'u': {'etag': '"v1"', 'content_hash': 'h'}})
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT etag, content_hash FROM urls').fetchall() == [('"v1"', 'h')]
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def test_revalidate_and_hot_tier(tmp_path):
+    """Revalidation refreshes the fetch time and the given validators, in SQLite and in memory."""
+    cache = make_cache(tmp_path / 'topics.db', hot_size=1)
+    cache.upsert_many({'u1': TOPICS, 'u2': TOPICS}, {'u1': {'etag': '"v1"', 'content_hash': 'h'}})
+    assert cache.lookup('u2').topics == cache.get('u1')
+    assert cache.stats['hot_hits'] == 1 and cache.stats['db_hits'] == 1
+    entry = cache.lookup('u1')
+    entry.fetched_at -= 3600
+    assert not entry.is_fresh(ttl=60)
+    cache.revalidate('u1', {'etag': '"v2"', 'last_modified': None})
+    for fresh_cache in [cache, make_cache(tmp_path / 'topics.db')]:
+        entry = fresh_cache.lookup('u1')
+        assert entry.is_fresh(ttl=60)
+        assert (entry.etag, entry.content_hash) == ('"v2"', 'h')
+
+
+def test_compact_evicts_least_recently_used(tmp_path):
+    """URLs beyond the maximum are evicted least recently used first, with their chunk topics."""
+    cache = make_cache(tmp_path / 'topics.db')
+    cache.upsert_many({'u1': TOPICS})
+    cache.upsert_many({'u2': TOPICS})
+    cache.upsert_many({'u3': TOPICS})
+    cache.lookup('u1')
+    assert cache.compact(max_urls=3) == 0
+    assert cache.compact(max_urls=2) == 1
+    assert cache.get_many(['u1', 'u2', 'u3']).keys() == {'u1', 'u3'}
+    assert cache.urls_by_topic('Section1', 1) == [{'url': 'u1', 'count': 2}, {'url': 'u3', 'count': 2}]
+    conn = sqlite3.connect(str(tmp_path / 'topics.db'))
+    assert conn.execute('SELECT COUNT(DISTINCT url_id) FROM url_topics').fetchone()[0] == 2
+
+
+def upsert_from_process(db_path, worker):
+    cache = make_cache(db_path)
+    for i in range(20):
+        cache.upsert_many({f'https://example.com/{worker}/{i}': TOPICS})
+
+
+def test_processes_share_the_database(tmp_path):
+    """Workers forked after the cache was created write to the same database through their own connections."""
+    db_path = str(tmp_path / 'topics.db')
+    cache = make_cache(db_path)
+    cache.engine.dispose()
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=upsert_from_process, args=(db_path, w)) for w in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert all(p.exitcode == 0 for p in processes)
+    assert len(cache.get_many([f'https://example.com/{w}/{i}' for w in range(4) for i in range(20)])) == 80
+
+
+def hold_lock(lock_path, log_path):
+    with process_lock(lock_path):
+        with open(log_path, 'a') as f:
+            f.write('start\n')
+            f.flush()
+            time.sleep(0.05)
+            f.write('end\n')
+
+
+def test_process_lock_serializes_processes(tmp_path):
+    """Only one process at a time runs the locked block."""
+    lock_path, log_path = str(tmp_path / 'compact.lock'), str(tmp_path / 'log')
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=hold_lock, args=(lock_path, log_path)) for _ in range(3)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    with open(log_path) as f:
+        assert f.read().split() == ['start', 'end'] * 3
@@ -0,0 +1,77 @@
+import numpy as np
+
+from embedding_cache import ChunkEmbeddingCache, chunk_key
+from inference import StackedTopicScorer
+
+DIM = 8
+
+
+def make_scorer(seed=0):
+    rng = np.random.default_rng(seed)
+    return StackedTopicScorer({'Section1': rng.normal(size=(5, DIM)), 'Section7': rng.normal(size=(3, DIM))},
+                              {'Section1': 1, 'Section7': 0})
+
+
+class CountingEmbedder:
+    """Deterministic embedding of every text, recording the texts it embeds."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def __call__(self, texts):
+        self.embedded += texts
+        return np.stack([np.random.default_rng(int(chunk_key(t), 16) % 2 ** 32).normal(size=DIM) for t in texts])
+
+
+def test_assign_matches_scorer_and_skips_cached_chunks(tmp_path):
+    """Cached chunks, including whitespace variants and repeats, are not embedded again."""
+    scorer, embed = make_scorer(), CountingEmbedder()
+    cache = ChunkEmbeddingCache(str(tmp_path), DIM, capacity=10)
+    texts = ['legal footer', 'risk factors', 'legal footer']
+    topics, scores = cache.assign(texts, embed, scorer)
+    expected_topics, expected_scores = scorer.assign(embed(texts))
+    for s in scorer.sections:
+        np.testing.assert_array_equal(topics[s], expected_topics[s])
+        np.testing.assert_allclose(scores[s], expected_scores[s], rtol=1e-6)
+    embed.embedded = []
+    cache.assign(['legal  footer\n', 'new text'], embed, scorer)
+    assert embed.embedded == ['new text']
+    assert cache.summary()['size'] == 3
+    assert cache.stats['hits'] == 1 and cache.stats['misses'] == 4
+
+
+def test_cache_persists_and_rescores_when_topics_change(tmp_path):
+    """A reopened cache keeps the embeddings, and only recomputes the assignments if the topic models changed."""
+    scorer, embed = make_scorer(), CountingEmbedder()
+    ChunkEmbeddingCache(str(tmp_path), DIM, capacity=10, topics_version=scorer.fingerprint).assign(
+        ['a', 'b'], embed, scorer)
+    new_scorer = make_scorer(seed=1)
+    cache = ChunkEmbeddingCache(str(tmp_path), DIM, capacity=10, topics_version=new_scorer.fingerprint)
+    embed.embedded = []
+    topics, _ = cache.assign(['a', 'b'], embed, new_scorer)
+    assert embed.embedded == [] and cache.stats['rescored'] == 2
+    # The embeddings were stored as float16, close enough to give the same topics
+    expected, _ = new_scorer.assign(embed(['a', 'b']))
+    assert all((topics[s] == expected[s]).all() for s in new_scorer.sections)
+    assert len(ChunkEmbeddingCache(str(tmp_path), DIM, capacity=20)) == 0
+
+
+def test_least_recently_used_chunks_are_evicted(tmp_path):
+    scorer, embed = make_scorer(), CountingEmbedder()
+    cache = ChunkEmbeddingCache(str(tmp_path), DIM, capacity=3)
+    for text in ['a', 'b', 'c', 'a', 'd']:
+        cache.assign([text], embed, scorer)
+    assert cache.stats['evictions'] == 1
+    assert cache.lookup([chunk_key(t) for t in 'abcd']).keys() == {chunk_key(t) for t in 'acd'}
+    assert sorted(slot for slot, _ in cache.lookup([chunk_key(t) for t in 'acd']).values()) == [0, 1, 2]
+
+
+def test_embeddings_to_rescore_are_copied_before_their_row_is_reused(tmp_path):
+    """A chunk is rescored with its own embedding even if its row is evicted and reused right after the lookup."""
+    scorer, embed = make_scorer(), CountingEmbedder()
+    ChunkEmbeddingCache(str(tmp_path), DIM, capacity=1, topics_version=scorer.fingerprint).assign(['a'], embed, scorer)
+    cache = ChunkEmbeddingCache(str(tmp_path), DIM, capacity=1, topics_version=make_scorer(seed=1).fingerprint)
+    _, unassigned = cache._lookup([chunk_key('a')])
+    cache.put([chunk_key('b')], embed(['b']), {chunk_key('b'): {}})
+    assert cache.lookup([chunk_key('a')]) == {}
+    np.testing.assert_allclose(unassigned[chunk_key('a')], embed(['a'])[0], rtol=1e-3, atol=1e-3)
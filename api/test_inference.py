@@ -0,0 +1,64 @@
+import numpy as np
+
+from inference import StackedTopicScorer, quantize_rows
+
+
+def test_stacked_scorer_matches_per_section_cosine():
+    """The stacked scorer returns the same topics as a per-section cosine similarity argmax."""
+    rng = np.random.default_rng(0)
+    topic_embeddings = {'Section1': rng.normal(size=(30, 16)), 'Section1A': rng.normal(size=(12, 16)),
+                        'Section7': rng.normal(size=(45, 16))}
+    outliers = {'Section1': 1, 'Section1A': 0, 'Section7': 1}
+    docs = rng.normal(size=(50, 16))
+    topics, scores = StackedTopicScorer(topic_embeddings, outliers).assign(docs)
+    for s, emb in topic_embeddings.items():
+        sim = (docs / np.linalg.norm(docs, axis=1, keepdims=True)) @ (emb / np.linalg.norm(emb, axis=1,
+                                                                                           keepdims=True)).T
+        np.testing.assert_array_equal(topics[s], sim.argmax(axis=1) - outliers[s])
+        np.testing.assert_allclose(scores[s], sim.max(axis=1), rtol=1e-5)
+
+
+def test_top_k_matches_a_full_sort():
+    """The top k topics are the k most similar of the searched sections, most similar first, without outliers."""
+    rng = np.random.default_rng(1)
+    topic_embeddings = {'Section1': rng.normal(size=(30, 16)), 'Section1A': rng.normal(size=(12, 16)),
+                        'Section7': rng.normal(size=(45, 16))}
+    outliers = {'Section1': 1, 'Section1A': 0, 'Section7': 1}
+    scorer = StackedTopicScorer(topic_embeddings, outliers)
+    query = rng.normal(size=16)
+    expected = []
+    for s in ['Section1', 'Section7']:
+        emb = topic_embeddings[s] / np.linalg.norm(topic_embeddings[s], axis=1, keepdims=True)
+        sim = emb @ (query / np.linalg.norm(query))
+        expected += [(s, t - outliers[s], score) for t, score in enumerate(sim) if t >= outliers[s]]
+    expected = sorted(expected, key=lambda e: -e[2])[:5]
+    found = scorer.top_k(query, 5, sections=['Section1', 'Section7'])
+    assert [f[:2] for f in found] == [e[:2] for e in expected]
+    np.testing.assert_allclose([f[2] for f in found], [e[2] for e in expected], rtol=1e-5)
+    assert len(scorer.top_k(query, 1000, outliers=True)) == 30 + 12 + 45
+
+
+def test_quantized_scorer_matches_float32():
+    """Quantized embeddings assign the float32 topics of documents close to a topic, with scores a few thousandths
+    off, and take a half or a quarter of the memory."""
+    rng = np.random.default_rng(2)
+    topic_embeddings = {'Section1': rng.normal(size=(40, 32)), 'Section7': rng.normal(size=(60, 32))}
+    outliers = {'Section1': 1, 'Section7': 1}
+    reference = StackedTopicScorer(topic_embeddings, outliers)
+    docs = np.vstack(list(topic_embeddings.values()))[rng.integers(0, 100, 200)] + rng.normal(0, 0.1, (200, 32))
+    expected_topics, expected_scores = reference.assign(docs)
+    for dtype, ratio in [('float16', 2), ('int8', 4)]:
+        quantized = {s: quantize_rows(e, dtype) for s, e in topic_embeddings.items()}
+        scales = {s: q[1] for s, q in quantized.items()} if dtype == 'int8' else None
+        scorer = StackedTopicScorer({s: q[0] for s, q in quantized.items()}, outliers, scales)
+        assert scorer.matrix.nbytes * ratio == reference.matrix.nbytes
+        assert scorer.fingerprint != reference.fingerprint
+        topics, scores = scorer.assign(docs)
+        for s in topic_embeddings:
+            # Documents drawn from the topics of the other section are far from all the topics of this one, and
+            # their near ties can flip
+            close = expected_scores[s] > 0.9
+            np.testing.assert_array_equal(topics[s][close], expected_topics[s][close])
+            np.testing.assert_allclose(scores[s], expected_scores[s], atol=5e-3)
+        np.testing.assert_allclose(scorer.section_embeddings('Section7'), reference.section_embeddings('Section7'),
+                                   atol=5e-3)
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from ingestion import InFlightRequests, PageFetchError, conditional_headers, fetch_page, make_http_client
+
+PAGE = b'<html><head><title>Filing</title></head><body><p>LIBOR transition risk</p></body></html>'
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Serves a small page on /page, a large one on /large and a 404 anywhere else."""
+
+    def do_GET(self):
+        if self.path == '/page' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path == '/page':
+            body = PAGE
+        elif self.path == '/large':
+            body = b'x' * 100_000
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    """Local HTTP stand-in for the scraped websites."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def fetch(url, **kwargs):
+    async def run():
+        async with make_http_client(timeout=5) as client:
+            return await fetch_page(client, url, **kwargs)
+    return asyncio.run(run())
+
+
+def test_fetch_page(server_url):
+    """The text of the page is extracted from its HTML."""
+    page = fetch(f'{server_url}/page')
+    assert 'LIBOR transition risk' in page.text
+    assert '<p>' not in page.text
+
+
+def test_fetch_page_conditional(server_url):
+    """A conditional request with the current ETag of the page returns an empty 304 page."""
+    page = fetch(f'{server_url}/page')
+    assert not page.not_modified
+    assert page.validators == {'etag': '"v1"', 'last_modified': None}
+    page = fetch(f'{server_url}/page', headers=conditional_headers(**page.validators))
+    assert page.not_modified
+    assert page.html == ''
+
+
+def test_fetch_page_errors(server_url):
+    """Error statuses and pages over the size limit raise PageFetchError."""
+    with pytest.raises(PageFetchError):
+        fetch(f'{server_url}/missing')
+    with pytest.raises(PageFetchError):
+        fetch(f'{server_url}/large', max_bytes=10_000)
+
+
+def test_fetch_page_with_malformed_content_length():
+    """A malformed Content-Length is ignored, the size of the body still being checked while it is read."""
+    def respond(request):
+        body = PAGE if request.url.path == '/page' else b'x' * 100_000
+        return httpx.Response(200, headers={'Content-Length': 'many'}, stream=httpx.ByteStream(body))
+
+    async def run(path):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(respond)) as client:
+            return await fetch_page(client, f'http://filings.test{path}', max_bytes=10_000)
+
+    assert 'LIBOR transition risk' in asyncio.run(run('/page')).text
+    with pytest.raises(PageFetchError):
+        asyncio.run(run('/large'))
+
+
+def test_in_flight_requests_are_deduplicated():
+    """Concurrent callers with the same key share a single execution."""
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return key.upper()
+
+    async def run():
+        in_flight = InFlightRequests()
+        results = await asyncio.gather(*[in_flight.run(k, lambda k=k: work(k)) for k in ['a', 'a', 'b', 'a']])
+        return results, len(in_flight)
+
+    results, pending = asyncio.run(run())
+    assert results == ['A', 'A', 'B', 'A']
+    assert sorted(calls) == ['a', 'b']
+    assert pending == 0
+
+
+def test_in_flight_requests_start_reports_joined_keys():
+    """A key started by a caller is joined by the next ones until it completes."""
+    async def run():
+        in_flight = InFlightRequests()
+        future = asyncio.get_running_loop().create_future()
+        task, started = in_flight.start('a', lambda: future)
+        joined, started_again = in_flight.start('a', lambda: None)
+        waiter = asyncio.ensure_future(in_flight.run('a', lambda: None))
+        future.set_result('A')
+        return started, started_again, joined is task, await waiter, len(in_flight)
+
+    assert asyncio.run(run()) == (True, False, True, 'A', 0)
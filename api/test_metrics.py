@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from inference import StackedTopicScorer
+from metrics import CacheEventsExporter, MetricsMiddleware, TimedScorer, observe_stage
+from profiling import PROFILE_FILE_HEADER, ProfilingMiddleware, StackSampler
+
+
+def sample_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_observe_stage_times_the_block():
+    before = sample_value('topics_api_stage_duration_seconds_count', stage='test_stage')
+    with observe_stage('test_stage'):
+        time.sleep(0.01)
+    assert sample_value('topics_api_stage_duration_seconds_count', stage='test_stage') == before + 1
+    assert sample_value('topics_api_stage_duration_seconds_sum', stage='test_stage') >= 0.01
+
+
+def test_timed_scorer_records_every_section():
+    rng = np.random.default_rng(0)
+    scorer = StackedTopicScorer({'Section1': rng.normal(size=(5, 8)), 'Section7': rng.normal(size=(3, 8))},
+                                {'Section1': 1, 'Section7': 0})
+    docs = rng.normal(size=(4, 8))
+    timings = {}
+    topics, _ = TimedScorer(scorer).assign(docs)
+    np.testing.assert_array_equal(topics['Section1'], scorer.assign(docs, timings=timings)[0]['Section1'])
+    assert set(timings) == {'similarity', 'Section1', 'Section7'}
+    assert all(seconds >= 0 for seconds in timings.values())
+    assert sample_value('topics_api_transform_duration_seconds_count', section='Section7') >= 1
+
+
+def test_cache_events_exporter_adds_new_counts():
+    stats = Counter({'hits': 1})
+    exporter = CacheEventsExporter({'test_cache': lambda: stats})
+    exporter.sync()
+    stats['hits'] += 2
+    stats['misses'] += 1
+    exporter.sync()
+    exporter.sync()
+    assert sample_value('topics_api_cache_events_total', cache='test_cache', event='hits') == 3
+    assert sample_value('topics_api_cache_events_total', cache='test_cache', event='misses') == 1
+
+
+def busy(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_stack_sampler_collapses_the_stacks_of_other_threads():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy, args=(stop,), name='busy-thread')
+    thread.start()
+    sampler = StackSampler(interval=0.001).start()
+    time.sleep(0.05)
+    stacks = sampler.stop()
+    stop.set()
+    thread.join()
+    busy_stacks = [s for s in stacks if s.startswith('busy-thread;')]
+    assert busy_stacks
+    assert all(any(frame.startswith('busy (test_metrics.py:') for frame in s.split(';')) for s in busy_stacks)
+    assert not any(s.startswith('stack-sampler') for s in stacks)
+
+
+def test_middlewares_label_routes_and_write_profiles(tmp_path):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, folder=str(tmp_path), interval=0.001)
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get('/items/{item_id}')
+    def get_item(item_id: int):
+        time.sleep(0.02)
+        return {'item_id': item_id}
+
+    client = TestClient(app)
+    labels = {'method': 'GET', 'route': '/items/{item_id}', 'status': '200'}
+    before = sample_value('topics_api_requests_total', **labels)
+    assert PROFILE_FILE_HEADER not in client.get('/items/1').headers
+    response = client.get('/items/2', headers={'X-Profile': '1'})
+    assert response.json() == {'item_id': 2}
+    assert sample_value('topics_api_requests_total', **labels) == before + 2
+    with open(os.path.join(tmp_path, response.headers[PROFILE_FILE_HEADER])) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
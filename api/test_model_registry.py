@@ -0,0 +1,64 @@
+import sys
+import types
+
+import pytest
+
+from model_registry import ModelRegistry, TokenChunker
+
+
+class WordTokenizer:
+    """Tokenizer with a token per word, standing in for the tokenizer of the embedding model."""
+
+    def __init__(self):
+        self.vocabulary = {}
+
+    def __call__(self, text, add_special_tokens=True, **kwargs):
+        ids = [self.vocabulary.setdefault(w, len(self.vocabulary)) for w in text.split()]
+        return {'input_ids': [101] + ids + [102] if add_special_tokens else ids}
+
+    def decode(self, ids):
+        words = {i: w for w, i in self.vocabulary.items()}
+        return ' '.join(words[i] for i in ids)
+
+
+def test_token_chunker():
+    """Texts are cut into windows of tokens, without special tokens, the last one holding the remainder."""
+    text = ' '.join(f'w{i}' for i in range(10))
+    assert TokenChunker(WordTokenizer(), tokens_per_chunk=4).split_text(text) == ['w0 w1 w2 w3', 'w4 w5 w6 w7',
+                                                                                  'w8 w9']
+    assert TokenChunker(WordTokenizer(), tokens_per_chunk=5).split_text(text) == ['w0 w1 w2 w3 w4',
+                                                                                  'w5 w6 w7 w8 w9']
+    assert TokenChunker(WordTokenizer(), tokens_per_chunk=4, chunk_overlap=2).split_text(text)[:2] == [
+        'w0 w1 w2 w3', 'w2 w3 w4 w5']
+    assert TokenChunker(WordTokenizer()).split_text('') == []
+    with pytest.raises(ValueError):
+        TokenChunker(WordTokenizer(), tokens_per_chunk=4, chunk_overlap=4)
+
+
+def test_registry_loads_models_once(monkeypatch):
+    """The tokenizer is loaded alone until the embedding model is, whose tokenizer is then shared."""
+    loaded = []
+
+    class SentenceTransformer:
+        def __init__(self, name):
+            loaded.append(('embedding_model', name))
+            self.tokenizer = WordTokenizer()
+
+    class AutoTokenizer:
+        @staticmethod
+        def from_pretrained(name):
+            loaded.append(('tokenizer', name))
+            return WordTokenizer()
+
+    monkeypatch.setitem(sys.modules, 'sentence_transformers', types.SimpleNamespace(
+        SentenceTransformer=SentenceTransformer))
+    monkeypatch.setitem(sys.modules, 'transformers', types.SimpleNamespace(AutoTokenizer=AutoTokenizer))
+    registry = ModelRegistry('model')
+    assert registry.chunker.split_text('a b') == ['a b']
+    assert registry.chunker is registry.chunker
+    assert loaded == [('tokenizer', 'model')]
+    model = registry.load().embedding_model
+    assert registry.embedding_model is model
+    assert registry.chunker.tokenizer is model.tokenizer
+    assert loaded == [('tokenizer', 'model'), ('embedding_model', 'model')]
+    assert registry.load_times.keys() == {'tokenizer', 'embedding_model'}
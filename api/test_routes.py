@@ -1,11 +1,14 @@
-import requests
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from fastapi.testclient import TestClient
-import sqlite3
+import json
 
-from api.app import app
+import api.app
+from api.app import BATCH_MAX_URLS, app, asset_stores, url_topics_cache, urls_in_flight
 import pandas as pd
 
-client = TestClient(app)
+client = TestClient(app, headers={'API-Key': 'your-api-key'})
 
 
 def test_connection():
@@ -55,17 +58,179 @@ def test_get_topics_sentiment():
     assert text['frequency'] == freq
 
 
-def test_update_database(url: str = "https://www.bloomberg.com"):
-    """Tests if a given url is added to the database."""
-    host = 'http://127.0.0.1:8080'
-    keep_all = False
-    requests.get(f"{host}/get_topics_url", params={'url': url, 'keep_all': f'{keep_all}'})
+def test_stream_topics_sentiment():
+    """Tests the sentiment stream returns one JSON record per line for the requested section and topic."""
+    response = client.get("/get_topics_sentiment/stream", params={'section': 'Section1', 'topic': 0})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert records
+    assert all(r['Section'] == 'Section1' and r['Topic'] == 0 for r in records)
+
+
+def test_page_topics_time():
+    """Tests the pages of the topics over time follow each other until the last one."""
+    limit = 500
+    response = client.get("/get_topics_time/page", params={'section': 'Section7', 'limit': limit})
+    assert response.status_code == 200
+    page = response.json()
+    records = page['records']
+    while page['next_cursor'] is not None:
+        assert len(page['records']) == limit
+        response = client.get("/get_topics_time/page",
+                              params={'section': 'Section7', 'limit': limit, 'cursor': page['next_cursor']})
+        assert response.status_code == 200
+        page = response.json()
+        records += page['records']
+    assert len(records) == len(asset_stores.topics_time.frames['Section7'])
+    response = client.get("/get_topics_time/page", params={'section': 'Section8'})
+    assert response.status_code == 404
+    response = client.get("/get_topics_time/page", params={'section': 'Section7', 'cursor': 'not-a-cursor'})
+    assert response.status_code == 422
+
+
+def test_invalid_time_range():
+    """Tests a start or end that is not a date is rejected rather than failing in the API."""
+    for path in ("/get_topics_time/page", "/get_topics_sentiment/stream"):
+        response = client.get(path, params={'section': 'Section1', 'start': 'not-a-date'})
+        assert response.status_code == 422
+    response = client.get("/get_topics_time/page", params={'section': 'Section1', 'start': '2015-01-01T00:00:00Z',
+                                                           'end': '2016'})
+    assert response.status_code == 200
+
+
+def test_section_topics_time():
+    """Tests the section series only hold the requested topics, in the compact layout."""
+    response = client.get("/sections/Section1/topics_time", params={'freq': '1Y', 'top_n': 15, 'outliers': False})
+    assert response.status_code == 200
+    payload = response.json()
+    assert set(payload['data']) == {'Timestamp', 'Topic', 'Frequency', 'Words'}
+    assert all(0 <= t < 15 for t in payload['data']['Topic'])
+    response = client.get("/sections/Section1/topics_sentiment", params={'top_n': 15})
+    assert response.status_code == 200
+    assert set(response.json()['data']) == {'Timestamp', 'Topic', 'mean', 'median'}
+    response = client.get("/sections/Section8/topics_time")
+    assert response.status_code == 404
+
+
+def test_search_topics():
+    """Tests the search returns k topics of the requested sections, most similar first, with their trend."""
+    response = client.get("/search_topics", params={'q': 'LIBOR transition risk', 'k': 5, 'trend': True})
+    assert response.status_code == 200
+    topics = response.json()['topics']
+    assert len(topics) == 5
+    scores = [t['score'] for t in topics]
+    assert scores == sorted(scores, reverse=True)
+    assert all(t['topic_id'] >= 0 and t['name'].startswith(f"{t['topic_id']}_") for t in topics)
+    assert set(topics[0]['trend']) == {'Timestamp', 'Frequency'}
+    response = client.get("/search_topics", params={'q': 'LIBOR', 'sections': ['Section1A', 'Section7']})
+    assert {t['section'] for t in response.json()['topics']} <= {'Section1A', 'Section7'}
+    response = client.get("/search_topics", params={'q': 'LIBOR', 'sections': 'Section8'})
+    assert response.status_code == 404
+
+
+def test_get_topics_urls_reports_errors():
+    """Tests the batch endpoint reports a per-URL error status for pages that cannot be fetched."""
+    url = 'http://127.0.0.1:1/unreachable'
+    response = client.post("/get_topics_urls", json={'urls': [url, url]})
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert list(results) == [url]
+    assert results[url]['status'] == 'error'
+    assert len(urls_in_flight) == 0
+    response = client.post("/get_topics_urls", json={'urls': [f'{url}/{i}' for i in range(BATCH_MAX_URLS + 1)]})
+    assert response.status_code == 422
+
+
+def test_get_urls_by_topic():
+    """Tests the reverse lookup returns the topic name and the URLs ordered by number of chunks."""
+    response = client.get("/get_urls_by_topic", params={'section': 'Section1', 'topic_id': 3})
+    assert response.status_code == 200
+    text = response.json()
+    assert text['name'].startswith('3_')
+    counts = [u['count'] for u in text['urls']]
+    assert counts == sorted(counts, reverse=True)
+    response = client.get("/get_urls_by_topic", params={'section': 'Section1', 'topic_id': 10 ** 6})
+    assert response.status_code == 404
+
+
+def test_reload_assets():
+    """Tests the stores are only reloaded when the accumulators change."""
+    response = client.post("/reload_assets")
+    assert response.status_code == 200
+    assert response.json()['reloaded'] is False
+
+
+def test_get_cache_stats():
+    """Tests the cache counters are returned, with the hit rate of the chunk cache."""
+    response = client.get("/get_cache_stats")
+    assert response.status_code == 200
+    text = response.json()
+    assert 'url_topics' in text
+    assert 0 <= text['chunk_embeddings']['hit_rate'] <= 1
+
+
+def test_metrics():
+    """Tests the metrics are exported in the Prometheus text format, per route template."""
+    client.get("/get_topics_time")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'topics_api_requests_total{method="GET",route="/get_topics_time",status="200"}' in response.text
+    assert 'topics_api_cache_events_total' in response.text
+    # Prometheus scrapes the metrics without the API key the other routes need
+    assert TestClient(app).get("/metrics").status_code == 200
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Long enough to be split into several chunks, assigned the same topics
+        body = b'<html><body>' + b'<p>Our results of operations depend on interest rates and credit risk.</p>' * 200 + \
+            b'</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_update_database():
+    """Tests if a given url is added to the database, with a local server standing in for the page."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/filing-{time.time_ns()}'
+    try:
+        response = client.get("/get_topics_url", params={'url': url, 'keep_all': 'false'})
+    finally:
+        server.shutdown()
+    assert response.status_code == 200
 
     # Check database was updated
-    conn = sqlite3.connect('db/topics-url-db.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM data WHERE url="https://www.bloomberg.com"')
-    result = cursor.fetchone()
-    assert result is not None
-    assert result[0] == url
-    conn.close()
+    assert url_topics_cache.get(url) is not None
+    # Unless keep_all, every topic is returned once
+    topics = client.get("/get_topics_url", params={'url': url}).json()
+    assert any(len(set(names)) < len(names) for names in topics.values())
+    assert response.json() == {s: list(dict.fromkeys(names)) for s, names in topics.items()}
+    assert all(len(set(names)) == len(names) for names in response.json().values())
+
+
+def test_get_topics_urls_reports_inference_errors(monkeypatch):
+    """Tests an error of the topic extraction is reported for the URLs of the batch rather than failing it."""
+    def fail(docs_chunks):
+        raise RuntimeError('inference failed')
+
+    monkeypatch.setattr(api.app, 'assign_topics', fail)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url, unreachable = f'http://127.0.0.1:{server.server_port}/filing-{time.time_ns()}', 'http://127.0.0.1:1/page'
+    try:
+        response = client.post("/get_topics_urls", json={'urls': [url, unreachable]})
+    finally:
+        server.shutdown()
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert results[url] == {'status': 'error', 'detail': 'Internal error while extracting the topics'}
+    assert results[unreachable]['detail'].startswith(f'Could not fetch {unreachable}')
+    assert url_topics_cache.get(url) is None and len(urls_in_flight) == 0
@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+from safetensors.numpy import save_file
+
+from quantize_topics import quantize_model
+from topic_index import TopicIndex, load_safetensors
+
+
+def make_model(path, embeddings):
+    """Save a minimal model folder with the files written by BERTopic's safetensors serialization."""
+    save_file({'topic_embeddings': embeddings}, str(path / 'topic_embeddings.safetensors'))
+    labels = {str(t): f'{t}_word' for t in range(-1, embeddings.shape[0] - 1)}
+    with open(path / 'topics.json', 'w') as f:
+        json.dump({'_outliers': 1, 'topic_labels': labels, 'topic_sizes': {k: 1 for k in labels},
+                   'topic_representations': {k: [['word', 0.2], ['other word', 0.1]] for k in labels}}, f)
+
+
+def test_load_safetensors_is_memory_mapped(tmp_path):
+    """Tensors are mapped read-only from the file and hold the saved values."""
+    embeddings = np.random.default_rng(0).normal(size=(6, 4)).astype(np.float32)
+    save_file({'topic_embeddings': embeddings}, str(tmp_path / 'e.safetensors'))
+    tensors = load_safetensors(str(tmp_path / 'e.safetensors'))
+    assert isinstance(tensors['topic_embeddings'], np.memmap)
+    assert not tensors['topic_embeddings'].flags.writeable
+    np.testing.assert_array_equal(tensors['topic_embeddings'], embeddings)
+
+
+def test_topic_index_transform(tmp_path):
+    """Each embedding is assigned the topic it is closest to, shifted by the outlier topic."""
+    embeddings = np.eye(5, dtype=np.float32)
+    make_model(tmp_path, embeddings)
+    index = TopicIndex(str(tmp_path))
+    topics, scores = index.transform(embeddings[[3, 0, 1]] * 2)
+    np.testing.assert_array_equal(topics, [2, -1, 0])
+    np.testing.assert_allclose(scores, 1)
+    assert index.topic_names[2] == '2_word'
+    assert index.topic_words[2] == 'word, other word'
+
+
+def test_topic_index_loads_quantized_embeddings(tmp_path):
+    """The int8 embeddings written next to the model are loaded with their scales and assign the same topics."""
+    embeddings = np.random.default_rng(0).normal(size=(8, 16)).astype(np.float32)
+    make_model(tmp_path, embeddings)
+    quantize_model(str(tmp_path), 'int8')
+    index = TopicIndex(str(tmp_path), 'int8')
+    assert index.embeddings.dtype == np.int8 and index.scales.shape == (8,)
+    np.testing.assert_allclose(index.normalized_embeddings, TopicIndex(str(tmp_path)).normalized_embeddings,
+                               atol=1e-2)
+    topics, _ = index.transform(embeddings)
+    np.testing.assert_array_equal(topics, np.arange(8) - 1)
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from inference import StackedTopicScorer
+
+pytest.importorskip('faiss')
+from topic_search import HnswTopicSearch  # noqa: E402
+
+
+def test_hnsw_search_finds_the_exact_top_k():
+    """On a small model the approximate search returns the topics of the exact search."""
+    rng = np.random.default_rng(0)
+    scorer = StackedTopicScorer({'Section1': rng.normal(size=(200, 32)), 'Section7': rng.normal(size=(300, 32))},
+                                {'Section1': 1, 'Section7': 1})
+    search = HnswTopicSearch(scorer)
+    for query in rng.normal(size=(10, 32)):
+        exact = scorer.top_k(query, 5)
+        found = search.top_k(query, 5)
+        assert [f[:2] for f in found] == [e[:2] for e in exact]
+        np.testing.assert_allclose([f[2] for f in found], [e[2] for e in exact], rtol=1e-5)
+        assert {f[0] for f in search.top_k(query, 5, sections=['Section7'])} == {'Section7'}
+        assert all(f[1] >= 0 for f in found)
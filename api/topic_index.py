@@ -0,0 +1,97 @@
+"""Lightweight, read-only view of a topic model saved by BERTopic with safetensors serialization."""
+import json
+import os
+import struct
+from typing import Dict, Tuple
+
+import numpy as np
+
+from inference import dequantize_rows, normalize_rows
+
+# safetensors dtype codes to numpy dtypes
+SAFETENSORS_DTYPES = {'F64': np.float64, 'F32': np.float32, 'F16': np.float16, 'I64': np.int64, 'I32': np.int32,
+                      'I16': np.int16, 'I8': np.int8, 'U8': np.uint8}
+
+
+def load_safetensors(path: str) -> Dict[str, np.ndarray]:
+    """Memory-map every tensor of a safetensors file as a read-only numpy array.
+
+    The file layout is an 8 byte little-endian header size, a JSON header and the raw tensor data, so each
+    tensor can be mapped in place without reading it into memory.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .safetensors file.
+
+    Returns
+    -------
+    dict of {str : np.memmap}
+        Tensors of the file by name.
+
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop('__metadata__', None)
+    tensors = {}
+    for name, info in header.items():
+        start, _ = info['data_offsets']
+        tensors[name] = np.memmap(path, dtype=SAFETENSORS_DTYPES[info['dtype']], mode='r',
+                                  offset=8 + header_size + start, shape=tuple(info['shape']))
+    return tensors
+
+
+def embeddings_file(dtype: str = 'float32') -> str:
+    """Name of the file of the topic embeddings in ``dtype`` in a model folder."""
+    return 'topic_embeddings.safetensors' if dtype == 'float32' else f'topic_embeddings.{dtype}.safetensors'
+
+
+class TopicIndex:
+    """Assign topics by cosine similarity against the saved topic embeddings of a BERTopic model.
+
+    Only ``topic_embeddings.safetensors`` and ``topics.json`` are read, so neither BERTopic nor its UMAP,
+    HDBSCAN and plotting dependencies are imported. The assignment is the one ``BERTopic.transform`` uses for
+    models saved without their dimensionality reduction and clustering models.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the saved model, e.g. ``topic_models/topic_models_Section1``.
+    dtype : str, optional
+        ``float32`` for the embeddings saved by BERTopic, or ``float16`` or ``int8`` for the quantized unit
+        embeddings written next to them by ``quantize_topics.py``, loaded instead.
+
+    """
+
+    def __init__(self, path: str, dtype: str = 'float32'):
+        self.path = path
+        self.dtype = dtype
+        tensors = load_safetensors(os.path.join(path, embeddings_file(dtype)))
+        self.embeddings = tensors['topic_embeddings']
+        # Scale of every topic of int8 embeddings
+        self.scales = tensors.get('scales')
+        with open(os.path.join(path, 'topics.json')) as f:
+            topics = json.load(f)
+        self.outliers = topics['_outliers']
+        self.topic_names = {int(k): v for k, v in topics['topic_labels'].items()}
+        self.topic_sizes = {int(k): v for k, v in topics['topic_sizes'].items()}
+        # Top 5 words of every topic, joined as in the Words column of BERTopic.topics_over_time
+        self.topic_words = {int(k): ', '.join(w for w, _ in v[:5]) for k, v in topics['topic_representations'].items()}
+        self._normalized = None
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def normalized_embeddings(self) -> np.ndarray:
+        """Unit norm topic embeddings, computed on first use."""
+        if self._normalized is None:
+            self._normalized = normalize_rows(dequantize_rows(self.embeddings, self.scales))
+        return self._normalized
+
+    def transform(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the topic id and cosine similarity of the closest topic to each document embedding."""
+        similarity = normalize_rows(embeddings) @ self.normalized_embeddings.T
+        best = similarity.argmax(axis=1)
+        return best - self.outliers, similarity[np.arange(similarity.shape[0]), best]
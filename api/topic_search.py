@@ -0,0 +1,58 @@
+"""Approximate nearest topic search, for topic models too large for the exact search of ``StackedTopicScorer``."""
+import heapq
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from inference import StackedTopicScorer, normalize_rows
+
+
+class HnswTopicSearch:
+    """Search the topics most similar to a query in an HNSW graph of the topic embeddings of every section.
+
+    Every section has its own graph over its normalised topic embeddings, searched by inner product, so a search can
+    be restricted to some sections without filtering the results of the others. It answers ``top_k`` like
+    ``StackedTopicScorer.top_k``, whose exact search is fast enough for the current models of a few thousand topics.
+
+    Parameters
+    ----------
+    scorer : StackedTopicScorer
+        Scorer holding the stacked topic embeddings.
+    neighbors : int, optional
+        Number of neighbors of every node of the graphs.
+    ef_search : int, optional
+        Size of the candidate list of a search. Larger values trade speed for recall.
+
+    """
+
+    def __init__(self, scorer: StackedTopicScorer, neighbors: int = 32, ef_search: int = 64):
+        if faiss is None:
+            raise ImportError('The approximate topic search needs faiss. Install faiss-cpu')
+        self.scorer = scorer
+        self.sections = scorer.sections
+        self.indexes = {}
+        for s in self.sections:
+            index = faiss.IndexHNSWFlat(scorer.matrix.shape[0], neighbors, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = ef_search
+            index.add(np.ascontiguousarray(scorer.section_embeddings(s)))
+            self.indexes[s] = index
+
+    def top_k(self, embedding: np.ndarray, k: int, sections: Optional[List[str]] = None,
+              outliers: bool = False) -> List[Tuple[str, int, float]]:
+        """Find approximately the ``k`` topics most similar to an embedding, as ``StackedTopicScorer.top_k``."""
+        query = normalize_rows(np.reshape(embedding, (1, -1)))
+        found = []
+        for s in self.sections:
+            if sections is not None and s not in sections:
+                continue
+            n_outliers = self.scorer.outliers[s]
+            # One more neighbor is searched in case the outlier topic is found and dropped
+            scores, rows = self.indexes[s].search(query, min(k + n_outliers, self.indexes[s].ntotal))
+            found.extend((float(score), s, int(row) - n_outliers) for score, row in zip(scores[0], rows[0])
+                         if row >= 0 and (outliers or row >= n_outliers))
+        return [(s, topic, score) for score, s, topic in heapq.nlargest(k, found, key=lambda f: f[0])]
@@ -0,0 +1,101 @@
+"""Build the figures of the topic models shown by the dashboard and save them to disk.
+
+The word scores, hierarchy and intertopic distance figures of every section only depend on the saved topic models,
+but need the models loaded with BERTopic and a clustering or a dimensionality reduction of the topic embeddings.
+They are built once and written as plotly JSON to ``figures/<section>/<figure>.json``, with a manifest recording the
+fingerprint of the model each section was built from. Sections whose model did not change are skipped.
+
+    python build_figures.py
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import plotly.io as pio
+
+from config import SECTIONS_TITLE
+
+FIGURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'figures')
+FIGURES = ['barchart', 'hierarchy', 'intertopic']
+# Files of a saved topic model the figures are built from. The quantized embeddings written next to them by
+# api/quantize_topics.py are left out, so quantizing a model does not invalidate its figures
+FINGERPRINT_FILES = ['topic_embeddings.safetensors', 'topics.json', 'config.json']
+
+
+def model_fingerprint(model_path: str, section: str) -> str:
+    """Hash of the ``FINGERPRINT_FILES`` of a saved topic model, so figures are rebuilt when it is saved again."""
+    digest = hashlib.sha256()
+    folder = os.path.join(model_path, f'topic_models_{section}')
+    for name in FINGERPRINT_FILES:
+        with open(os.path.join(folder, name), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def figure_path(section: str, name: str, figures_path: str = FIGURES_PATH) -> str:
+    return os.path.join(figures_path, section, f'{name}.json')
+
+
+def read_manifest(figures_path: str = FIGURES_PATH) -> dict:
+    try:
+        with open(os.path.join(figures_path, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def stale_sections(model_path: str, figures_path: str = FIGURES_PATH) -> list:
+    """Sections with a missing figure or figures built from another version of their model."""
+    manifest = read_manifest(figures_path)
+    return [s for s in SECTIONS_TITLE
+            if manifest.get(s) != model_fingerprint(model_path, s)
+            or not all(os.path.exists(figure_path(s, name, figures_path)) for name in FIGURES)]
+
+
+def build_section(model_path: str, section: str, figures_path: str = FIGURES_PATH):
+    """Load the topic model of a section with BERTopic and write its figures."""
+    from bertopic import BERTopic
+
+    topic_model = BERTopic.load(os.path.join(model_path, f'topic_models_{section}'), embedding_model='all-MiniLM-L6-v2')
+    fig_top = topic_model.visualize_barchart(title=f'<b>Topic word scores: {section} <b>')
+    fig_top.update_layout(height=800, width=1200)
+    fig_hier = topic_model.visualize_hierarchy(top_n_topics=50, title=f'<b>Topic Hierarchical structure <b>')
+    fig_dist = topic_model.visualize_topics(title=f'<b>Intertopic Distance Map: {section} <b>')
+    fig_dist.update_layout(height=800, width=1200)
+    fig_dist.add_annotation(x=-10, y=-30,
+                            text="Text annotation without arrow",
+                            showarrow=False
+                            )
+    os.makedirs(os.path.join(figures_path, section), exist_ok=True)
+    for name, fig in zip(FIGURES, [fig_top, fig_hier, fig_dist]):
+        pio.write_json(fig, figure_path(section, name, figures_path))
+
+
+def build_figures(model_path: str, figures_path: str = FIGURES_PATH, force: bool = False) -> list:
+    """Build the figures of the sections that are stale, or of all of them if ``force``. Return the sections built."""
+    sections = list(SECTIONS_TITLE) if force else stale_sections(model_path, figures_path)
+    manifest = read_manifest(figures_path)
+    for section in sections:
+        print(f'Building the figures of {section}')
+        build_section(model_path, section, figures_path)
+        manifest[section] = model_fingerprint(model_path, section)
+        # The manifest is updated after every section, so an interrupted build keeps the sections already built
+        with open(os.path.join(figures_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    return sections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-path', default=os.path.join('..', 'topic_models'))
+    parser.add_argument('--figures-path', default=FIGURES_PATH)
+    parser.add_argument('--force', action='store_true', help='Rebuild the figures of every section')
+    args = parser.parse_args()
+    built = build_figures(args.model_path, args.figures_path, args.force)
+    print(f'{len(built)} sections built, figures in {args.figures_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,14 @@
 This is to show the three topic models and their inttertopic distances
 """
 import json
+import time
+from functools import lru_cache
 
+import numpy as np
 import requests
 import pandas as pd
 import os
 
-from bertopic import BERTopic
 from collections import Counter
 
 import dash
@@ -17,6 +19,7 @@ from dash.dependencies import Input, Output
 import plotly.graph_objects as go
 import plotly.express as px
 from config import SECTIONS_DESCRIPTION, DOCKER, SECTIONS_TITLE, FED_TOPIC_MAPPINGS
+from build_figures import build_figures, figure_path
 import dash_loading_spinners as dls
 
 # Change the URL according to whether we are in docker or not (this can be made better)
@@ -29,9 +32,20 @@ if os.environ.get('TOPIC_MODELS_PATH') is not None:
 else:
     model_path = '../topic_models'
 
-topic_models = {s: BERTopic.load(os.path.join(model_path, f'topic_models_{s}'), embedding_model='all-MiniLM-L6-v2') for
-                s in
-                SECTIONS_TITLE}
+# Section series are memoized, so switching tabs or sections does not download them again. They are fetched again
+# every CACHE_SECONDS, to follow the updates of the assets
+CACHE_SECONDS = 300
+
+# The figures of the topic models are built by build_figures.py, only missing or outdated ones are built here
+build_figures(model_path)
+
+
+@lru_cache(maxsize=None)
+def load_figure(section, name):
+    """Return a figure saved by build_figures.py, read from disk once."""
+    with open(figure_path(section, name)) as f:
+        return json.load(f)
+
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.layout = html.Div([
@@ -75,29 +89,39 @@ app.layout = html.Div([
 
 
 
+@lru_cache(maxsize=64)
+def _fetch_section_series(endpoint, section, params, period):
+    payload = requests.get(url=os.path.join(URL_API, 'sections', section, endpoint), params=dict(params)).json()
+    df = pd.DataFrame(payload['data'])
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    # Categorical columns are sent as codes into their distinct values
+    for column, categories in payload['categories'].items():
+        df[column] = np.asarray(categories, dtype=object)[df[column].to_numpy(dtype=int)]
+    df['Name'] = df['Topic'].astype(str).map(payload['names'])
+    return df
+
+
+def section_series(endpoint, section, **params):
+    """Return the plot-ready series of a section from the api, memoized for CACHE_SECONDS."""
+    # The frame is copied, so callbacks can modify it without changing the memoized one
+    return _fetch_section_series(endpoint, section, tuple(sorted(params.items())),
+                                 int(time.time() // CACHE_SECONDS)).copy()
+
+
 @app.callback(
     Output('topic-model-plot', 'figure'),
         Output('section_description', 'children'),
     Output('topic-hierarchical-plot', 'figure'),
             Input('section-dropdown', 'value'))
 def display_topic_model(section):
-    fig_top = topic_models[section].visualize_barchart(title=f'<b>Topic word scores: {section} <b>')
-    fig_hier = topic_models[section].visualize_hierarchy(top_n_topics=50, title=f'<b>Topic Hierarchical structure <b>')
-    fig_top.update_layout(height=800, width=1200)
-    return fig_top, SECTIONS_DESCRIPTION[section], fig_hier
+    return load_figure(section, 'barchart'), SECTIONS_DESCRIPTION[section], load_figure(section, 'hierarchy')
 
 
 @app.callback(
     Output('topic-interdistance-plot', 'figure'),
     Input('section-dropdown-1', 'value'))
 def display_intertopic_dist(section):
-    fig = topic_models[section].visualize_topics(title=f'<b>Intertopic Distance Map: {section} <b>')
-    fig.update_layout(height=800, width=1200)
-    fig.add_annotation(x=-10, y=-30,
-                       text="Text annotation without arrow",
-                       showarrow=False
-                       )
-    return fig
+    return load_figure(section, 'intertopic')
 
 
 @app.callback(
@@ -105,11 +129,10 @@ def display_intertopic_dist(section):
     Input('section-dropdown-time', 'value'))
 def display_topic_time(section):
     TOP_N = 15
-    data = requests.get(url=os.path.join(URL_API, 'get_topics_time'), params={'top_n': f'{TOP_N}'}).json()
-    df = pd.read_json(data[section], orient='records')
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-    fig = topic_models[section].visualize_topics_over_time(df)
+    df = section_series('topics_time', section, top_n=TOP_N)
+    fig = px.line(data_frame=df, x='Timestamp', y='Frequency', color='Name', hover_data=['Words'])
     fig.update_layout(
+        title='<b>Topics over Time</b>',
         height=800, width=1200
     )
     return fig
@@ -122,13 +145,11 @@ def display_topic_time(section):
 def display_topic_time_sentiment(section, adjust_flag):
     TOP_N = 15
     FREQ = '1Y'
-    data = requests.get(url=os.path.join(URL_API, 'get_topics_sentiment'), params={'freq': f'{FREQ}'}).json()
-    df = pd.read_json(data[section], orient='records')
-    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    df = section_series('topics_sentiment', section, freq=FREQ, top_n=TOP_N, outliers=False)
     if adjust_flag:
         df['Timestamp'] = pd.to_datetime(df['Timestamp'].dt.year - 1, format='%Y')
     df = df.set_index('Timestamp')
-    fig = px.line(data_frame=df.loc[df.Topic.isin(range(0, TOP_N)), :], y='mean', color='Name')
+    fig = px.line(data_frame=df, y='mean', color='Name')
     fig.update_layout(
         title='Topic Sentiment over time',
         xaxis_title='Snapshot Date',